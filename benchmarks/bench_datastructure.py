@@ -0,0 +1,33 @@
+"""
+Measures what passing the datastructure costs when the result dictionary is large.
+
+Every method is passed the datastructure (`pass_datastructure=True`).
+Compares the default copy (`dict(result)`) against the read-only view (`copy_datastructure=False`).
+
+Usage:
+
+    python benchmarks/bench_datastructure.py [number of methods] [starting keys]
+"""
+import sys
+import timeit
+
+from synthetic import make_registry
+
+
+def main(methods=50, keys=1000):
+    registry, FLAGS = make_registry(methods, depth=methods)
+    start = dict(('key{}'.format(ix), ix) for ix in range(keys))
+
+    for copy_datastructure in (True, False):
+        def build_out():
+            registry.build_out(
+                FLAGS.ALL, start_with=dict(start), pass_datastructure=True, copy_datastructure=copy_datastructure)
+
+        number = 200
+        seconds = min(timeit.repeat(build_out, number=number, repeat=5)) / number
+        print('copy_datastructure={:<5}  {} methods, {} keys: {:8.1f} us/build_out'.format(
+            str(copy_datastructure), methods, keys, seconds * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,129 @@
+"""
+Benchmark suite for FlagRegistry and Flags.
+
+Measures calls per second and peak memory allocated per call for `build_out()`, the dependency resolution
+helpers and flag operations, over synthetic registries of different sizes, chain depths, fan-out and
+number of return values.
+
+Usage:
+
+    python benchmarks/run.py                   # run and print the results
+    python benchmarks/run.py --save            # also save them as the baseline
+    python benchmarks/run.py --compare         # fail if a benchmark is slower than the baseline
+    python benchmarks/run.py --filter build_out
+
+Baselines are only comparable on the same machine and Python version, so `--compare` should be run
+against a baseline saved from the parent commit on the same host.
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+
+from synthetic import make_registry
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+SHAPES = [
+    # name, methods, depth, fan_out, returns
+    ('small', 10, 1, 1, 1),
+    ('wide', 200, 1, 1, 1),
+    ('deep', 100, 100, 1, 1),
+    ('fan_out', 100, 10, 4, 1),
+    ('multi_return', 50, 5, 2, 4),
+]
+
+
+def cases():
+    """
+    Yields (name, fn) for every benchmark.
+    """
+    for shape, methods, depth, fan_out, returns in SHAPES:
+        registry, FLAGS = make_registry(methods, depth, fan_out, returns)
+        leaf = getattr(FLAGS, 'M{}_0'.format(methods - 1))
+        method = list(registry.r.keys())[-1]
+
+        yield 'build_out[{}]'.format(shape), lambda r=registry, f=FLAGS.ALL: r.build_out(f)
+        yield 'build_out_leaf[{}]'.format(shape), lambda r=registry, f=leaf: r.build_out(f)
+        yield 'build_out_view[{}]'.format(shape), (
+            lambda r=registry, f=FLAGS.ALL: r.build_out(f, pass_datastructure=True, copy_datastructure=False))
+        frozen, _ = make_registry(methods, depth, fan_out, returns)
+        frozen.freeze()
+        yield 'build_out_frozen[{}]'.format(shape), lambda r=frozen, f=FLAGS.ALL: r.build_out(f)
+        yield 'compile_plan[{}]'.format(shape), lambda r=registry, f=FLAGS.ALL: r._compile_plan(f)
+        yield '_validate_flags[{}]'.format(shape), lambda r=registry, f=leaf: r._validate_flags(f)
+        yield '_calculate_dependency_flag[{}]'.format(shape), (
+            lambda r=registry, m=method: r._calculate_dependency_flag(m))
+
+    registry, FLAGS = make_registry(20)
+    yield 'Flags.__getattr__', lambda F=FLAGS: F.M7_0
+    yield 'Flags.combine', lambda F=FLAGS: F.M1_0 | F.M2_0 | F.M3_0
+
+
+def measure(fn, min_time=0.2):
+    """
+    :return calls_per_second, bytes_per_call: Best of three timing runs, and the peak memory allocated by one call.
+    """
+    fn()
+    timer = timeit.Timer(fn)
+    number, elapsed = timer.autorange()
+    while elapsed < min_time:
+        number *= 2
+        elapsed = timer.timeit(number)
+    best = min([elapsed] + timer.repeat(repeat=2, number=number))
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return number / best, peak - before
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--save', action='store_true', help='save the results as the baseline')
+    parser.add_argument('--compare', action='store_true', help='compare against the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown (default 0.2 = 20%%)')
+    parser.add_argument('--filter', default='', help='only run benchmarks containing this string')
+    parser.add_argument('--baseline', default=BASELINE, help='baseline file')
+    options = parser.parse_args(argv)
+
+    baseline = dict()
+    if options.compare:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+
+    results = dict()
+    regressions = list()
+    print('{:<44} {:>14} {:>12} {:>10}'.format('benchmark', 'calls/s', 'bytes/call', 'vs base'))
+    for name, fn in cases():
+        if options.filter not in name:
+            continue
+        calls_per_second, allocated = measure(fn)
+        results[name] = dict(calls_per_second=calls_per_second, bytes_per_call=allocated)
+
+        change = ''
+        if name in baseline:
+            ratio = calls_per_second / baseline[name]['calls_per_second']
+            change = '{:+.0%}'.format(ratio - 1)
+            if ratio < 1 - options.tolerance:
+                regressions.append(name)
+                change += ' !'
+        print('{:<44} {:>14,.0f} {:>12,} {:>10}'.format(name, calls_per_second, allocated, change))
+
+    if options.save:
+        with open(options.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    if regressions:
+        print('\n{} benchmark(s) slower than the baseline: {}'.format(len(regressions), ', '.join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,46 @@
+"""
+Synthetic FlagRegistry instances for the benchmarks.
+"""
+from flagpole import FlagRegistry, Flags
+
+
+def make_registry(methods=20, depth=1, fan_out=1, returns=1):
+    """
+    Builds a registry of `methods` registered methods arranged in dependency chains.
+
+    The methods are laid out in layers of `depth`.  Every method in a layer after the first depends on
+    `fan_out` methods of the layer before it, so `depth=1` gives independent methods and a large
+    `depth` gives long chains.  Every method has `returns` return values, each with its own flag and key.
+
+    :return registry, FLAGS: The registry and its Flags.
+    """
+    names = ['M{}_{}'.format(ix, rtv_ix) for ix in range(methods) for rtv_ix in range(returns)]
+    FLAGS = Flags(*names)
+    registry = FlagRegistry()
+
+    per_layer = max(1, methods // depth)
+    for ix in range(methods):
+        layer = ix // per_layer
+        depends_on = 0
+        if layer:
+            previous_layer = range((layer - 1) * per_layer, layer * per_layer)
+            for offset in range(fan_out):
+                upstream = previous_layer[(ix + offset) % len(previous_layer)]
+                depends_on |= getattr(FLAGS, 'M{}_0'.format(upstream))
+
+        keys = tuple('M{}_{}'.format(ix, rtv_ix) for rtv_ix in range(returns))
+        flags = tuple(getattr(FLAGS, key) for key in keys)
+        registry.register(
+            flag=flags if returns > 1 else flags[0],
+            depends_on=depends_on,
+            key=keys if returns > 1 else keys[0])(_make_method(ix, returns))
+    return registry, FLAGS
+
+
+def _make_method(ix, returns):
+    retval = tuple(range(returns)) if returns > 1 else ix
+
+    def method(*args, **kwargs):
+        return retval
+    method.__name__ = 'method_{}'.format(ix)
+    return method
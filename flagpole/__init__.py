@@ -1,12 +1,242 @@
-from collections import defaultdict
+import functools
+import heapq
+import numbers
+import re
+import threading
+import time
+from collections import defaultdict, OrderedDict
+
+from flagpole._codegen import generate_build
+from flagpole.cache import SingleFlight, TTLCache, make_key
+from flagpole.lazy import LazyResult
+from flagpole.record import Record, record_class
+from flagpole.limits import Limit, Retry
+from flagpole.stats import LatencyEstimates, MethodStats, Observer, _method_name, _timer
+from flagpole.store import SQLiteStore, Store
+from flagpole.trace import Span, Tracer
+
+try:
+    from types import MappingProxyType
+except ImportError:  # Python 2
+    MappingProxyType = None
+
+
+# Key under which a partial build out lists the flags and keys which were not produced.
+INCOMPLETE = '_incomplete'
+
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def _get_process_pool(max_workers=None):
+    """
+    :return: The ProcessPoolExecutor shared by every registry, created on first use.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            from concurrent.futures import ProcessPoolExecutor
+            _process_pool = ProcessPoolExecutor(max_workers=max_workers)
+        return _process_pool
+
+
+def _call_with_timeout(timeout, fn, *args, **kwargs):
+    """
+    Calls `fn` on a thread of its own and waits at most `timeout` seconds for its return value.
+
+    :raises concurrent.futures.TimeoutError: If it takes longer.  The thread is left to finish on its own.
+    """
+    from concurrent.futures import Future
+
+    future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    return future.result(timeout)
+
+
+class CircularDependencyError(Exception):
+    """
+    Raised when the methods in a FlagRegistry depend on each other in a cycle.
+
+    :param methods: The methods making up the cycle, with the first method repeated at the end.
+    """
+    def __init__(self, methods=None):
+        self.methods = methods or list()
+        message = 'Circular Dependency Error.'
+        if self.methods:
+            message = '{} {}'.format(
+                message, ' -> '.join(getattr(m, '__name__', repr(m)) for m in self.methods))
+        super(CircularDependencyError, self).__init__(message)
+
+
+class _Step(object):
+    """
+    A single method call within a compiled execution plan.
+
+    :param method: The @FlagRegistry.register() decorated method.
+    :param method_flag: Combination of all flags associated with this method.
+    :param method_dependencies: Combination of all dependencies associated with this method.
+    :param slots: tuple of (key, rtv_ix) pairs for the requested return values.
+    :param multi: True if the method has multiple return values.
+    :param requires: tuple of plan indices of the steps this step directly depends on.
+    :param options: dict of the extra keyword arguments the method was registered with.
+    :param requested_flags: Combination of the flags of the requested return values.
+    """
+    __slots__ = (
+        'method', 'method_flag', 'method_dependencies', 'slots', 'multi', 'requires', 'options', 'requested_flags')
+
+    def __init__(self, method, method_flag, method_dependencies, slots, multi, requires=(), options=None,
+                 requested_flags=0):
+        self.method = method
+        self.method_flag = method_flag
+        self.method_dependencies = method_dependencies
+        self.slots = slots
+        self.multi = multi
+        self.requires = requires
+        self.options = options or dict()
+        self.requested_flags = requested_flags
+
+
+class _Plan(object):
+    """
+    The compiled form of a `build_out()` call for one `flags` value.
+
+    :param flags: The user-supplied flags with any dependency flags added.
+    :param steps: list of _Step, in the order they must be executed.
+    """
+    __slots__ = ('flags', 'steps', 'dependents', 'timed', 'build', '_ancestors', '_key_index')
+
+    def __init__(self, flags, steps):
+        self.flags = flags
+        self.steps = steps
+        self.timed = any(step.options.get('timeout') is not None for step in steps)
+        self.dependents = [list() for _ in steps]
+        for ix, step in enumerate(steps):
+            for required in step.requires:
+                self.dependents[required].append(ix)
+        # The generated build function of a frozen registry.  See `FlagRegistry.freeze()`.
+        self.build = None
+        self._ancestors = None
+        self._key_index = None
+
+    def key_index(self):
+        """
+        :return key_steps: dict mapping each key to the plan index of the step which fills it in.
+        :return keyless_steps: tuple of plan indices of the steps which merge their return value without a key.
+        """
+        if self._key_index is None:
+            key_steps = dict()
+            keyless_steps = list()
+            for ix, step in enumerate(self.steps):
+                for key, rtv_ix in step.slots:
+                    if key:
+                        key_steps[key] = ix
+                    elif ix not in keyless_steps:
+                        keyless_steps.append(ix)
+            self._key_index = key_steps, tuple(keyless_steps)
+        return self._key_index
+
+    def ancestors(self, ix):
+        """
+        Returns the plan indices of every step the step at `ix` transitively depends on, in plan order.
+
+        Only the concurrent schedulers need these, so they are calculated on first use.
+        """
+        if self._ancestors is None:
+            ancestors = list()
+            for step in self.steps:
+                step_ancestors = set(step.requires)
+                for required in step.requires:
+                    step_ancestors.update(ancestors[required])
+                ancestors.append(tuple(sorted(step_ancestors)))
+            self._ancestors = ancestors
+        return self._ancestors[ix]
+
+
+class _Call(object):
+    """
+    The per-call options of a build out, shared by every step.
+
+    :param pass_datastructure: Pass the result dictionary to every method, not only to methods with dependencies.
+    :param copy_datastructure: Pass methods a copy of the result dictionary.  If False, pass a read-only view of it instead.
+    :param deadline: Seconds the call may take, or None.
+    :param tracer: `flagpole.trace.Tracer` recording a span for every method call, or None.
+    :param record: Build into a `flagpole.record.Record` instead of a dict: True for the registry's record class, or a class.
+    """
+    __slots__ = ('pass_datastructure', 'copy_datastructure', 'deadline', 'tracer', 'record')
+
+    def __init__(self, pass_datastructure=False, copy_datastructure=True, deadline=None, tracer=None, record=False):
+        self.pass_datastructure = pass_datastructure
+        self.copy_datastructure = copy_datastructure or MappingProxyType is None
+        # Stored as the time (per `_timer()`) at which it passes.
+        self.deadline = _timer() + deadline if deadline is not None else None
+        self.tracer = tracer
+        self.record = record
+
+    @classmethod
+    def from_kwargs(cls, kwargs):
+        """
+        Pops the build out options from the **kwargs passed into `build_out()` and friends.
+        """
+        return cls(
+            pass_datastructure=kwargs.pop('pass_datastructure', False),
+            copy_datastructure=kwargs.pop('copy_datastructure', True),
+            deadline=kwargs.pop('deadline', None),
+            tracer=kwargs.pop('tracer', None),
+            record=kwargs.pop('record', False))
+
+    def needs_datastructure(self, step, result, args):
+        """
+        :return: True if the method must be passed the datastructure as its first argument.
+        """
+        # No need to pass along the datastructure if it's already in *args
+        return (result not in args) and bool(step.method_dependencies or self.pass_datastructure)
+
+    def datastructure(self, step, result, args):
+        """
+        :return data: What to pass the method as its first argument, or None if it is not passed the datastructure.
+        """
+        if not self.needs_datastructure(step, result, args):
+            return None
+        if self.copy_datastructure:
+            return dict(result)
+        return MappingProxyType(result)
 
 
 class FlagRegistry:
-    
+
+    # Number of distinct `flags` values whose execution plans are cached.
+    plan_cache_size = 128
+
     def __init__(self):
         self.r = defaultdict(list)
+        self._plans = OrderedDict()
+        self._method_index = dict()
+        self._providers = defaultdict(list)
+        self._dependency_flags = dict()
+        self._order = None
+        self._options = defaultdict(dict)
+        self.observers = list()
+        self.limits = dict()
+        self._single_flight = SingleFlight()
+        self.frozen = False
+        self.latencies = LatencyEstimates()
+        self.store = None
+        self._record_class = None
 
-    def register(self, flag, depends_on=0, key=None):
+    def register(self, flag, depends_on=0, key=None, batch_size=None, cache=None, pass_requested=False, timeout=None,
+                 limit=None, retry=None, coalesce=None, persist=None, persist_key=None, executor=None):
         """
         optional methods must register their flag with the FlagRegistry.
 
@@ -59,7 +289,132 @@ class FlagRegistry:
 
         The `get_rules` method does not itself mutate the alb object, but it instead returns a new object (`rules`) which is
         appended to the final return value by the FlagRegistry.
+
+        Batch Example:
+        --------------
+
+        @ALBFlagRegistry.register(flag=FLAGS.TAGS, key='tags', batch_size=20)
+        def get_tags(albs, **conn):
+            tags = describe_tags(resource_arns=[alb['Arn'] for alb in albs], **conn)
+            return [tags.get(alb['Arn']) for alb in albs]
+
+        A method registered with a `batch_size` is called with a list of what would otherwise be its first argument
+        (the item, or the datastructure if it is passed one), and must return a list with one return value per entry.
+        When `build_out_many()` builds several items together, it calls the method once per chunk of up to
+        `batch_size` items and splits the returned list back into each item's result.  `build_out()` calls it with
+        a list of one.  Limits, retries, observers and the `executor` apply to each batch call.  A `cache`,
+        `coalesce` or `persist` would need the arguments of a single item, so they raise a ValueError.
+
+        Within `build_out_many()`, the list holds the datastructure of each item if the method is passed one, or else
+        the items themselves (with `start_with_items=True`, the datastructure is the item).  The remaining arguments
+        are the ones shared by every item.
+
+        Cache Example:
+        --------------
+
+        @ALBFlagRegistry.register(flag=FLAGS.POLICY, key='policy', cache=TTLCache(maxsize=64, ttl=300))
+        def get_account_policy(alb, account_number=None, **conn):
+            pass
+
+        A method registered with a `cache` is only called when the cache has no fresh return value for the
+        *args/**kwargs passed to `build_out()`.  A cached return value fills in every key/rtv_ix slot exactly as
+        if the method had run.  See `flagpole.cache.TTLCache`.
+
+        Requested Return Values Example:
+        --------------------------------
+
+        @FlagRegistry.register(
+            flag=(FLAGS.GRANTS, FLAGS.GRANT_REFERENCES, FLAGS.OWNER),
+            key=('grants', 'grant_references', 'owner'),
+            pass_requested=True)
+        def get_grants(bucket_name, requested_flags=FLAGS.ALL, **conn):
+            grants = get_bucket_acl(bucket_name, **conn) if requested_flags & FLAGS.GRANTS else None
+            ...
+            return grants, grant_references, owner
+
+        With `pass_requested=True`, the method is passed a `requested_flags` keyword argument holding the flags of
+        the return values which will be kept, so it can skip the work for the others.  It must still return a value
+        (such as None) in every position.
+
+        Timeout Example:
+        ----------------
+
+        @ALBFlagRegistry.register(flag=FLAGS.RULES, depends_on=FLAGS.LISTENERS, key='rules', timeout=5)
+        def get_rules(alb, **conn):
+            pass
+
+        A method registered with a `timeout` (seconds) is abandoned by `build_out()` if it runs longer, along with
+        the methods depending on it, and the partial result lists what was not produced under `flagpole.INCOMPLETE`.
+        Python cannot interrupt a running function, so the method's thread is left to finish in the background.
+
+        Rate Limit Example:
+        -------------------
+
+        ALBFlagRegistry.add_limit('elbv2', rate=10, burst=20, max_in_flight=4)
+
+        @ALBFlagRegistry.register(
+            flag=FLAGS.RULES, depends_on=FLAGS.LISTENERS, key='rules',
+            limit='elbv2', retry=Retry(on=is_throttling_error))
+        def get_rules(alb, **conn):
+            pass
+
+        A method registered with a `limit` (the name of a limit added with `add_limit()`, or a `flagpole.Limit`)
+        waits for a token and an in-flight slot before every call.  Limits are shared by every method using them
+        and every concurrent `build_out()` on the registry.  With a `retry` (a `flagpole.Retry`), calls raising a
+        throttling error are retried with jittered exponential backoff.
+
+        Coalesce Example:
+        -----------------
+
+        @S3FlagRegistry.register(
+            flag=FLAGS.ACCOUNT_POLICY, key='account_policy',
+            coalesce=lambda bucket_name, **conn: conn['account_number'])
+        def get_account_policy(bucket_name, **conn):
+            pass
+
+        With `coalesce`, identical calls made at the same time by concurrent build outs share a single execution:
+        later callers wait for the call in flight and all receive its return value (or exception).  Calls are
+        identical when their key matches: `coalesce=True` uses the *args/**kwargs passed to `build_out()`, or
+        pass a function over them returning the key.  The datastructure is not part of the key.
+
+        Persist Example:
+        ----------------
+
+        S3FlagRegistry.store = SQLiteStore('/var/cache/s3/results.db')
+
+        @S3FlagRegistry.register(flag=FLAGS.LIFECYCLE, key='lifecycle', persist=3600)
+        def get_lifecycle(bucket_name, **conn):
+            pass
+
+        With `persist` and a `store` set on the registry (see `flagpole.store`), return values are kept in the store
+        for `persist` seconds (True for no expiry), keyed on the method, the *args/**kwargs passed to `build_out()` and
+        the flags.  `build_out()` serves fresh entries from the store, also after a restart, and only calls the method
+        for missing or expired ones.
+
+        The arguments are keyed by their repr, which must be the same in the next process.  Calls with unhashable
+        arguments, or with objects whose repr is their memory address (ie. a boto3 client in **conn), raise a
+        TypeError.  Pass a `persist_key` function over the *args/**kwargs to pick what identifies a call instead,
+        for example `persist_key=lambda bucket_name, **conn: (conn['account_number'], bucket_name)`.
+        Calls whose key is None are not persisted.
+
+        Process Example:
+        ----------------
+
+        @S3FlagRegistry.register(flag=FLAGS.POLICY_DIFF, depends_on=FLAGS.POLICY, key='policy_diff', executor='process')
+        def diff_policy(data, bucket_name, **conn):
+            pass
+
+        With `executor='process'`, the method runs in a process pool shared by every registry (see
+        `process_pool_workers`), so CPU-bound methods are not held up by the GIL while the rest of the build out
+        runs on threads.  Its arguments, including the datastructure, and its return value are pickled, so the
+        method must be a module-level function.  Any other `concurrent.futures.Executor` can be passed instead.
         """
+        if self.frozen:
+            raise RuntimeError('FlagRegistry is frozen.  Register every method before calling freeze().')
+        if batch_size and (cache is not None or coalesce or persist is not None):
+            # They are keyed on the arguments of a single call, which a batch call doesn't have.
+            raise ValueError('A method with a batch_size can not be registered with a cache, coalesce or persist.')
+
         def decorator(fn):
             flag_list = flag
             key_list = key
@@ -69,10 +424,31 @@ class FlagRegistry:
                 key_list = [key]
             for idx in range(len(flag_list)):
                 self.r[fn].append(
-                    dict(flag=flag_list[idx],
-                         depends_on=depends_on,
+                    dict(flag=int(flag_list[idx]),
+                         depends_on=int(depends_on),
                          key=key_list[idx],
                          rtv_ix=idx))
+            if batch_size:
+                self._options[fn]['batch_size'] = batch_size
+            if cache is not None:
+                self._options[fn]['cache'] = cache
+            if pass_requested:
+                self._options[fn]['pass_requested'] = True
+            if timeout is not None:
+                self._options[fn]['timeout'] = timeout
+            if limit is not None:
+                self._options[fn]['limit'] = limit
+            if retry is not None:
+                self._options[fn]['retry'] = retry
+            if coalesce:
+                self._options[fn]['coalesce'] = coalesce
+            if persist is not None:
+                self._options[fn]['persist'] = None if persist is True else persist
+            if persist_key is not None:
+                self._options[fn]['persist_key'] = persist_key
+            if executor is not None:
+                self._options[fn]['executor'] = executor
+            self._index_method(fn)
             return fn
         return decorator
 
@@ -98,46 +474,45 @@ class FlagRegistry:
 
         return flags
 
-    def _calculate_dependency_flag(self, method, calculated=None):
+    def _calculate_dependency_flag(self, method):
         """
         Given a method that may or may not contain dependencies, create a binary flag
         which represents all dependent methods.
-        
-        As dependencies may be multiple levels deep, we use a recursive approach.
-        
-        Note: Will raise an Exception if a dependency cycle is detected.
-        
+
+        As dependencies may be multiple levels deep, the flags for every method are calculated
+        in one sweep over the topological order, and cached until the next call to `register()`.
+
+        Note: Will raise a CircularDependencyError if a dependency cycle is detected.
+
         :param method: Starting point for calculating dependency flag
-        :param calculated: set of methods this function has been called with.  Used to detect dependency cycles.
         :return dependencies: binary flag (int) created by binary-ORing each dependency in the chain.
         """
-        if not calculated:
-            calculated = set([method])
-        else:
-            calculated.add(method)
-        
-        method_flag, dependencies = self._get_method_flag(method)
-        methods = self._find_methods_matching_flag(dependencies)
-        for m in methods:
-            if m in calculated:
-                raise Exception('Circular Dependency Error.')
-            dependencies = dependencies | self._calculate_dependency_flag(m, calculated=calculated)
-        return dependencies
+        dependency_flags = self._dependency_flags
+        if not dependency_flags:
+            # Filled in before being published, so concurrent first build outs never see a partial dict.
+            dependency_flags = dict()
+            for m in self._topological_order():
+                method_flag, dependencies = self._get_method_flag(m)
+                for upstream in self._find_methods_matching_flag(dependencies):
+                    dependencies = dependencies | dependency_flags[upstream]
+                dependency_flags[m] = dependencies
+            self._dependency_flags = dependency_flags
+        return dependency_flags[method]
 
     def _find_methods_matching_flag(self, flag):
         """
-        Given a flag, iterates over the method registry and returns a list of 
-        all methods which match the flag.
-        
+        Given a flag, uses the flag bit index to return a list of
+        all methods which match the flag, in registration order.
+
         :param flag: flag to match against
         :return results: list of matching methods.
         """
-        results = list()
-        for m in self.r:
-            method_flag, dependencies = self._get_method_flag(m)
-            if method_flag & flag:
-                results.append(m)
-        return results 
+        results = set()
+        while flag:
+            bit = flag & -flag
+            results.update(self._providers.get(bit, ()))
+            flag = flag ^ bit
+        return sorted(results, key=self._method_index.get)
 
     def _get_method_flag(self, method):
         """
@@ -158,106 +533,1172 @@ class FlagRegistry:
             method_dependencies = method_dependencies | entry['depends_on']
         return method_flag, method_dependencies
 
-    def _execute_method(self, method, method_flag, method_dependencies, executed_flag, result, pass_datastructure, flags, *args, **kwargs):
+    def _index_method(self, method):
+        """
+        Adds a newly registered method to the flag bit index and invalidates everything
+        derived from the dependency graph.
+        """
+        if method not in self._method_index:
+            self._method_index[method] = len(self._method_index)
+
+        method_flag, method_dependencies = self._get_method_flag(method)
+        while method_flag:
+            bit = method_flag & -method_flag
+            if method not in self._providers[bit]:
+                self._providers[bit].append(method)
+            method_flag = method_flag ^ bit
+
+        self._dependency_flags = dict()
+        self._order = None
+        self._plans.clear()
+        self._record_class = None
+
+    def _topological_order(self):
+        """
+        Orders every registered method after the methods it depends on, using Kahn's algorithm.
+        Ties are broken by registration order so the result is deterministic.
+
+        The order is cached until the next call to `register()`.
+
+        Note: Will raise a CircularDependencyError naming the methods in the cycle if one is detected.
+
+        :return order: list of all registered methods.
+        """
+        if self._order is not None:
+            return self._order
+
+        upstream = dict()
+        downstream = defaultdict(list)
+        for method in self.r:
+            method_flag, method_dependencies = self._get_method_flag(method)
+            upstream[method] = self._find_methods_matching_flag(method_dependencies)
+            for m in upstream[method]:
+                downstream[m].append(method)
+
+        in_degree = dict((method, len(upstream[method])) for method in self.r)
+        ready = [(self._method_index[method], method) for method in self.r if not in_degree[method]]
+        heapq.heapify(ready)
+
+        order = list()
+        while ready:
+            _, method = heapq.heappop(ready)
+            order.append(method)
+            for m in downstream[method]:
+                in_degree[m] -= 1
+                if not in_degree[m]:
+                    heapq.heappush(ready, (self._method_index[m], m))
+
+        if len(order) < len(self.r):
+            # Every method left over still waits on another left over method.
+            # Walk upstream from any of them until we revisit one to name the cycle.
+            path = [next(method for method in self.r if in_degree[method])]
+            while True:
+                method = next(m for m in upstream[path[-1]] if in_degree[m])
+                if method in path:
+                    raise CircularDependencyError(path[path.index(method):] + [method])
+                path.append(method)
+
+        self._order = order
+        return order
+
+    def _compile_plan(self, flags):
+        """
+        Resolve the dependency flags and the execution order for a given `flags` value.
+
+        :param flags: The flags passed into `build_out()`.
+        :return plan: _Plan holding the resolved flags and the ordered steps.
+        """
+        flags = self._validate_flags(int(flags))
+        steps = list()
+        step_index = dict()
+        for method in self._topological_order():
+            method_flag, method_dependencies = self._get_method_flag(method)
+            if flags & method_flag:
+                step_index[method] = len(steps)
+                steps.append(self._compile_step(method, method_flag, method_dependencies, flags, step_index))
+        return _Plan(flags, steps)
+
+    def _compile_step(self, method, method_flag, method_dependencies, flags, step_index):
+        """
+        Helper method to build the _Step for a method, keeping only the return values requested by `flags`.
+
+        :param step_index: dict mapping each method compiled so far to its plan index.
+        Every dependency of `method` is already among them.
+        """
+        entries = [entry for entry in self.r[method] if flags & entry['flag']]
+        slots = tuple((entry['key'], entry['rtv_ix']) for entry in entries)
+        requested_flags = 0
+        for entry in entries:
+            requested_flags = requested_flags | entry['flag']
+        requires = sorted(
+            step_index[m] for m in self._find_methods_matching_flag(method_dependencies) if m in step_index)
+        return _Step(
+            method, method_flag, method_dependencies, slots, len(self.r[method]) > 1,
+            requires=tuple(requires), options=self._options.get(method), requested_flags=requested_flags)
+
+    def _get_plan(self, flags):
         """
-        Executes a @FlagRegistry.register() decorated method.
+        Returns the cached _Plan for `flags`, compiling it on a cache miss.
 
-        First checks the flags to see if the method is required.
-        Next, checks if there are any dependent methods that have yet to be executed.
-            If so, return False instead of executing.  We will try again on a later pass.
-        Finally, execute the method and mutate the result dictionary to contain the results
-        from each return value.
+        The cache holds at most `plan_cache_size` plans and is cleared whenever a method is registered.
+        """
+        plan = self._plans.get(flags)
+        if plan is None:
+            plan = self._compile_plan(flags)
+            if len(self._plans) >= self.plan_cache_size:
+                self._plans.popitem(last=False)
+            self._plans[flags] = plan
+        return plan
+
+    def freeze(self, *flags):
+        """
+        Locks the registry against further `register()` calls, and switches `build_out()` over to generated code.
+
+        For every `flags` value, the first sequential `build_out()` after freezing generates a function which calls
+        the plan's methods one after the other and stores their return values under keys known in advance,
+        skipping the generic bookkeeping done on every call otherwise.  The result is exactly the same.
+        Methods registered with options (cache, limit, ...) still go through the general path, as does
+        everything while observers are added.
+
+        :param *flags: flags values to generate the functions for now, instead of on first use.
+        """
+        self.frozen = True
+        self._topological_order()
+        for value in flags:
+            plan = self._get_plan(value)
+            if plan.build is None:
+                plan.build = generate_build(self, plan)
 
-        :return True: If this method was either executed or should be removed from future passes.
-        :return False: If this method could not be executed because of outstanding dependent methods. (Try again later)
+    def record_class(self):
         """
-        if not flags & method_flag:
-            # by returning True, we remove this method from the method_queue.
-            return True
+        Returns the `flagpole.record.Record` class for this registry, with a `__slots__` slot for every registered key.
 
-        # Check if all method dependencies have been executed.
-        # If a method still has unexecuted dependencies, add the method to the queue.
-        if method_dependencies and not (method_dependencies & executed_flag):
-            return False
+        `build_out(..., record=True)` (and `build_out_many`, `build_out_iter`, `build_out_async`) fill in an instance
+        of it instead of a dict.  Records take a fraction of the memory of a dict, allow attribute access to the keys
+        (`result.rules`), and convert with `result.to_dict()`.  Keys from methods registered without a `key` are kept
+        in a dict on the side.
+        """
+        if self._record_class is None:
+            keys = list()
+            for method in sorted(self.r, key=self._method_index.get):
+                for entry in self.r[method]:
+                    if entry['key'] and entry['key'] not in keys:
+                        keys.append(entry['key'])
+            self._record_class = record_class(keys)
+        return self._record_class
+
+    def _new_result(self, call):
+        """
+        :return result: A new, empty result for a build out: a dict, or a record if the call asked for one.
+        """
+        if not call.record:
+            return dict()
+        if call.record is True:
+            return self.record_class()()
+        return call.record()
+
+    def add_limit(self, name, rate=None, burst=None, max_in_flight=None):
+        """
+        Declares a named `flagpole.Limit` which methods can use with `register(..., limit=name)`.
+
+        :param rate: Calls per second allowed on average.
+        :param burst: Calls allowed at once after a quiet period.
+        :param max_in_flight: Calls allowed to run at the same time.
+        :return limit: The Limit.
+        """
+        self.limits[name] = Limit(rate=rate, burst=burst, max_in_flight=max_in_flight)
+        return self.limits[name]
+
+    def _get_limit(self, step):
+        """
+        :return limit: The Limit the step's method was registered with, or None.
+        """
+        limit = step.options.get('limit')
+        if limit is None or isinstance(limit, Limit):
+            return limit
+        return self.limits[limit]
 
-        # At least one of the return values is required. Call the method.
-        if (result not in args) and (method_dependencies or pass_datastructure):
-            # Need to pass along dict(result) if it's not already in *args
-            retval = method(dict(result), *args, **kwargs)
+    def add_observer(self, observer):
+        """
+        Adds an observer to be told about every method call made by this registry.  See `flagpole.stats.Observer`.
+        """
+        self.observers.append(observer)
+
+    def remove_observer(self, observer):
+        self.observers.remove(observer)
+
+    def _notify(self, callback, step, *args):
+        """
+        Calls `callback` on every observer with the step's method, flag and keys followed by `args`.
+        """
+        keys = tuple(key for key, rtv_ix in step.slots)
+        for observer in self.observers:
+            getattr(observer, callback)(step.method, step.method_flag, keys, *args)
+
+    def _call_step(self, step, data, *args, **kwargs):
+        """
+        Calls the method for a compiled step, or returns its cached return value.
+
+        :param data: The datastructure to pass as the first argument, or None to only pass *args.
+        :return retval: The return value of the method.
+        """
+        cache = step.options.get('cache')
+        if cache is not None:
+            cache_key = self._cache_key(step, cache, *args, **kwargs)
+            if cache_key is not None:
+                hit, retval = cache.lookup(cache_key)
+                if hit:
+                    if self.observers:
+                        self._notify('on_method_skip', step, 'cache')
+                else:
+                    retval = self._persisted(step, data, *args, **kwargs)
+                    cache.store(cache_key, retval)
+                return retval
+        return self._persisted(step, data, *args, **kwargs)
+
+    def _store_key(self, step, *args, **kwargs):
+        """
+        :return store_key: (method name, argument key, flag) identifying the call in `self.store`, or None if
+        the step's method is not persisted or its `persist_key` returned None.
+        :raises TypeError: If the arguments can't be keyed in a way which holds across processes.
+        """
+        if self.store is None or 'persist' not in step.options:
+            return None
+        persist_key = step.options.get('persist_key')
+        if persist_key is not None:
+            key = persist_key(*args, **kwargs)
+            if key is None:
+                return None
+            key = repr(key)
         else:
-            retval = method(*args, **kwargs)
+            key = make_key(*args, **kwargs)
+            if key is None:
+                raise TypeError('Unhashable arguments to persisted method {}, register it with a persist_key.'.format(
+                    _method_name(step.method)))
+            key = repr(key)
+            if ' at 0x' in key:
+                # The repr of the object would be different in the next process, so the entry could never hit.
+                raise TypeError('Arguments to persisted method {} have no stable repr, register it with a '
+                                'persist_key: {}'.format(_method_name(step.method), key))
+        flag = step.requested_flags if step.options.get('pass_requested') else step.method_flag
+        return _method_name(step.method), key, flag
 
-        for entry in self.r[method]:
-            if len(self.r[method]) > 1:
-                key_retval = retval[entry['rtv_ix']]
+    def _persisted(self, step, data, *args, **kwargs):
+        """
+        Calls the method for a compiled step, or returns its return value from the persistent store.
+        """
+        store_key = self._store_key(step, *args, **kwargs) if 'persist' in step.options else None
+        if store_key is None:
+            return self._coalesce(step, data, *args, **kwargs)
+        hit, retval = self.store.get(*store_key)
+        if hit:
+            if self.observers:
+                self._notify('on_method_skip', step, 'store')
+            return retval
+        retval = self._coalesce(step, data, *args, **kwargs)
+        self.store.put(*store_key, value=retval, ttl=step.options['persist'])
+        return retval
+
+    def _coalesce_key(self, step, *args, **kwargs):
+        """
+        :return coalesce_key: The key identical in-flight calls of the step's method share, or None.
+        """
+        coalesce = step.options.get('coalesce')
+        key = make_key(*args, **kwargs) if coalesce is True else coalesce(*args, **kwargs)
+        if key is None:
+            return None
+        if step.options.get('pass_requested'):
+            key = (key, step.requested_flags)
+        return step.method, key
+
+    def _coalesce(self, step, data, *args, **kwargs):
+        """
+        Calls the method for a compiled step, sharing the execution with identical calls in flight if it coalesces.
+        """
+        if step.options.get('coalesce'):
+            coalesce_key = self._coalesce_key(step, *args, **kwargs)
+            if coalesce_key is not None:
+                shared, retval = self._single_flight.do(
+                    coalesce_key, self._observe, step, self._invoke_method, step, data, *args, **kwargs)
+                if shared and self.observers:
+                    self._notify('on_method_skip', step, 'coalesced')
+                return retval
+        return self._observe(step, self._invoke_method, step, data, *args, **kwargs)
+
+    def _cache_key(self, step, cache, *args, **kwargs):
+        """
+        :return cache_key: The key for this call in the step's cache, or None if it must not be cached.
+        """
+        cache_key = cache.make_key(*args, **kwargs)
+        if cache_key is not None and step.options.get('pass_requested'):
+            # A call for some of the return values must not be served to a call for others.
+            cache_key = (cache_key, step.requested_flags)
+        return cache_key
+
+    def _observe(self, step, fn, *args, **kwargs):
+        """
+        Returns fn(*args, **kwargs), reporting the start, end or error of the step's method to any observers.
+        """
+        if not self.observers:
+            return self._throttle(step, fn, *args, **kwargs)
+
+        self._notify('on_method_start', step)
+        start = _timer()
+        try:
+            retval = self._throttle(step, fn, *args, **kwargs)
+        except Exception as e:
+            self._notify('on_method_error', step, _timer() - start, e)
+            raise
+        self._notify('on_method_end', step, _timer() - start)
+        return retval
+
+    def _throttle(self, step, fn, *args, **kwargs):
+        """
+        Returns fn(*args, **kwargs), waiting on the step's limit before every attempt and retrying throttling errors.
+        """
+        limit = self._get_limit(step)
+        retry = step.options.get('retry')
+        if limit is None and retry is None:
+            return fn(*args, **kwargs)
+
+        attempt = 0
+        while True:
+            if limit is not None:
+                limit.acquire()
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if retry is None or not retry.should_retry(e, attempt):
+                    raise
+            finally:
+                if limit is not None:
+                    limit.release()
+            time.sleep(retry.delay(attempt))
+            attempt += 1
+
+    def _invoke_method(self, step, data, *args, **kwargs):
+        """
+        Calls the method for a compiled step.
+        """
+        method = step.method
+        if step.options.get('executor') is not None:
+            method = functools.partial(self._call_elsewhere, step.options['executor'], method)
+        if step.options.get('pass_requested'):
+            kwargs['requested_flags'] = step.requested_flags
+        if step.options.get('batch_size'):
+            if data is None and args:
+                data, args = args[0], args[1:]
+            return method([data], *args, **kwargs)[0]
+        if data is not None:
+            return method(data, *args, **kwargs)
+        return method(*args, **kwargs)
+
+    # Number of worker processes in the pool shared by methods registered with `executor='process'`.
+    # None means one per CPU.
+    process_pool_workers = None
+
+    def _call_elsewhere(self, executor, method, *args, **kwargs):
+        """
+        Calls the method on another executor, and waits for its return value.
+
+        :param executor: 'process' for the shared process pool, or a `concurrent.futures.Executor`.
+        """
+        if executor == 'process':
+            executor = _get_process_pool(self.process_pool_workers)
+        if args and MappingProxyType is not None and isinstance(args[0], MappingProxyType):
+            # Views can't be pickled.
+            args = (dict(args[0]),) + args[1:]
+        return executor.submit(method, *args, **kwargs).result()
+
+    def _merge_step(self, step, retval, result):
+        """
+        Mutates the result dictionary to contain the requested return values of a compiled step.
+        """
+        for key, rtv_ix in step.slots:
+            key_retval = retval[rtv_ix] if step.multi else retval
+            if key:
+                result[key] = key_retval
             else:
-                key_retval = retval
-            if flags & entry['flag']:
-                if entry['key']:
-                    result.update({entry['key']: key_retval})
-                else:
-                    result.update(key_retval)
-        return True
+                result.update(key_retval)
+
+    def _step_items(self, step, retval):
+        """
+        :return: (key, value) for each requested return value of a compiled step.  The key is None for a value
+        which is merged into the result dictionary.
+        """
+        for key, rtv_ix in step.slots:
+            yield key or None, retval[rtv_ix] if step.multi else retval
 
-    def _do_method_pass(self, method_queue, executed_flag, result, pass_datastructure, flags, *args, **kwargs):
+    def _run_step(self, step, result, call, *args, **kwargs):
+        """
+        Calls the method for a compiled step and mutates the result dictionary
+        to contain the requested return values.
         """
-        Loop over available methods, executing those that are ready.
-        - Raise an exception if we don't execute any methods on a given path. (circular dependency)
+        data = call.datastructure(step, result, args)
+        self._merge_step(step, self._call_step(step, data, *args, **kwargs), result)
 
-        :return next_method_queue: The list of methods to use for the next pass.
-        :return executed_flag: Binary combination of all flags whose attached methods have been executed.
+    def _run_concurrent(self, plan, result, call, executor, *args, **kwargs):
         """
-        did_execute_method = False
-        next_method_queue = list()
+        Submits each step of the plan to the executor as soon as the steps it depends on have finished.
 
-        for method in method_queue:
-            method_flag, method_dependencies = self._get_method_flag(method)
-            if self._execute_method(method, method_flag, method_dependencies, executed_flag, result, pass_datastructure, flags, *args, **kwargs):
-                did_execute_method = True
-                executed_flag = int(executed_flag | method_flag)
+        A step that needs the datastructure receives a copy of the starting result with the return values
+        of its ancestors merged in, in plan order.  Once every step has finished, all return values are merged
+        into the result dictionary in plan order, so the result does not depend on which call finished first.
+
+        If the result is itself one of the *args (ie. `build_out(flags, alb, start_with=alb)`), methods read
+        the keys of the methods they depend on from it, so each return value is also merged into it as soon as
+        its method finishes, before the methods depending on it are submitted.
+
+        If a method raises, the steps that have not started yet are cancelled and the exception is re-raised.
+
+        If a method runs past its registered `timeout`, or the call runs past its `deadline`, the method is
+        abandoned (its thread is left to finish on its own) and the methods depending on it are never started.
+        Everything else is still merged into the result, which is then marked incomplete.
+        """
+        steps = plan.steps
+        retvals = [None] * len(steps)
+        abandoned = set()
+        for _ in self._iter_concurrent(plan, result, call, executor, retvals, abandoned, *args, **kwargs):
+            pass
+
+        for ix, step in enumerate(steps):
+            if ix not in abandoned:
+                self._merge_step(step, retvals[ix], result)
+        if abandoned:
+            self._mark_incomplete(result, [steps[ix] for ix in sorted(abandoned)])
+
+    def _iter_concurrent(self, plan, result, call, executor, retvals, abandoned, *args, **kwargs):
+        """
+        Scheduler behind `_run_concurrent()`.  Yields the index of each step as it finishes, after storing its
+        return value in `retvals`.  The indexes of the abandoned steps are added to `abandoned`.
+
+        Steps whose dependencies have finished wait in a ready queue until the executor has a free worker,
+        and the step on the longest remaining chain of estimated latencies goes first (see `_priorities()`).
+        Executors which don't tell how many workers they have are given every ready step right away.
+
+        The result dictionary is only read, to build the datastructure passed to the methods, unless it is one
+        of the *args: then each return value is merged into it as its method finishes.
+        """
+        from concurrent.futures import wait, FIRST_COMPLETED
+
+        steps = plan.steps
+        live = result in args
+        waiting = [len(step.requires) for step in steps]
+        priorities = self._priorities(plan)
+        workers = getattr(executor, '_max_workers', None)
+        ready = list()
+        futures = dict()
+        started = dict()
+        trace = call.tracer.begin(plan) if call.tracer is not None else None
+
+        def run(ix, data):
+            start = started[ix] = _timer()
+            if trace is not None:
+                retval = trace.call(ix, self._call_step, steps[ix], data, *args, **kwargs)
+            else:
+                retval = self._call_step(steps[ix], data, *args, **kwargs)
+            self.latencies.update(steps[ix].method, _timer() - start)
+            return retval
+
+        def submit(ix):
+            step = steps[ix]
+            data = None
+            if call.needs_datastructure(step, result, args):
+                data = dict(result)
+                for ancestor in plan.ancestors(ix):
+                    self._merge_step(steps[ancestor], retvals[ancestor], data)
+            futures[executor.submit(run, ix, data)] = ix
+
+        def dispatch():
+            while ready and (workers is None or len(futures) < workers):
+                submit(heapq.heappop(ready)[1])
+
+        for ix in range(len(steps)):
+            if not waiting[ix]:
+                heapq.heappush(ready, (-priorities[ix], ix))
+        dispatch()
+
+        try:
+            while futures:
+                expires = self._next_expiry(steps, futures, started, call.deadline)
+                timeout = None if expires is None else max(0, expires - _timer())
+                done, _ = wait(list(futures), timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    ix = futures.pop(future)
+                    retvals[ix] = future.result()
+                    if live:
+                        self._merge_step(steps[ix], retvals[ix], result)
+                    for dependent in plan.dependents[ix]:
+                        waiting[dependent] -= 1
+                        if not waiting[dependent]:
+                            heapq.heappush(ready, (-priorities[dependent], dependent))
+                    yield ix
+
+                if expires is not None:
+                    now = _timer()
+                    for future, ix in list(futures.items()):
+                        timeout = steps[ix].options.get('timeout')
+                        if (call.deadline is not None and now >= call.deadline) or \
+                                (timeout is not None and ix in started and now >= started[ix] + timeout):
+                            future.cancel()
+                            del futures[future]
+                            self._abandon(plan, ix, abandoned)
+                    if call.deadline is not None and now >= call.deadline:
+                        while ready:
+                            self._abandon(plan, heapq.heappop(ready)[1], abandoned)
+                dispatch()
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    def _iter_sequential(self, plan, result, call, abandoned, *args, **kwargs):
+        """
+        Runs the steps of the plan one at a time in plan order, against the live result dictionary, for a call with
+        a deadline or methods with a `timeout`.  Yields the index and return value of each step once it has been
+        merged into the result.  The indexes of the abandoned steps are added to `abandoned`.
+
+        Only the methods which can run out of time (every method under a deadline, otherwise only the methods
+        registered with a `timeout`) are called on a thread of their own, to be abandoned if they take too long.
+        """
+        trace = call.tracer.begin(plan) if call.tracer is not None else None
+        for ix, step in enumerate(plan.steps):
+            if ix in abandoned:
+                continue
+            timeout = step.options.get('timeout')
+            if call.deadline is not None:
+                left = call.deadline - _timer()
+                timeout = left if timeout is None else min(timeout, left)
+            if timeout is not None and timeout <= 0:
+                self._abandon(plan, ix, abandoned)
+                continue
+
+            fn = self._call_step if trace is None else functools.partial(trace.call, ix, self._call_step)
+            data = call.datastructure(step, result, args)
+            if timeout is None:
+                retval = fn(step, data, *args, **kwargs)
             else:
-                next_method_queue.append(method)
+                from concurrent.futures import TimeoutError
+                try:
+                    retval = _call_with_timeout(timeout, fn, step, data, *args, **kwargs)
+                except TimeoutError:
+                    self._abandon(plan, ix, abandoned)
+                    continue
+            self._merge_step(step, retval, result)
+            yield ix, retval
 
-        if not did_execute_method:
-            raise Exception('Circular Dependency Error.')
+    def _abandon(self, plan, ix, abandoned):
+        """
+        Adds the step at `ix` and every step depending on it to the `abandoned` set of plan indices.
+        """
+        descendants = [ix]
+        while descendants:
+            ix = descendants.pop()
+            if ix not in abandoned:
+                abandoned.add(ix)
+                descendants.extend(plan.dependents[ix])
 
-        return next_method_queue, executed_flag
+    def _priorities(self, plan):
+        """
+        Critical-path priorities for the concurrent scheduler.
+
+        :return priorities: For each step of the plan, the estimated latency of the longest chain of steps
+        starting with it and following its dependents.  Methods without an estimate in `self.latencies`
+        count as the average of the known estimates, or as 1 if none are known.
+        """
+        steps = plan.steps
+        costs = [self.latencies.estimate(step.method) for step in steps]
+        known = [cost for cost in costs if cost is not None]
+        default = sum(known) / len(known) if known else 1.0
+
+        priorities = [0.0] * len(steps)
+        for ix in range(len(steps) - 1, -1, -1):
+            tail = max([priorities[dependent] for dependent in plan.dependents[ix]] or [0.0])
+            priorities[ix] = (default if costs[ix] is None else costs[ix]) + tail
+        return priorities
+
+    # How often to check on methods with a timeout which are still queued on a busy executor.
+    _timeout_poll_interval = 0.01
+
+    def _next_expiry(self, steps, futures, started, deadline):
+        """
+        :return: The earliest time (per `_timer()`) at which the deadline or the timeout of a running step expires, or None.
+        """
+        expires = deadline
+        for ix in futures.values():
+            timeout = steps[ix].options.get('timeout')
+            if timeout is None:
+                continue
+            if ix in started:
+                step_expires = started[ix] + timeout
+            else:
+                step_expires = _timer() + self._timeout_poll_interval
+            if expires is None or step_expires < expires:
+                expires = step_expires
+        return expires
+
+    def _mark_incomplete(self, result, steps):
+        """
+        Records the flags and keys of the steps which did not finish under the INCOMPLETE key of the result.
+        """
+        incomplete = result.setdefault(INCOMPLETE, dict(flags=0, keys=list()))
+        for step in steps:
+            incomplete['flags'] = incomplete['flags'] | step.requested_flags
+            incomplete['keys'].extend(key for key, rtv_ix in step.slots if key)
 
     def build_out(self, flags, *args, **kwargs):
         """
         Provided user-supplied flags, `build_out` will find the appropriate methods from the FlagRegistry
         and mutate the `result` dictionary.
 
-        Stage 1: Set the flags for any dependencies if not already set.
-        Stage 2: Repeatedly loop over available methods, executing those that are ready.
-        - Break when we've executed all methods.
-        - Break and error out if we don't execute any on a given pass.
+        Stage 1: Fetch the execution plan for `flags`, compiling and caching it on first use.
+        - The plan has the flags for any dependencies set, and the methods in topological order.
+        - Error out if a dependency cycle is detected.
+        Stage 2: Execute each method in the plan.
+        - With an `executor` or `max_workers`, independent methods run concurrently and each method
+          is dispatched as soon as the methods it depends on have finished.
+        - With a `deadline`, or methods registered with a `timeout`, methods which run out of time are
+          abandoned, along with the methods depending on them, and build_out returns a partial result.
+          The flags and keys which were not produced are listed under `result[flagpole.INCOMPLETE]`,
+          as dict(flags=..., keys=[...]).  Without an `executor` or `max_workers`, the methods still run
+          one at a time in plan order; only the methods which can run out of time get a thread of their own.
 
         :param flags: User-supplied combination of FLAGS.  (ie. `flags = FLAGS.CORS | FLAGS.WEBSITE`)
         :param pass_datastructure: To pass the result dictionary as an arg to each decorated method, set this to True.  Otherwise it will only be sent if a dependency is detected.
+        :param copy_datastructure: By default, methods are passed a copy of the result dictionary.  Set this to False to pass a read-only view of the live result instead, which avoids copying it for every method.  Methods must not hold on to the view, as it keeps changing while build_out runs.  (Concurrent build outs always pass a copy.)
         :param start_with: You can pass in a dictionary for build_out to mutate. By default, build_out will create a new dictionary and return it.
+        :param executor: A `concurrent.futures.Executor` to run the methods on.  It is not shut down by build_out.
+        :param max_workers: Without an `executor`, run the methods on a thread pool of this size created for this call.
+        :param deadline: Seconds the whole call may take.  Methods still running when it passes are abandoned.
+        :param tracer: A `flagpole.trace.Tracer` to record a span (timings, thread, dependencies) for every method call.
+        :param record: Set to True to build into a compact record (see `record_class()`) instead of a new dictionary.
         :param *args: Passed on to the method registered in the FlagRegistry
         :param **kwargs: Passed on to the method registered in the FlagRegistry
         :return result: The dictionary created by combining the output of all executed methods.
         """
-        pass_datastructure = kwargs.pop('pass_datastructure', False)
+        call = _Call.from_kwargs(kwargs)
         start_with = kwargs.pop('start_with', dict())
+        executor = kwargs.pop('executor', None)
+        max_workers = kwargs.pop('max_workers', None)
+
+        plan = self._get_plan(flags)
+        result = start_with or self._new_result(call)
+        return self._execute(plan, result, call, executor, max_workers, *args, **kwargs)
+
+    def _execute(self, plan, result, call, executor, max_workers, *args, **kwargs):
+        """
+        Runs the plan one step at a time, or concurrently with an executor or `max_workers`.  Without an
+        executor, the concurrent steps run on a thread pool created for this call.
 
-        flags = self._validate_flags(flags)
-        result = start_with or dict()
+        :return result: The result dictionary, mutated.
+        """
+        timed = call.deadline is not None or plan.timed
+        if executor is None and max_workers and len(plan.steps) > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+            try:
+                self._run_concurrent(plan, result, call, executor, *args, **kwargs)
+            finally:
+                # Don't wait on abandoned methods.
+                executor.shutdown(wait=not timed)
+        elif executor is not None:
+            self._run_concurrent(plan, result, call, executor, *args, **kwargs)
+        elif timed:
+            abandoned = set()
+            for _ in self._iter_sequential(plan, result, call, abandoned, *args, **kwargs):
+                pass
+            if abandoned:
+                self._mark_incomplete(result, [plan.steps[ix] for ix in sorted(abandoned)])
+        else:
+            self._build_item(plan, result, call, *args, **kwargs)
+        return result
 
-        method_queue = self.r.keys()
-        executed_flag = 0
-        while len(method_queue) > 0:
-            method_queue, executed_flag = self._do_method_pass(
-                method_queue, executed_flag, result, pass_datastructure, flags,
-                *args, **kwargs)
+    def _build_item(self, plan, result, call, *args, **kwargs):
+        """
+        Executes each step of the plan in order, mutating and returning the result dictionary.
+        """
+        if call.tracer is not None:
+            trace = call.tracer.begin(plan)
+            for ix, step in enumerate(plan.steps):
+                data = call.datastructure(step, result, args)
+                self._merge_step(step, trace.call(ix, self._call_step, step, data, *args, **kwargs), result)
+            return result
+        if self.frozen and not self.observers:
+            if plan.build is None:
+                plan.build = generate_build(self, plan)
+            copy = dict if call.copy_datastructure else MappingProxyType
+            return plan.build(result, call.pass_datastructure, copy, args, kwargs)
+        for step in plan.steps:
+            self._run_step(step, result, call, *args, **kwargs)
         return result
 
+    def build_out_iter(self, flags, *args, **kwargs):
+        """
+        Streaming version of `build_out()`.  A generator which yields the return values of each method as soon as
+        it finishes, instead of returning the result dictionary once every method has finished.
+
+        Each return value is yielded as a `(key, value)` pair.  For a method registered without a key, the key
+        is None and the value is the dictionary which `build_out()` would merge into the result.  So:
+
+            for key, value in registry.build_out_iter(FLAGS.ALL, alb):
+                if key is None:
+                    index.update(value)
+                else:
+                    index[key] = value
+
+        The same methods run, in the same dependency order, as with `build_out()` and the same arguments.
+        Without an `executor` or `max_workers`, the methods run one at a time in plan order and each is only
+        called once the consumer asks for the next value.  Otherwise they run concurrently and their values are
+        yielded in the order the methods finish.  If any method was abandoned because of a `deadline` or a
+        `timeout`, the last pair is `(flagpole.INCOMPLETE, dict(flags=..., keys=[...]))`.
+
+        The `start_with` dictionary (or a new one) is still mutated as `build_out()` would, but the values it
+        started with are not yielded.
+
+        :param flags: User-supplied combination of FLAGS.  (ie. `flags = FLAGS.CORS | FLAGS.WEBSITE`)
+        :param *args: Passed on to the method registered in the FlagRegistry
+        :param **kwargs: Passed on to the method registered in the FlagRegistry, and every keyword argument of `build_out()`.
+        :return: Generator of (key, value) pairs.
+        """
+        call = _Call.from_kwargs(kwargs)
+        start_with = kwargs.pop('start_with', dict())
+        executor = kwargs.pop('executor', None)
+        max_workers = kwargs.pop('max_workers', None)
+
+        plan = self._get_plan(flags)
+        result = start_with or self._new_result(call)
+
+        steps = plan.steps
+        abandoned = set()
+        timed = call.deadline is not None or plan.timed
+        if executor is None and not (max_workers and len(steps) > 1):
+            for ix, retval in self._iter_sequential(plan, result, call, abandoned, *args, **kwargs):
+                for item in self._step_items(steps[ix], retval):
+                    yield item
+            if abandoned:
+                self._mark_incomplete(result, [steps[ix] for ix in sorted(abandoned)])
+                yield INCOMPLETE, result[INCOMPLETE]
+            return
+
+        own_executor = executor is None
+        if own_executor:
+            from concurrent.futures import ThreadPoolExecutor
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+        retvals = [None] * len(steps)
+        try:
+            for ix in self._iter_concurrent(plan, result, call, executor, retvals, abandoned, *args, **kwargs):
+                for item in self._step_items(steps[ix], retvals[ix]):
+                    yield item
+        finally:
+            if own_executor:
+                executor.shutdown(wait=not timed)
+
+        for ix, step in enumerate(steps):
+            if ix not in abandoned:
+                self._merge_step(step, retvals[ix], result)
+        if abandoned:
+            self._mark_incomplete(result, [steps[ix] for ix in sorted(abandoned)])
+            yield INCOMPLETE, result[INCOMPLETE]
+
+    def build_out_many(self, flags, items, *args, **kwargs):
+        """
+        Builds out many items with the same flags, yielding each result dictionary as it is finished.
+
+        The execution plan is resolved once for all items.  Each item is built out on a shared worker pool,
+        with at most `window` items in flight, so memory stays flat and the first results arrive before
+        the last items have been read from `items`.
+
+        Example:
+
+            for result in registry.build_out_many(FLAGS.ALL, albs, start_with_items=True, pass_datastructure=True, **conn):
+                save(result)
+
+        :param flags: User-supplied combination of FLAGS.  (ie. `flags = FLAGS.CORS | FLAGS.WEBSITE`)
+        :param items: Iterable of items.  Each item is passed to the registered methods as the first positional argument.
+        :param start_with_items: Instead of passing each item as an argument, use it as the `start_with` dictionary for its build out.
+        :param pass_datastructure: Same as `build_out()`.
+        :param copy_datastructure: Same as `build_out()`.
+        :param executor: A `concurrent.futures.Executor` to build the items on.  It is not shut down by build_out_many.
+        :param max_workers: Without an `executor`, build the items on a thread pool of this size.  Defaults to 8.
+        :param window: Maximum number of items in flight.  Defaults to twice `max_workers`, or with an `executor`,
+        twice its number of workers.  Plans with `batch_size`
+        methods keep at least as many items in flight as the largest `batch_size`.
+        :param ordered: Yield results in the order of `items` (default).  If False, yield them as they finish.
+        :param deadline: Seconds the whole sweep may take.  Items still being built when it passes come back
+        partial, marked as `build_out()` would, and so do the items started after it.
+        :param *args: Passed on to the method registered in the FlagRegistry, after the item.
+        :param **kwargs: Passed on to the method registered in the FlagRegistry
+        :return: A generator of result dictionaries.
+
+        Under a deadline, or for methods registered with a `timeout`, each method which can run out of time is
+        called on a thread of its own, so that abandoned methods never hold up the workers building the items.
+        Neither is supported together with methods registered with a `batch_size`, which raises a ValueError.
+        """
+        call = _Call.from_kwargs(kwargs)
+        start_with_items = kwargs.pop('start_with_items', False)
+        executor = kwargs.pop('executor', None)
+        max_workers = kwargs.pop('max_workers', None)
+        if max_workers is None:
+            # Executors which don't tell how many workers they have get the default window.
+            max_workers = getattr(executor, '_max_workers', None) or 8
+        window = kwargs.pop('window', None) or 2 * max_workers
+        ordered = kwargs.pop('ordered', True)
+
+        plan = self._get_plan(flags)
+        if (call.deadline is not None or plan.timed) and any(step.options.get('batch_size') for step in plan.steps):
+            raise ValueError('build_out_many() does not support a deadline or timeouts with batch_size methods.')
+        return self._build_out_many(
+            plan, items, start_with_items, call, executor, max_workers, window, ordered, args, kwargs)
+
+    def _build_out_many(self, plan, items, start_with_items, call, executor, max_workers, window, ordered, args, kwargs):
+        """
+        Generator behind `build_out_many()`.
+        """
+        from collections import deque
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+        owns_executor = executor is None
+        if owns_executor:
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+
+        items = iter(items)
+        pending = deque()
+
+        if call.deadline is not None or plan.timed:
+            def build(plan, result, call, *args, **kwargs):
+                return self._execute(plan, result, call, None, None, *args, **kwargs)
+        else:
+            build = self._build_item
+
+        def submit():
+            for item in items:
+                if start_with_items:
+                    pending.append(executor.submit(build, plan, item or self._new_result(call), call, *args, **kwargs))
+                else:
+                    pending.append(executor.submit(build, plan, self._new_result(call), call, item, *args, **kwargs))
+                if len(pending) >= window:
+                    return
+
+        batch_sizes = [step.options.get('batch_size') for step in plan.steps if step.options.get('batch_size')]
+        if batch_sizes:
+            # Chunks smaller than a batch would split every batch in two.
+            chunk_size = max([window] + batch_sizes)
+            try:
+                chunk = list()
+                for item in items:
+                    chunk.append(item)
+                    if len(chunk) >= chunk_size:
+                        for result in self._build_chunk(plan, chunk, start_with_items, call, executor, args, kwargs):
+                            yield result
+                        chunk = list()
+                for result in self._build_chunk(plan, chunk, start_with_items, call, executor, args, kwargs):
+                    yield result
+            finally:
+                if owns_executor:
+                    executor.shutdown(wait=True)
+            return
+
+        try:
+            submit()
+            while pending:
+                if ordered:
+                    yield pending.popleft().result()
+                else:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in [future for future in pending if future in done]:
+                        pending.remove(future)
+                        yield future.result()
+                submit()
+        finally:
+            for future in pending:
+                future.cancel()
+            if owns_executor:
+                executor.shutdown(wait=True)
+
+    def _build_chunk(self, plan, chunk, start_with_items, call, executor, args, kwargs):
+        """
+        Builds out a chunk of items one plan step at a time, for plans with batch-capable methods.
+
+        For each step, the pending items are either submitted to the executor one call per item, or
+        for a method registered with a `batch_size`, one call per chunk of up to `batch_size` items.
+
+        :return results: list of result dictionaries, in the order of `chunk`.
+        """
+        if start_with_items:
+            results = [item or self._new_result(call) for item in chunk]
+            item_args = [args] * len(chunk)
+        else:
+            results = [self._new_result(call) for _ in chunk]
+            item_args = [(item,) + tuple(args) for item in chunk]
+
+        for step in plan.steps:
+            calls = list()
+            for result, call_args in zip(results, item_args):
+                calls.append((call.datastructure(step, result, call_args), call_args))
+
+            batch_size = step.options.get('batch_size')
+            if batch_size:
+                method = step.method
+                if step.options.get('executor') is not None:
+                    method = functools.partial(self._call_elsewhere, step.options['executor'], method)
+                batch_kwargs = dict(kwargs)
+                if step.options.get('pass_requested'):
+                    batch_kwargs['requested_flags'] = step.requested_flags
+                futures = list()
+                for ix in range(0, len(calls), batch_size):
+                    batch = list()
+                    for result, (data, call_args) in zip(results[ix:ix + batch_size], calls[ix:ix + batch_size]):
+                        if data is None:
+                            # Without the datastructure, the per-item argument is the item itself.
+                            data = dict(result) if start_with_items else call_args[0]
+                        batch.append(data)
+                    futures.append((len(batch), executor.submit(self._observe, step, method, batch, *args, **batch_kwargs)))
+                retvals = list()
+                for size, future in futures:
+                    batch_retvals = future.result()
+                    if len(batch_retvals) != size:
+                        raise ValueError('{} returned {} values for a batch of {}.'.format(
+                            getattr(step.method, '__name__', step.method), len(batch_retvals), size))
+                    retvals.extend(batch_retvals)
+            else:
+                futures = [executor.submit(self._call_step, step, data, *call_args, **kwargs) for data, call_args in calls]
+                retvals = [future.result() for future in futures]
+
+            for result, retval in zip(results, retvals):
+                self._merge_step(step, retval, result)
+        return results
+
+    def refresh(self, result, flags, *args, **kwargs):
+        """
+        Re-runs the methods for `flags` on a result dictionary built out earlier, and mutates it in place.
+
+        Methods which depend on a refreshed method are re-run too, since their return values may have changed.
+        Every other key in the result is kept as it is, and is passed along to the methods which depend on it.
+        If a refreshed method depends on a key missing from the result, the method providing it is run as well.
+
+        Example:
+
+            alb = registry.build_out(FLAGS.ALL, start_with=alb, pass_datastructure=True, **conn)
+            ...
+            registry.refresh(alb, FLAGS.LISTENERS, pass_datastructure=True, **conn)  # also refreshes RULES
+
+        :param result: The dictionary returned by an earlier `build_out()`.
+        :param flags: The flags whose methods must be re-run.
+        :param built_with: The flags the result was built with.  Used to find the dependent methods to re-run.
+        By default it is inferred from the keys present in the result, which misses methods registered without a `key`.
+        :param pass_datastructure: Same as `build_out()`.
+        :param copy_datastructure: Same as `build_out()`.
+        :param deadline: Same as `build_out()`.  With a deadline, or methods registered with a `timeout`, methods which
+        run out of time are abandoned and the result is marked incomplete.  The keys of abandoned methods keep their
+        earlier values.
+        :param *args: Passed on to the method registered in the FlagRegistry
+        :param **kwargs: Passed on to the method registered in the FlagRegistry
+        :return result: The same dictionary, with the refreshed keys updated.  The keys listed under
+        `flagpole.INCOMPLETE` by the earlier build out are no longer listed once their method has been re-run.
+        """
+        call = _Call.from_kwargs(kwargs)
+        built_with = kwargs.pop('built_with', None)
+        incomplete = result.pop(INCOMPLETE, None)
+        if built_with is None:
+            built_with = self._infer_flags(result)
+            if incomplete is not None:
+                # The earlier build out was asked for these too.
+                built_with = built_with | incomplete['flags']
+
+        plan = self._get_plan(built_with | flags)
+        steps = plan.steps
+
+        stale = [bool(step.method_flag & flags) for step in steps]
+        for ix in range(len(steps)):
+            if stale[ix]:
+                for dependent in plan.dependents[ix]:
+                    stale[dependent] = True
+
+        for ix in reversed(range(len(steps))):
+            if stale[ix]:
+                for required in steps[ix].requires:
+                    if any(key and key not in result for key, rtv_ix in steps[required].slots):
+                        stale[required] = True
+
+        rerun = [ix for ix in range(len(steps)) if stale[ix]]
+        if call.deadline is not None or any(steps[ix].options.get('timeout') is not None for ix in rerun):
+            # Run the stale steps as a plan of their own.  The keys of the others are already in the result.
+            position = dict((ix, pos) for pos, ix in enumerate(rerun))
+            sub_steps = list()
+            for ix in rerun:
+                step = steps[ix]
+                sub_steps.append(_Step(
+                    step.method, step.method_flag, step.method_dependencies, step.slots, step.multi,
+                    requires=tuple(position[required] for required in step.requires if required in position),
+                    options=step.options, requested_flags=step.requested_flags))
+            self._execute(_Plan(plan.flags, sub_steps), result, call, None, None, *args, **kwargs)
+        else:
+            for ix in rerun:
+                self._run_step(steps[ix], result, call, *args, **kwargs)
+
+        if incomplete is not None:
+            # Whatever was missing before and was not re-run is still missing.
+            refreshed_flags = 0
+            refreshed_keys = set()
+            for ix in rerun:
+                refreshed_flags = refreshed_flags | steps[ix].requested_flags
+                refreshed_keys.update(key for key, rtv_ix in steps[ix].slots if key)
+            flags_left = incomplete['flags'] & ~refreshed_flags
+            keys_left = [key for key in incomplete['keys'] if key not in refreshed_keys]
+            if flags_left or keys_left:
+                still_incomplete = result.setdefault(INCOMPLETE, dict(flags=0, keys=list()))
+                still_incomplete['flags'] = still_incomplete['flags'] | flags_left
+                still_incomplete['keys'].extend(key for key in keys_left if key not in still_incomplete['keys'])
+        return result
+
+    def _infer_flags(self, result):
+        """
+        :return flags: The combination of the flags of every registered return value whose key is in `result`.
+        """
+        flags = 0
+        for method in self.r:
+            for entry in self.r[method]:
+                if entry['key'] and entry['key'] in result:
+                    flags = flags | entry['flag']
+        return flags
+
+    def build_out_lazy(self, flags, *args, **kwargs):
+        """
+        Lazy version of `build_out()`.  Returns a `flagpole.lazy.LazyResult` mapping instead of the result dictionary.
+
+        No method runs until a key is read.  Reading `result['rules']` runs only the method providing 'rules'
+        and the methods it depends on, and keeps their return values for later reads.  Iterating or calling
+        `result.to_dict()` runs every remaining method.
+
+        :param flags: User-supplied combination of FLAGS.  (ie. `flags = FLAGS.CORS | FLAGS.WEBSITE`)
+        :param pass_datastructure: Same as `build_out()`.
+        :param copy_datastructure: Same as `build_out()`.
+        :param start_with: Same as `build_out()`.  It is mutated as methods run.
+        :param record: Same as `build_out()`.
+        :param *args: Passed on to the method registered in the FlagRegistry
+        :param **kwargs: Passed on to the method registered in the FlagRegistry
+        :return result: LazyResult over the result dictionary.
+        :raises ValueError: With a `deadline`, an `executor`, `max_workers` or a `tracer`, or if any of the methods has
+        a `timeout`.  Methods run when a key is read, on the reading thread, where they can't be abandoned or run
+        concurrently, and whenever the key happens to be read.
+        """
+        call = _Call.from_kwargs(kwargs)
+        start_with = kwargs.pop('start_with', dict())
+        for name in ('executor', 'max_workers'):
+            if kwargs.pop(name, None) is not None:
+                raise ValueError('build_out_lazy() does not support `{}`: methods run on the thread reading the key.'.format(name))
+        if call.tracer is not None:
+            raise ValueError('build_out_lazy() does not support a tracer.')
+
+        plan = self._get_plan(flags)
+        if call.deadline is not None or plan.timed:
+            raise ValueError('build_out_lazy() does not support a deadline or methods with a timeout.')
+        return LazyResult(self, plan, start_with or self._new_result(call), call, args, kwargs)
+
+    def build_out_async(self, flags, *args, **kwargs):
+        """
+        asyncio version of `build_out()`.  Returns a coroutine which resolves to the result dictionary.
+
+        Methods may be registered as `async def` with the same decorator.  Every method is started as a task
+        which waits for the methods it depends on, so independent methods run at the same time on the event loop.
+        Methods which are not coroutine functions are run on a thread with `loop.run_in_executor()`.
+
+        As with a concurrent `build_out()`, a method that needs the datastructure receives a copy of the starting
+        result with the return values of the methods it depends on merged in, and all return values are merged
+        into the result dictionary in plan order once every method has finished.  If the result is itself one of
+        the *args, each return value is also merged into it as soon as its method finishes.
+
+        :param flags: User-supplied combination of FLAGS.  (ie. `flags = FLAGS.CORS | FLAGS.WEBSITE`)
+        :param pass_datastructure: Same as `build_out()`.
+        :param start_with: Same as `build_out()`.
+        :param executor: Executor for the methods which are not coroutine functions.  Defaults to the loop's default executor.
+        :param *args: Passed on to the method registered in the FlagRegistry
+        :param **kwargs: Passed on to the method registered in the FlagRegistry
+        :return result: The dictionary created by combining the output of all executed methods.
+        """
+        from flagpole._aio import build_out_async
+        return build_out_async(self, flags, *args, **kwargs)
+
+
+class FlagValue(int):
+    """
+    The int type of the members of a `Flags`.  Its repr shows the flag names:
+
+        >>> FLAGS.RULES
+        RULES
+        >>> FLAGS.parse('BASE|RULES')
+        BASE|RULES
+
+    Combining members (`FLAGS.BASE | FLAGS.RULES`) is plain int arithmetic and returns a plain int, so flags
+    cost no more than ints on the hot path.  Each Flags generates its own subclass, which knows its names.
+    `str()`, formatting, JSON and pickling treat values as plain ints.
+    """
+    __slots__ = ()
+
+    # Set on the generated subclasses.
+    _flags = None
+
+    @property
+    def names(self):
+        """
+        :return: tuple of the names of the flags set in this value.
+        :raises ValueError: If the value has bits set beyond `ALL`.
+        """
+        return self._flags.decode(self)
+
+    def __repr__(self):
+        try:
+            return '|'.join(self._flags.decode(self)) or 'NONE'
+        except ValueError:
+            return int.__repr__(self)
+
+    __str__ = int.__repr__
+
+    def __reduce__(self):
+        return int, (int(self),)
+
+
+# What Python 2 accepts as a `__slots__` entry.  Python 3 has `str.isidentifier()`.
+_identifier = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def _is_identifier(name):
+    if hasattr(name, 'isidentifier'):
+        return name.isidentifier()
+    return _identifier.match(name) is not None
+
 
 class Flags(object):
+    """
+    A set of named bit flags:
+
+        FLAGS = Flags('BASE', 'LISTENERS', 'RULES')
+        FLAGS.RULES                   # RULES (4)
+        FLAGS.parse('BASE|RULES')     # BASE|RULES (5)
+        FLAGS.decode(5)               # ('BASE', 'RULES')
+
+    Members are `FlagValue` ints, stored as real attributes of a `__slots__` subclass generated for each Flags.
+    `ALL` (every flag) and `None`/`NONE` (no flag) are added automatically.  `flags` maps the names to plain ints.
+    A flag named like an attribute of Flags itself (ie. `parse`) is only available as `FLAGS['parse']`, and
+    a flag whose name is not an identifier (ie. `my-flag`) as `FLAGS['my-flag']` or `getattr(FLAGS, 'my-flag')`.
+    """
+    __slots__ = ('flags', '_idx', '_by_name', '_bit_names', '_parsed', '_decoded')
+
+    # Number of distinct strings and values whose `parse()` and `decode()` results are cached.
+    cache_size = 1024
+
+    def __new__(cls, *flags):
+        if '_value_type' not in cls.__dict__:
+            names = [
+                name for name in tuple(flags) + ('ALL', 'None', 'NONE')
+                if _is_identifier(name) and not hasattr(cls, name)]
+            cls = type(cls.__name__, (cls,), dict(__slots__=tuple(names), _value_type=None))
+            cls._value_type = type('FlagValue', (FlagValue,), dict(__slots__=(), _flags=None))
+        return object.__new__(cls)
+
     def __init__(self, *flags):
-        from collections import OrderedDict
+        value_type = self._value_type
+        value_type._flags = self
         self.flags = OrderedDict()
         self._idx = 0
         for flag in flags:
@@ -267,8 +1708,86 @@ class Flags(object):
         self.flags['None'] = 0
         self.flags['NONE'] = 0
 
+        self._by_name = dict((name, self._value(value)) for name, value in self.flags.items())
+        self._bit_names = tuple(flags)
+        self._parsed = dict()
+        self._decoded = dict()
+        for name, value in self._by_name.items():
+            if name in type(self).__slots__:
+                object.__setattr__(self, name, value)
+
     def __getattr__(self, k):
-        return self.flags[k]
+        # Only for names shadowed by a method of Flags, or which can't be slots.  Everything else is a slot.
+        try:
+            return self._by_name[k]
+        except KeyError:
+            raise AttributeError(k)
+
+    def __getitem__(self, k):
+        return self._by_name[k]
+
+    def parse(self, text):
+        """
+        Parses a combination of flag names, ie. from a config file.
+
+        :param text: Names separated by `|`, ie. 'BASE|RULES'.  Whitespace is ignored.  An int is checked and
+        converted as is.
+        :return value: The FlagValue.
+        :raises ValueError: For an unknown name, or an int with bits set beyond `ALL`.
+        """
+        if isinstance(text, numbers.Integral):
+            if text < 0 or text & ~self.flags['ALL']:
+                raise ValueError('Not a combination of these flags: {!r}'.format(text))
+            return self._value(text)
+        value = self._parsed.get(text)
+        if value is None:
+            value = 0
+            for name in text.split('|'):
+                name = name.strip()
+                if name:
+                    try:
+                        value = value | self._by_name[name]
+                    except KeyError:
+                        raise ValueError('Unknown flag: {!r}'.format(name))
+            value = self._value(value)
+            if len(self._parsed) >= self.cache_size:
+                self._parsed.clear()
+            self._parsed[text] = value
+        return value
+
+    def _value(self, value):
+        """
+        :return: `value` as a FlagValue.  On Python 2, values beyond 63 bits are longs and stay plain longs.
+        """
+        return self._value_type(value) if isinstance(value, int) else value
+
+    def decode(self, value):
+        """
+        :return names: tuple of the names of the flags set in `value`, in the order they were defined.
+        :raises ValueError: If `value` has bits set beyond `ALL`.
+        """
+        names = self._decoded.get(value)
+        if names is None:
+            value = int(value)
+            if value < 0 or value & ~self.flags['ALL']:
+                raise ValueError('Not a combination of these flags: {!r}'.format(value))
+            bits = list()
+            remaining = value
+            while remaining:
+                bit = remaining & -remaining
+                bits.append(self._bit_names[bit.bit_length() - 1])
+                remaining = remaining ^ bit
+            names = tuple(bits)
+            if len(self._decoded) >= self.cache_size:
+                self._decoded.clear()
+            self._decoded[value] = names
+        return names
+
+    def __reduce__(self):
+        return Flags, tuple(self._bit_names)
 
     def __repr__(self):
-        return str(self.flags)
\ No newline at end of file
+        return str(self.flags)
+
+
+from flagpole.composite import CompositeRegistry  # noqa: E402  (needs the classes above)
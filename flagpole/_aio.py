@@ -0,0 +1,225 @@
+"""
+asyncio support for FlagRegistry.build_out_async.
+
+Kept in its own module so the rest of flagpole does not depend on `async def` syntax.
+"""
+import asyncio
+import functools
+import inspect
+import weakref
+
+from flagpole import _Call
+from flagpole.stats import _timer
+
+
+async def _call_step(registry, step, data, *args, **kwargs):
+    """
+    Coroutine version of `FlagRegistry._call_step()` for `async def` methods.
+    """
+    cache = step.options.get('cache')
+    cache_key = registry._cache_key(step, cache, *args, **kwargs) if cache is not None else None
+    if cache_key is not None:
+        hit, retval = cache.lookup(cache_key)
+        if hit:
+            if registry.observers:
+                registry._notify('on_method_skip', step, 'cache')
+            return retval
+
+    store_key = registry._store_key(step, *args, **kwargs) if 'persist' in step.options else None
+    if store_key is not None:
+        hit, retval = registry.store.get(*store_key)
+        if hit:
+            if registry.observers:
+                registry._notify('on_method_skip', step, 'store')
+            if cache_key is not None:
+                cache.store(cache_key, retval)
+            return retval
+
+    coalesce_key = registry._coalesce_key(step, *args, **kwargs) if step.options.get('coalesce') else None
+    if coalesce_key is None:
+        retval = await _observe(registry, step, data, *args, **kwargs)
+    else:
+        flights = _flights.setdefault(asyncio.get_running_loop(), dict())
+        flight = flights.get(coalesce_key)
+        if flight is None:
+            flight = flights[coalesce_key] = asyncio.ensure_future(_observe(registry, step, data, *args, **kwargs))
+            flight.add_done_callback(lambda _: flights.pop(coalesce_key, None))
+        elif registry.observers:
+            registry._notify('on_method_skip', step, 'coalesced')
+        # Shielded so a caller timing out does not cancel the call for the others sharing it.
+        retval = await asyncio.shield(flight)
+
+    if store_key is not None:
+        registry.store.put(*store_key, value=retval, ttl=step.options['persist'])
+    if cache_key is not None:
+        cache.store(cache_key, retval)
+    return retval
+
+
+# Coalesced `async def` calls in flight, per event loop: {loop: {coalesce_key: future}}
+_flights = weakref.WeakKeyDictionary()
+
+
+async def _observe(registry, step, data, *args, **kwargs):
+    """
+    Coroutine version of `FlagRegistry._observe()` for `async def` methods.
+    """
+    if registry.observers:
+        registry._notify('on_method_start', step)
+        start = _timer()
+        try:
+            retval = await _throttle(registry, step, data, *args, **kwargs)
+        except Exception as e:
+            registry._notify('on_method_error', step, _timer() - start, e)
+            raise
+        registry._notify('on_method_end', step, _timer() - start)
+        return retval
+    return await _throttle(registry, step, data, *args, **kwargs)
+
+
+# How often to check a limit which is waiting for other calls to finish.
+_LIMIT_POLL_INTERVAL = 0.01
+
+
+async def _throttle(registry, step, data, *args, **kwargs):
+    """
+    Coroutine version of `FlagRegistry._throttle()` for `async def` methods.  Waits on limits without blocking the loop.
+    """
+    limit = registry._get_limit(step)
+    retry = step.options.get('retry')
+
+    attempt = 0
+    while True:
+        if limit is not None:
+            wait = limit.try_acquire()
+            while wait != 0:
+                await asyncio.sleep(_LIMIT_POLL_INTERVAL if wait is None else wait)
+                wait = limit.try_acquire()
+        try:
+            return await _invoke_method(registry, step, data, *args, **kwargs)
+        except Exception as e:
+            if retry is None or not retry.should_retry(e, attempt):
+                raise
+        finally:
+            if limit is not None:
+                limit.release()
+        await asyncio.sleep(retry.delay(attempt))
+        attempt += 1
+
+
+async def _invoke_method(registry, step, data, *args, **kwargs):
+    """
+    Coroutine version of `FlagRegistry._invoke_method()` for `async def` methods.
+    """
+    if step.options.get('batch_size'):
+        # The batch's list of return values only exists once the coroutine has finished.
+        if data is None and args:
+            data, args = args[0], args[1:]
+        if step.options.get('pass_requested'):
+            kwargs['requested_flags'] = step.requested_flags
+        return (await step.method([data], *args, **kwargs))[0]
+    return await registry._invoke_method(step, data, *args, **kwargs)
+
+
+class _Abandoned(Exception):
+    """
+    Raised in the task of a method which ran past its timeout, and of the methods depending on it.
+    """
+
+
+async def build_out_async(registry, flags, *args, **kwargs):
+    """
+    See `FlagRegistry.build_out_async()`.
+    """
+    call = _Call.from_kwargs(kwargs)
+    start_with = kwargs.pop('start_with', dict())
+    executor = kwargs.pop('executor', None)
+
+    plan = registry._get_plan(flags)
+    result = start_with or registry._new_result(call)
+
+    steps = plan.steps
+    live = result in args
+    retvals = [None] * len(steps)
+    tasks = list()
+    loop = asyncio.get_running_loop()
+    trace = call.tracer.begin(plan) if call.tracer is not None else None
+
+    async def run(ix):
+        step = steps[ix]
+        if step.requires:
+            await asyncio.gather(*[tasks[required] for required in step.requires])
+
+        timeout = step.options.get('timeout')
+        if timeout is None:
+            retvals[ix] = await call_method(ix)
+        else:
+            try:
+                retvals[ix] = await asyncio.wait_for(call_method(ix), timeout)
+            except asyncio.TimeoutError:
+                raise _Abandoned()
+        if live:
+            # Methods read the keys of the methods they depend on from the result itself.
+            registry._merge_step(step, retvals[ix], result)
+
+    async def call_method(ix):
+        step = steps[ix]
+        data = None
+        if call.needs_datastructure(step, result, args):
+            data = dict(result)
+            for ancestor in plan.ancestors(ix):
+                registry._merge_step(steps[ancestor], retvals[ancestor], data)
+
+        if not inspect.iscoroutinefunction(step.method):
+            if trace is not None:
+                fn = functools.partial(trace.call, ix, registry._call_step, step, data, *args, **kwargs)
+            else:
+                fn = functools.partial(registry._call_step, step, data, *args, **kwargs)
+            return await loop.run_in_executor(executor, fn)
+
+        if trace is None:
+            return await _call_step(registry, step, data, *args, **kwargs)
+        span = trace.start(ix)
+        try:
+            retval = await _call_step(registry, step, data, *args, **kwargs)
+        except BaseException as e:
+            trace.finish(span, e)
+            raise
+        trace.finish(span)
+        return retval
+
+    for ix in range(len(steps)):
+        tasks.append(asyncio.ensure_future(run(ix)))
+
+    abandoned = list()
+    try:
+        pending = set(tasks)
+        while pending:
+            timeout = None if call.deadline is None else max(0, call.deadline - _timer())
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                if task.exception() is not None and not isinstance(task.exception(), _Abandoned):
+                    raise task.exception()
+            if not done:
+                # The deadline passed.
+                break
+
+        for ix, task in enumerate(tasks):
+            if not task.done():
+                task.cancel()
+                abandoned.append(ix)
+            elif isinstance(task.exception(), _Abandoned):
+                abandoned.append(ix)
+            elif task.exception() is not None:
+                raise task.exception()
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+    for ix, step in enumerate(steps):
+        if ix not in abandoned:
+            registry._merge_step(step, retvals[ix], result)
+    if abandoned:
+        registry._mark_incomplete(result, [steps[ix] for ix in abandoned])
+    return result
@@ -0,0 +1,54 @@
+"""
+Code generation for frozen FlagRegistries.  See `FlagRegistry.freeze()`.
+
+Each compiled _Plan is turned into a straight-line function which calls the methods one after the other
+and writes their return values into the result dictionary, doing at generation time everything
+`FlagRegistry._build_item()` would otherwise work out again on every call.
+"""
+
+
+def generate_build(registry, plan):
+    """
+    :return build: function(result, pass_datastructure, copy, args, kwargs) running every step of the plan in order
+    and mutating the result dictionary exactly like `FlagRegistry._build_item()`.  `copy` turns the result into
+    the datastructure passed to the methods (`dict` or `MappingProxyType`).
+    """
+    namespace = dict(call_step=registry._call_step)
+    lines = ['def build(result, pass_datastructure, copy, args, kwargs):']
+    for ix, step in enumerate(plan.steps):
+        namespace['m{}'.format(ix)] = step.method
+        namespace['s{}'.format(ix)] = step
+        lines.append('    # {}'.format(getattr(step.method, '__name__', 'step {}'.format(ix))))
+
+        if step.method_dependencies:
+            needs_data = 'result not in args'
+        else:
+            needs_data = 'pass_datastructure and result not in args'
+
+        if step.options:
+            # Caching, limits and the like go through the general path, for this step only.
+            lines.append('    if {}:'.format(needs_data))
+            lines.append('        retval = call_step(s{}, copy(result), *args, **kwargs)'.format(ix))
+            lines.append('    else:')
+            lines.append('        retval = call_step(s{}, None, *args, **kwargs)'.format(ix))
+        else:
+            lines.append('    if {}:'.format(needs_data))
+            lines.append('        retval = m{}(copy(result), *args, **kwargs)'.format(ix))
+            lines.append('    else:')
+            lines.append('        retval = m{}(*args, **kwargs)'.format(ix))
+
+        for slot_ix, (key, rtv_ix) in enumerate(step.slots):
+            value = 'retval[{}]'.format(rtv_ix) if step.multi else 'retval'
+            if key:
+                name = 'k{}_{}'.format(ix, slot_ix)
+                namespace[name] = key
+                lines.append('    result[{}] = {}'.format(name, value))
+            else:
+                lines.append('    result.update({})'.format(value))
+    lines.append('    return result')
+
+    source = '\n'.join(lines) + '\n'
+    exec(compile(source, '<flagpole build {}>'.format(plan.flags), 'exec'), namespace)
+    build = namespace['build']
+    build.source = source
+    return build
@@ -0,0 +1,148 @@
+"""
+Result caches for methods registered with a FlagRegistry.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    _clock = time.monotonic
+except AttributeError:  # Python 2
+    _clock = time.time
+
+
+def make_key(*args, **kwargs):
+    """
+    Default cache key: the positional arguments and the sorted keyword arguments.
+
+    :return key: A hashable key, or None if any of the arguments are not hashable.
+    """
+    key = (args, tuple(sorted(kwargs.items())))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+class TTLCache(object):
+    """
+    A bounded, thread-safe cache for the return values of a registered method.
+
+    Entries are evicted least-recently-used first once `maxsize` is reached, and
+    expire `ttl` seconds after they were stored.
+
+    Example:
+
+        @registry.register(flag=FLAGS.POLICY, key='policy', cache=TTLCache(maxsize=64, ttl=300))
+        def get_account_policy(alb, account_number=None, **conn):
+            pass
+
+    The cache key is built from the *args/**kwargs passed to `build_out()`, not from the datastructure.
+    Pass a `key` function to choose what identifies a call, for example `key=lambda alb, **conn: conn['account_number']`.
+    Calls whose key is None (or not hashable, with the default key) are not cached.
+
+    Cached return values are shared between every `build_out()` that hits them, so they must not be mutated.
+
+    :param maxsize: Maximum number of entries, at least 1.
+    :param ttl: Seconds an entry stays fresh.  None means entries never expire.
+    :param key: Function over the method's *args/**kwargs returning the cache key.
+    """
+    def __init__(self, maxsize=128, ttl=None, key=None):
+        if maxsize < 1:
+            raise ValueError('TTLCache maxsize must be at least 1, not {}.'.format(maxsize))
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.make_key = key or make_key
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, key):
+        """
+        :return hit: True if a fresh value is cached for `key`.
+        :return value: The cached value, or None.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and (entry[0] is None or entry[0] > _clock()):
+                self._entries[key] = entry
+                self.hits += 1
+                return True, entry[1]
+            self.misses += 1
+            return False, None
+
+    def store(self, key, value):
+        expires = _clock() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries.pop(key, None)
+            while len(self._entries) >= self.maxsize:
+                self._entries.popitem(last=False)
+            self._entries[key] = (expires, value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return 'TTLCache(maxsize={}, ttl={}, size={}, hits={}, misses={})'.format(
+            self.maxsize, self.ttl, len(self), self.hits, self.misses)
+
+
+class _Flight(object):
+    __slots__ = ('event', 'value', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Lets concurrent calls with the same key share a single execution.
+
+    The first caller for a key runs the function.  Callers arriving with the same key while it is
+    running wait for it, and get its return value (or its exception) instead of running it again.
+    Nothing is kept once the call finishes; combine with a TTLCache to also reuse finished calls.
+    """
+    def __init__(self):
+        self._flights = dict()
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        :return shared: True if the value came from a call made by another caller.
+        :return value: fn(*args, **kwargs)
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return True, flight.value
+
+        try:
+            flight.value = fn(*args, **kwargs)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.event.set()
+        return False, flight.value
+
+    def __len__(self):
+        return len(self._flights)
@@ -0,0 +1,347 @@
+"""
+Several FlagRegistries built out together as one dependency graph.
+"""
+import heapq
+from collections import OrderedDict
+
+from flagpole import CircularDependencyError, _Call
+
+
+class _Node(object):
+    """
+    A method call within a composite plan.
+
+    :param name: Name of the registry the method is called through.
+    :param step: Its _Step in that registry's plan.
+    :param targets: list of (registry name, _Step) whose slots the return value fills in.  More than one if
+    the same method is registered the same way with several of the registries.
+    :param requires: tuple of the indices of the nodes it depends on, in any registry.
+    :param cross: True if it depends on methods of another registry.
+    """
+    __slots__ = ('name', 'step', 'targets', 'requires', 'cross')
+
+    def __init__(self, name, step):
+        self.name = name
+        self.step = step
+        self.targets = [(name, step)]
+        self.requires = set()
+        self.cross = False
+
+
+def _same_call(step, other):
+    """
+    :return: True if the steps of a method registered with two registries call it the same way, so one call can
+    fill in the keys of both.
+    """
+    if step.options != other.options or bool(step.method_dependencies) != bool(other.method_dependencies):
+        return False
+    return not step.options.get('pass_requested') or step.requested_flags == other.requested_flags
+
+
+class _CompositePlan(object):
+    """
+    The compiled form of a `CompositeRegistry.build_out()` call for one set of flags.
+
+    :param flags: dict mapping each registry name to the flags its plan was fetched with.
+    :param plans: OrderedDict mapping each registry name to its _Plan.
+    :param nodes: list of _Node, in an order in which they can be executed.
+    """
+    __slots__ = ('flags', 'plans', 'nodes', 'dependents', 'ancestors')
+
+    def __init__(self, flags, plans, nodes):
+        self.flags = flags
+        self.plans = plans
+        self.nodes = nodes
+        self.dependents = [list() for _ in nodes]
+        self.ancestors = list()
+        for ix, node in enumerate(nodes):
+            node_ancestors = set(node.requires)
+            for required in node.requires:
+                self.dependents[required].append(ix)
+                node_ancestors.update(self.ancestors[required])
+            self.ancestors.append(tuple(sorted(node_ancestors)))
+
+
+class CompositeRegistry(object):
+    """
+    Builds out several FlagRegistries as a single dependency graph, so that the methods of different
+    registries run at the same time on one executor, and methods of one registry can depend on another's.
+
+    Example:
+
+        account = CompositeRegistry(OrderedDict(iam=IAMFlagRegistry, s3=S3FlagRegistry))
+        account.depends(('s3', S3_FLAGS.POLICY), on=('iam', IAM_FLAGS.ROLES))
+        result = account.build_out(dict(iam=IAM_FLAGS.ALL, s3=S3_FLAGS.ALL), account_number='123', max_workers=8)
+        result['s3']['policy']
+
+    Flags are always paired with the name of their registry, so the bits of independent `Flags` never collide.
+
+    A method with a dependency on another registry is passed its own registry's datastructure, with the return
+    values of the methods it depends on in the other registries nested under their registry name
+    (ie. `data['iam']['roles']`).  A method registered with several of the registries is called once, and its
+    return value fills in the keys it was registered with in each of them.
+
+    Every method is passed the same *args/**kwargs, and goes through its own registry's caching, limits and
+    observers.  A method registered with several registries is only called once if it is registered the same way
+    with each (same options, and the same requested flags if it is passed them); otherwise it is called for each.
+
+    Timeouts, deadlines, tracers and read-only views are not supported across registries: `build_out()` raises
+    a ValueError for them, and for registries with methods registered with a `timeout`.
+    """
+
+    # Number of distinct `flags` values whose composite plans are cached.
+    plan_cache_size = 128
+
+    def __init__(self, registries=None):
+        self.registries = OrderedDict()
+        self._dependencies = list()
+        self._plans = OrderedDict()
+        for name, registry in (registries or dict()).items():
+            self.add(name, registry)
+
+    def add(self, name, registry):
+        """
+        Adds a FlagRegistry under `name`.  Its results are returned under the same name.
+        """
+        self.registries[name] = registry
+        self._plans.clear()
+
+    def depends(self, dependent, on):
+        """
+        Declares a dependency between registries.
+
+        :param dependent: (registry name, flags).  The methods of the registry providing any of these flags...
+        :param on: ...depend on the methods of this (registry name, flags), or on each of a list of them.
+        """
+        if dependent[0] not in self.registries:
+            raise KeyError(dependent[0])
+        for upstream in on if isinstance(on, list) else [on]:
+            if upstream[0] not in self.registries:
+                raise KeyError(upstream[0])
+            self._dependencies.append(((dependent[0], int(dependent[1])), (upstream[0], int(upstream[1]))))
+        self._plans.clear()
+
+    def _expand_flags(self, flags):
+        """
+        :return flags: The flags for each registry, with the flags of the upstream methods of the requested ones added.
+        """
+        flags = dict((name, int(value)) for name, value in flags.items())
+        changed = True
+        while changed:
+            changed = False
+            for (name, flag), (upstream, upstream_flag) in self._dependencies:
+                if name not in flags or not self.registries[name]._validate_flags(flags[name]) & flag:
+                    continue
+                if flags.get(upstream, 0) & upstream_flag != upstream_flag:
+                    flags[upstream] = flags.get(upstream, 0) | upstream_flag
+                    changed = True
+        return flags
+
+    def _compile_plan(self, flags):
+        """
+        Combines the plans of the registries into a single graph.
+
+        :raises CircularDependencyError: If the dependencies between registries form a cycle.
+        """
+        flags = self._expand_flags(flags)
+        plans = OrderedDict(
+            (name, registry._get_plan(flags[name])) for name, registry in self.registries.items() if name in flags)
+
+        nodes = list()
+        node_of = dict()
+        by_method = dict()
+        for name, plan in plans.items():
+            for ix, step in enumerate(plan.steps):
+                shared = [node_ix for node_ix in by_method.get(step.method, ()) if _same_call(nodes[node_ix].step, step)]
+                if shared:
+                    node_ix = shared[0]
+                    nodes[node_ix].targets.append((name, step))
+                else:
+                    node_ix = len(nodes)
+                    by_method.setdefault(step.method, list()).append(node_ix)
+                    nodes.append(_Node(name, step))
+                node_of[(name, ix)] = node_ix
+                nodes[node_ix].requires.update(node_of[(name, required)] for required in step.requires)
+
+        for (name, flag), (upstream, upstream_flag) in self._dependencies:
+            if name not in plans:
+                continue
+            providers = [node_of[(upstream, ix)] for ix, step in enumerate(plans[upstream].steps)
+                         if step.method_flag & upstream_flag]
+            for ix, step in enumerate(plans[name].steps):
+                if step.method_flag & flag:
+                    node = nodes[node_of[(name, ix)]]
+                    node.requires.update(providers)
+                    node.cross = True
+
+        return _CompositePlan(flags, plans, self._order(nodes))
+
+    def _order(self, nodes):
+        """
+        :return nodes: The nodes in topological order, ties going to the one added first, with `requires` renumbered.
+        """
+        waiting = [len(node.requires) for node in nodes]
+        dependents = [list() for _ in nodes]
+        for ix, node in enumerate(nodes):
+            for required in node.requires:
+                dependents[required].append(ix)
+
+        ready = [ix for ix, count in enumerate(waiting) if not count]
+        heapq.heapify(ready)
+        order = list()
+        while ready:
+            ix = heapq.heappop(ready)
+            order.append(ix)
+            for dependent in dependents[ix]:
+                waiting[dependent] -= 1
+                if not waiting[dependent]:
+                    heapq.heappush(ready, dependent)
+
+        if len(order) < len(nodes):
+            # Every node left over still waits on another left over node.
+            # Walk upstream from any of them until we revisit one to name the cycle.
+            path = [next(ix for ix in range(len(nodes)) if waiting[ix])]
+            while True:
+                ix = next(required for required in sorted(nodes[path[-1]].requires) if waiting[required])
+                if ix in path:
+                    cycle = path[path.index(ix):] + [ix]
+                    raise CircularDependencyError([nodes[node_ix].step.method for node_ix in cycle])
+                path.append(ix)
+
+        position = dict((ix, pos) for pos, ix in enumerate(order))
+        ordered = list()
+        for ix in order:
+            node = nodes[ix]
+            node.requires = tuple(sorted(position[required] for required in node.requires))
+            ordered.append(node)
+        return ordered
+
+    def _get_plan(self, flags):
+        """
+        Returns the cached _CompositePlan for `flags`, compiling it on a cache miss or if any registry's plan changed.
+        """
+        cache_key = tuple(sorted((name, int(value)) for name, value in flags.items()))
+        plan = self._plans.get(cache_key)
+        if plan is not None and all(
+                self.registries[name]._plans.get(plan.flags[name]) is registry_plan
+                for name, registry_plan in plan.plans.items()):
+            return plan
+
+        plan = self._compile_plan(flags)
+        if len(self._plans) >= self.plan_cache_size:
+            self._plans.popitem(last=False)
+        self._plans[cache_key] = plan
+        return plan
+
+    def build_out(self, flags, *args, **kwargs):
+        """
+        Builds out every registry in `flags` as a single graph.
+
+        :param flags: dict mapping registry names to their flags.  Registries only needed by a dependency are built too.
+        :param pass_datastructure: Same as `FlagRegistry.build_out()`.
+        :param start_with: dict mapping registry names to the dictionary to mutate for that registry.
+        :param executor: A `concurrent.futures.Executor` to run the methods of every registry on.
+        :param max_workers: Without an `executor`, run the methods on a thread pool of this size created for this call.
+        Without either, the methods run one at a time.
+        :param *args: Passed on to every method.
+        :param **kwargs: Passed on to every method.
+        :return result: dict mapping each registry name to its result dictionary.
+        :raises ValueError: For a `tracer`, `deadline` or `copy_datastructure=False`, or if any of the methods has
+        a `timeout`.
+        """
+        for option in ('tracer', 'deadline'):
+            if kwargs.get(option) is not None:
+                raise ValueError('CompositeRegistry.build_out() does not support {}.'.format(option))
+        if not kwargs.get('copy_datastructure', True):
+            raise ValueError('CompositeRegistry.build_out() does not support copy_datastructure=False.')
+        call = _Call.from_kwargs(kwargs)
+        start_with = kwargs.pop('start_with', None) or dict()
+        executor = kwargs.pop('executor', None)
+        max_workers = kwargs.pop('max_workers', None)
+
+        plan = self._get_plan(flags)
+        timed = [name for name, registry_plan in plan.plans.items() if registry_plan.timed]
+        if timed:
+            raise ValueError('CompositeRegistry.build_out() does not support methods with a timeout ({}).'.format(
+                ', '.join(timed)))
+        results = OrderedDict()
+        for name in plan.plans:
+            results[name] = start_with.get(name) or self.registries[name]._new_result(call)
+
+        if executor is None and max_workers:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                retvals = self._run(plan, results, call, executor, args, kwargs)
+        else:
+            retvals = self._run(plan, results, call, executor, args, kwargs)
+
+        # Merge in the order of each registry's plan, as its own build_out would.
+        node_of = dict()
+        for node_ix, node in enumerate(plan.nodes):
+            for name, step in node.targets:
+                node_of[(name, step.method)] = node_ix
+        for name, registry_plan in plan.plans.items():
+            registry = self.registries[name]
+            for step in registry_plan.steps:
+                registry._merge_step(step, retvals[node_of[(name, step.method)]], results[name])
+        return dict(results)
+
+    def _datastructure(self, plan, node_ix, results, call, retvals, args):
+        """
+        :return data: What to pass the node's method as its first argument, or None.
+        """
+        node = plan.nodes[node_ix]
+        result = results[node.name]
+        if not node.cross and not call.needs_datastructure(node.step, result, args):
+            return None
+
+        data = dict(result)
+        for ancestor in plan.ancestors[node_ix]:
+            for name, step in plan.nodes[ancestor].targets:
+                target = data if name == node.name else data.setdefault(name, dict(results[name]))
+                self.registries[name]._merge_step(step, retvals[ancestor], target)
+        return data
+
+    def _run(self, plan, results, call, executor, args, kwargs):
+        """
+        Calls every node of the plan, one at a time or on the executor as soon as the nodes it depends on have finished.
+
+        :return retvals: list of the return value of each node.
+        """
+        nodes = plan.nodes
+        retvals = [None] * len(nodes)
+
+        def run(ix, data):
+            node = nodes[ix]
+            return self.registries[node.name]._call_step(node.step, data, *args, **kwargs)
+
+        if executor is None:
+            for ix in range(len(nodes)):
+                retvals[ix] = run(ix, self._datastructure(plan, ix, results, call, retvals, args))
+            return retvals
+
+        from concurrent.futures import wait, FIRST_COMPLETED
+        waiting = [len(node.requires) for node in nodes]
+        futures = dict()
+
+        def submit(ix):
+            futures[executor.submit(run, ix, self._datastructure(plan, ix, results, call, retvals, args))] = ix
+
+        for ix in range(len(nodes)):
+            if not waiting[ix]:
+                submit(ix)
+        try:
+            while futures:
+                done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+                for future in done:
+                    ix = futures.pop(future)
+                    retvals[ix] = future.result()
+                    for dependent in plan.dependents[ix]:
+                        waiting[dependent] -= 1
+                        if not waiting[dependent]:
+                            submit(dependent)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+        return retvals
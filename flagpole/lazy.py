@@ -0,0 +1,91 @@
+"""
+Lazy build outs, where each registered method only runs when one of its keys is read.
+"""
+import threading
+
+try:
+    from collections.abc import Mapping
+except ImportError:  # Python 2
+    from collections import Mapping
+
+
+class LazyResult(Mapping):
+    """
+    Read-only mapping returned by `FlagRegistry.build_out_lazy()`.
+
+    Reading a key runs the registered method providing it, after the methods it depends on, and keeps
+    the return values.  Keys from methods registered without a `key` are only known once those methods
+    have run, so reading a key no method provides runs all of them.
+
+    Iterating, `len()`, `to_dict()`, `dict(result)` and pickling run every remaining method first.
+    Use `json.dumps(result.to_dict())` to serialize.
+    """
+    def __init__(self, registry, plan, result, call, args, kwargs):
+        self._registry = registry
+        self._plan = plan
+        self._result = result
+        self._call = call
+        self._args = args
+        self._kwargs = kwargs
+        self._done = [False] * len(plan.steps)
+        self._lock = threading.RLock()
+
+    def _run(self, ix):
+        """
+        Runs the step at `ix` and any of its ancestors which have not run yet, in plan order.
+        """
+        with self._lock:
+            if self._done[ix]:
+                return
+            for step_ix in self._plan.ancestors(ix) + (ix,):
+                if not self._done[step_ix]:
+                    self._registry._run_step(
+                        self._plan.steps[step_ix], self._result, self._call, *self._args, **self._kwargs)
+                    self._done[step_ix] = True
+
+    def _resolve(self, key):
+        """
+        Runs whatever is needed for `key` to be in the result, if any method provides it.
+        """
+        key_steps, keyless_steps = self._plan.key_index()
+        if key in key_steps:
+            self._run(key_steps[key])
+        elif key not in self._result:
+            for ix in keyless_steps:
+                self._run(ix)
+
+    def __getitem__(self, key):
+        self._resolve(key)
+        return self._result[key]
+
+    def __contains__(self, key):
+        self._resolve(key)
+        return key in self._result
+
+    def __iter__(self):
+        return iter(self.to_dict())
+
+    def __len__(self):
+        return len(self.to_dict())
+
+    def to_dict(self):
+        """
+        Runs every remaining method and returns the result dictionary.
+        """
+        for ix in range(len(self._done)):
+            if not self._done[ix]:
+                self._run(ix)
+        return self._result
+
+    def pending(self):
+        """
+        :return: The methods which have not run yet.
+        """
+        return [step.method for step, done in zip(self._plan.steps, self._done) if not done]
+
+    def __reduce__(self):
+        return dict, (self.to_dict(),)
+
+    def __repr__(self):
+        return 'LazyResult({!r}, pending={})'.format(
+            self._result, [getattr(method, '__name__', method) for method in self.pending()])
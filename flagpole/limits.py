@@ -0,0 +1,129 @@
+"""
+Rate limits, concurrency caps and retries for methods registered with a FlagRegistry.
+"""
+import random
+import threading
+
+from flagpole.cache import _clock
+
+
+class Limit(object):
+    """
+    A token bucket rate limit combined with a cap on the number of calls in flight.
+
+    One Limit is shared by every method registered with it, across every concurrent `build_out()`
+    on the registry.  Declare named limits with `registry.add_limit(name, ...)`, and use them with
+    `register(..., limit=name)`:
+
+        registry.add_limit('elbv2', rate=10, burst=20, max_in_flight=4)
+
+        @registry.register(flag=FLAGS.LISTENERS, key='listeners', limit='elbv2')
+        def get_listeners(alb, **conn):
+            pass
+
+    :param rate: Calls per second allowed on average.  None means no rate limit.
+    :param burst: Calls allowed at once after a quiet period.  Defaults to `rate` (at least 1).
+    :param max_in_flight: Calls allowed to run at the same time.  None means no cap.
+    """
+    def __init__(self, rate=None, burst=None, max_in_flight=None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate or 1))
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self._tokens = float(self.burst)
+        self._updated = _clock()
+        self._condition = threading.Condition()
+
+    def try_acquire(self):
+        """
+        Takes a token and an in-flight slot if both are available.
+
+        :return wait: 0 if acquired.  Otherwise the seconds until a token is available,
+        or None if the call has to wait for another call to finish.
+        """
+        with self._condition:
+            return self._try_acquire()
+
+    def _try_acquire(self):
+        if self.max_in_flight is not None and self.in_flight >= self.max_in_flight:
+            return None
+        if self.rate:
+            now = _clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1:
+                return (1 - self._tokens) / self.rate
+            self._tokens -= 1
+        self.in_flight += 1
+        return 0
+
+    def acquire(self):
+        """
+        Blocks until a token and an in-flight slot are available, and takes them.
+        """
+        with self._condition:
+            while True:
+                wait = self._try_acquire()
+                if wait == 0:
+                    return
+                self._condition.wait(wait)
+
+    def release(self):
+        """
+        Gives back the in-flight slot taken by `acquire()`.
+        """
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def __repr__(self):
+        return 'Limit(rate={}, burst={}, max_in_flight={}, in_flight={})'.format(
+            self.rate, self.burst, self.max_in_flight, self.in_flight)
+
+
+class Retry(object):
+    """
+    Retries a registered method with jittered exponential backoff when it raises a throttling error.
+
+        @registry.register(flag=FLAGS.RULES, key='rules', retry=Retry(on=is_throttling_error))
+        def get_rules(alb, **conn):
+            pass
+
+    The n-th retry waits a random time between 0 and min(`max_backoff`, `backoff` * 2**n) seconds,
+    so calls throttled together do not all retry together.
+
+    :param on: The exception class (or tuple of classes) to retry, or a function taking the exception and
+    returning True if it should be retried.
+    :param attempts: Maximum number of calls, including the first one.
+    :param backoff: Seconds of the first backoff window.
+    :param max_backoff: Largest backoff window, in seconds.
+    """
+    def __init__(self, on, attempts=5, backoff=0.1, max_backoff=5.0):
+        self.on = on
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def should_retry(self, error, attempt):
+        """
+        :param error: The exception raised by the method.
+        :param attempt: Zero-based number of the call which raised it.
+        """
+        if attempt + 1 >= self.attempts:
+            return False
+        if isinstance(self.on, (type, tuple)):
+            return isinstance(error, self.on)
+        return bool(self.on(error))
+
+    def delay(self, attempt):
+        """
+        :return: Seconds to wait before retrying after call number `attempt` failed.
+        """
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
@@ -0,0 +1,150 @@
+"""
+Compact result records, an alternative to a dict per build out.  See `FlagRegistry.record_class()`.
+"""
+import keyword
+
+try:
+    from collections.abc import Mapping, MutableMapping
+except ImportError:  # Python 2
+    from collections import Mapping, MutableMapping
+
+# The Python 2 ABCs have no __slots__, so inheriting from them would give every record a __dict__.
+# There, Record gets their mixin methods copied in instead, and is registered as a virtual subclass.
+_slotted_abcs = '__slots__' in vars(MutableMapping)
+
+
+class Record(MutableMapping if _slotted_abcs else object):
+    """
+    Base class of the generated record classes.
+
+    A record is a mutable mapping with one `__slots__` slot per registered key, so it takes a fraction
+    of the memory of a dict with the same keys and a key can be read as an attribute (`record.rules`).
+    Keys which are not valid attribute names, or which are the names of methods (`keys`, `update`, ...),
+    are only available as items.  Keys outside of the
+    registered ones (from methods registered without a `key`, or `start_with`) are kept in a dict
+    which is only created when needed.
+
+    Iteration follows the order of the registered keys, followed by the other keys in insertion order.
+    Records compare equal to dicts with the same items.  Use `to_dict()` to convert, ie. for `json.dumps()`.
+    """
+    __slots__ = ('_extra',)
+
+    # Set on the generated classes: tuple of (key, slot name) and {key: slot name}.
+    _fields = ()
+    _slot_of = {}
+
+    def __getitem__(self, key):
+        slot = self._slot_of.get(key)
+        if slot is not None:
+            try:
+                return getattr(self, slot)
+            except AttributeError:
+                raise KeyError(key)
+        extra = getattr(self, '_extra', None)
+        if extra is None:
+            raise KeyError(key)
+        return extra[key]
+
+    def __setitem__(self, key, value):
+        slot = self._slot_of.get(key)
+        if slot is not None:
+            setattr(self, slot, value)
+            return
+        try:
+            self._extra[key] = value
+        except AttributeError:
+            self._extra = {key: value}
+
+    def __delitem__(self, key):
+        slot = self._slot_of.get(key)
+        if slot is not None:
+            try:
+                delattr(self, slot)
+            except AttributeError:
+                raise KeyError(key)
+            return
+        extra = getattr(self, '_extra', None)
+        if extra is None:
+            raise KeyError(key)
+        del extra[key]
+
+    def __contains__(self, key):
+        slot = self._slot_of.get(key)
+        if slot is not None:
+            return hasattr(self, slot)
+        extra = getattr(self, '_extra', None)
+        return extra is not None and key in extra
+
+    def __iter__(self):
+        for key, slot in self._fields:
+            if hasattr(self, slot):
+                yield key
+        extra = getattr(self, '_extra', None)
+        if extra:
+            for key in list(extra):
+                yield key
+
+    def __len__(self):
+        extra = getattr(self, '_extra', None)
+        return sum(1 for key, slot in self._fields if hasattr(self, slot)) + (len(extra) if extra else 0)
+
+    def update(self, *args, **kwargs):
+        # Faster than the MutableMapping mixin, for the dicts merged in by methods without a key.
+        for other in args + (kwargs,):
+            items = other.items() if hasattr(other, 'items') else other
+            for key, value in items:
+                self[key] = value
+
+    def to_dict(self):
+        return dict((key, self[key]) for key in self)
+
+    def __reduce__(self):
+        # The generated classes can't be found by name, so records pickle by their keys and items.
+        return _unpickle_record, (tuple(key for key, slot in self._fields), self.to_dict())
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, self.to_dict())
+
+
+if not _slotted_abcs:
+    for _abc in (MutableMapping, Mapping):
+        for _name, _value in vars(_abc).items():
+            if _name not in vars(Record) and not _name.startswith('_abc') and \
+                    _name not in ('__abstractmethods__', '__doc__', '__module__'):
+                setattr(Record, _name, _value)
+    MutableMapping.register(Record)
+
+
+_classes = dict()
+
+
+def record_class(keys, name='Record'):
+    """
+    :param keys: The keys to give a slot, in order.
+    :return cls: The Record subclass for these keys.  Classes are cached by `keys`.
+    """
+    keys = tuple(keys)
+    cls = _classes.get((keys, name))
+    if cls is None:
+        fields = list()
+        for ix, key in enumerate(keys):
+            valid = isinstance(key, str) and not key.startswith('_') and not keyword.iskeyword(key)
+            try:
+                valid = valid and key.isidentifier()
+            except AttributeError:  # Python 2
+                valid = valid and key.replace('_', 'a').isalnum() and not key[:1].isdigit()
+            # A slot named after a method would hide it from every record.
+            valid = valid and not hasattr(Record, key)
+            fields.append((key, key if valid else '_{}'.format(ix)))
+        cls = type(name, (Record,), dict(
+            __slots__=tuple(slot for key, slot in fields),
+            _fields=tuple(fields),
+            _slot_of=dict(fields)))
+        _classes[(keys, name)] = cls
+    return cls
+
+
+def _unpickle_record(keys, items):
+    record = record_class(keys)()
+    record.update(items)
+    return record
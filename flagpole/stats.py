@@ -0,0 +1,213 @@
+"""
+Instrumentation for FlagRegistry method calls.
+"""
+import threading
+import time
+from collections import defaultdict
+
+try:
+    _timer = time.perf_counter
+except AttributeError:  # Python 2
+    _timer = time.time
+
+
+class Observer(object):
+    """
+    Base class for FlagRegistry observers.  Override the callbacks you are interested in.
+
+    Register an observer with `registry.add_observer(observer)`.  While a registry has no observers,
+    `build_out()` does not time or report anything.
+
+    Every callback is passed the registered method, its flag (the combination of the flags of all its
+    return values) and the tuple of keys being filled in for this call.  Callbacks may be called from
+    several threads at once.
+    """
+    def on_method_start(self, method, flag, keys):
+        pass
+
+    def on_method_end(self, method, flag, keys, elapsed):
+        """
+        :param elapsed: Seconds the method took.
+        """
+        pass
+
+    def on_method_error(self, method, flag, keys, elapsed, error):
+        """
+        :param elapsed: Seconds until the method raised.
+        :param error: The exception raised.
+        """
+        pass
+
+    def on_method_skip(self, method, flag, keys, reason):
+        """
+        :param reason: Why the method was not called: 'cache', 'store' (`flagpole.store`), or 'coalesced' when it
+        shared a call in flight.
+        """
+        pass
+
+
+class _Timings(object):
+    __slots__ = ('calls', 'errors', 'skips', 'total', 'samples', '_next')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.skips = 0
+        self.total = 0.0
+        self.samples = list()
+        self._next = 0
+
+    def add(self, elapsed, max_samples):
+        self.calls += 1
+        self.total += elapsed
+        if len(self.samples) < max_samples:
+            self.samples.append(elapsed)
+        else:
+            # Keep the most recent `max_samples` latencies.
+            self.samples[self._next] = elapsed
+            self._next = (self._next + 1) % max_samples
+
+
+class MethodStats(Observer):
+    """
+    Observer which aggregates call counts, error and skip counts, and latencies per registered method.
+
+    Example:
+
+        stats = MethodStats()
+        registry.add_observer(stats)
+        ...
+        for name, summary in stats.summary().items():
+            print(name, summary['calls'], summary['p99'])
+
+    Percentiles are calculated over the most recent `max_samples` calls of each method.
+
+    :param max_samples: Number of latencies kept per method.
+    """
+    def __init__(self, max_samples=1024):
+        self.max_samples = max_samples
+        self._timings = defaultdict(_Timings)
+        self._lock = threading.Lock()
+
+    def on_method_end(self, method, flag, keys, elapsed):
+        with self._lock:
+            self._timings[method].add(elapsed, self.max_samples)
+
+    def on_method_error(self, method, flag, keys, elapsed, error):
+        with self._lock:
+            timings = self._timings[method]
+            timings.add(elapsed, self.max_samples)
+            timings.errors += 1
+
+    def on_method_skip(self, method, flag, keys, reason):
+        with self._lock:
+            self._timings[method].skips += 1
+
+    def percentile(self, method, percent):
+        """
+        :return: The latency (seconds) below which `percent` percent of the recent calls of `method` fell, or None.
+        """
+        with self._lock:
+            samples = sorted(self._timings[method].samples) if method in self._timings else None
+        if not samples:
+            return None
+        ix = int(round(percent / 100.0 * (len(samples) - 1)))
+        return samples[ix]
+
+    def summary(self):
+        """
+        :return: dict mapping each method name to its calls, errors, skips, total, mean, p50, p90 and p99 (seconds).
+        """
+        summary = dict()
+        with self._lock:
+            methods = list(self._timings.keys())
+        for method in methods:
+            timings = self._timings[method]
+            summary[getattr(method, '__name__', repr(method))] = dict(
+                calls=timings.calls,
+                errors=timings.errors,
+                skips=timings.skips,
+                total=timings.total,
+                mean=timings.total / timings.calls if timings.calls else None,
+                p50=self.percentile(method, 50),
+                p90=self.percentile(method, 90),
+                p99=self.percentile(method, 99))
+        return summary
+
+    def reset(self):
+        with self._lock:
+            self._timings.clear()
+
+
+def _method_name(method):
+    """
+    :return: A name for the method which stays the same across processes, for persisting per-method data.
+    """
+    name = getattr(method, '__qualname__', None) or getattr(method, '__name__', None)
+    if name is None:
+        return repr(method)
+    module = getattr(method, '__module__', None)
+    return '{}.{}'.format(module, name) if module else name
+
+
+class LatencyEstimates(object):
+    """
+    Exponentially weighted moving average of the latency of each method.
+
+    Every registry keeps one as `registry.latencies`, updated by the concurrent `build_out()`, to start the
+    methods on the longest remaining dependency chain first.  Estimates are keyed by the method's module and
+    qualified name, so they can be saved and loaded in another process:
+
+        json.dump(registry.latencies.to_dict(), fp)
+        ...
+        registry.latencies.seed(json.load(fp))
+
+    :param alpha: Weight of the newest latency in the average, between 0 and 1.
+    """
+    def __init__(self, alpha=0.2):
+        self.alpha = alpha
+        self._estimates = dict()
+        self._lock = threading.Lock()
+
+    def update(self, method, elapsed):
+        """
+        Adds the latency (seconds) of a call of `method` to its average.
+        """
+        name = _method_name(method)
+        with self._lock:
+            estimate = self._estimates.get(name)
+            if estimate is None:
+                self._estimates[name] = elapsed
+            else:
+                self._estimates[name] = estimate + self.alpha * (elapsed - estimate)
+
+    def estimate(self, method, default=None):
+        """
+        :return: The average latency (seconds) of `method`, or `default` if it has not been seen.
+        """
+        return self._estimates.get(_method_name(method), default)
+
+    def seed(self, estimates):
+        """
+        Sets the estimates for some methods, replacing what was measured so far.
+
+        :param estimates: dict mapping methods, or names as returned by `to_dict()`, to latencies (seconds).
+        """
+        with self._lock:
+            for method, elapsed in estimates.items():
+                name = _method_name(method) if callable(method) else method
+                self._estimates[name] = float(elapsed)
+
+    def to_dict(self):
+        """
+        :return: dict mapping method names to their average latency (seconds).
+        """
+        with self._lock:
+            return dict(self._estimates)
+
+    def reset(self):
+        with self._lock:
+            self._estimates.clear()
+
+    def __len__(self):
+        return len(self._estimates)
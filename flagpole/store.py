@@ -0,0 +1,160 @@
+"""
+Persistent stores for the return values of registered methods, so a restarted process starts warm.
+
+    registry.store = SQLiteStore('/var/cache/collector/results.db')
+
+    @registry.register(flag=FLAGS.POLICY, key='policy', persist=3600)
+    def get_account_policy(alb, account_number=None, **conn):
+        pass
+
+Entries are keyed by the method's module and qualified name, the repr of the *args/**kwargs passed to
+`build_out()` (or of what the method's `persist_key` returns for them) and the flags of the return values,
+and expire after the `persist` TTL of the method.
+"""
+import pickle
+import sqlite3
+import threading
+import time
+
+# Wall clock time, so that entries expire across restarts.
+_now = time.time
+
+
+class Store(object):
+    """
+    Interface of a persistent store.  Subclass it to keep the return values somewhere else.
+
+    Stores must be thread-safe.  Expiry uses wall clock time, so that entries outlive the process.
+    """
+    def get(self, method, key, flag):
+        """
+        :param method: Name of the method.  (see `flagpole.stats._method_name()`)
+        :param key: String identifying the arguments of the call.
+        :param flag: The flags of the return values.
+        :return hit: True if a fresh value is stored.
+        :return value: The stored return value, or None.
+        """
+        raise NotImplementedError
+
+    def put(self, method, key, flag, value, ttl=None):
+        """
+        :param ttl: Seconds the value stays fresh.  None means it never expires.
+        """
+        raise NotImplementedError
+
+    def flush(self):
+        """
+        Writes any buffered entries.
+        """
+        pass
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class SQLiteStore(Store):
+    """
+    Store backed by a single SQLite database file.
+
+    Writes are buffered in memory, and written in one transaction once `batch_size` entries are waiting or
+    `flush_interval` seconds have passed since the last write, and on `flush()`/`close()`.  Buffered entries
+    are served from memory.  Reads go through SQLite's memory-mapped I/O, so a read of a warm database
+    is a B-tree lookup in the page cache.
+
+    Values are pickled, so they must be picklable and the file must only be shared with trusted processes.
+
+    :param path: The database file.  Created if it does not exist.
+    :param batch_size: Number of buffered entries which triggers a write.
+    :param flush_interval: Seconds after which buffered entries are written.
+    :param mmap_size: Bytes of the database file to memory map.
+    """
+    def __init__(self, path, batch_size=100, flush_interval=1.0, mmap_size=256 * 1024 * 1024):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.hits = 0
+        self.misses = 0
+        self._pending = dict()
+        self._flushed = _now()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('PRAGMA mmap_size={:d}'.format(mmap_size))
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS results ('
+            'method TEXT NOT NULL, key TEXT NOT NULL, flag INTEGER NOT NULL, expires REAL, value BLOB NOT NULL, '
+            'PRIMARY KEY (method, key, flag)) WITHOUT ROWID')
+
+    def get(self, method, key, flag):
+        now = _now()
+        with self._lock:
+            entry = self._pending.get((method, key, flag))
+            if entry is None:
+                entry = self._db.execute(
+                    'SELECT expires, value FROM results WHERE method = ? AND key = ? AND flag = ?',
+                    (method, key, flag)).fetchone()
+            if entry is not None and (entry[0] is None or entry[0] > now):
+                self.hits += 1
+                # Python 2 reads BLOBs back as buffers.
+                return True, pickle.loads(bytes(entry[1]))
+            self.misses += 1
+            return False, None
+
+    def put(self, method, key, flag, value, ttl=None):
+        now = _now()
+        expires = now + ttl if ttl is not None else None
+        entry = (expires, pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            self._pending[(method, key, flag)] = entry
+            if len(self._pending) >= self.batch_size or now - self._flushed >= self.flush_interval:
+                self._write()
+
+    def flush(self):
+        with self._lock:
+            self._write()
+
+    def _write(self):
+        """
+        Writes the buffered entries in one transaction.  Must be called with the lock held.
+        """
+        self._flushed = _now()
+        if not self._pending:
+            return
+        rows = [key + (expires, sqlite3.Binary(value)) for key, (expires, value) in self._pending.items()]
+        self._pending.clear()
+        with self._db:
+            self._db.execute('BEGIN')
+            self._db.executemany(
+                'INSERT OR REPLACE INTO results (method, key, flag, expires, value) VALUES (?, ?, ?, ?, ?)', rows)
+
+    def purge(self):
+        """
+        Deletes the expired entries.
+
+        :return: Number of entries deleted.
+        """
+        with self._lock:
+            self._write()
+            with self._db:
+                self._db.execute('BEGIN')
+                return self._db.execute('DELETE FROM results WHERE expires <= ?', (_now(),)).rowcount
+
+    def close(self):
+        with self._lock:
+            self._write()
+            self._db.close()
+
+    def __len__(self):
+        with self._lock:
+            self._write()
+            return self._db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def __repr__(self):
+        return 'SQLiteStore({!r}, hits={}, misses={})'.format(self.path, self.hits, self.misses)
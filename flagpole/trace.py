@@ -0,0 +1,238 @@
+"""
+Per-call tracing of FlagRegistry build outs.
+
+Pass a Tracer to `build_out(..., tracer=tracer)` (or `build_out_many`, `build_out_iter`, `build_out_async`)
+to record a span for every method call, then export them for chrome://tracing / Perfetto or as folded stacks
+for flame graph tools:
+
+    tracer = Tracer()
+    for alb in albs:
+        registry.build_out(FLAGS.ALL, alb, max_workers=4, tracer=tracer)
+    with open('build_out.json', 'w') as fp:
+        tracer.write_chrome_trace(fp)
+"""
+import json
+import threading
+from collections import OrderedDict
+
+from flagpole.stats import _timer
+
+
+def _name(method):
+    return getattr(method, '__name__', repr(method))
+
+
+class Span(object):
+    """
+    One method call within a traced build out.  Times are per `flagpole.stats._timer()`, in seconds.
+
+    :param item: Number of the build out within the tracer, in the order they started.
+    :param method: Name of the method.
+    :param flag: Combination of the flags of the return values requested from the method.
+    :param keys: tuple of the keys the method fills in.
+    :param requires: tuple of the names of the methods it directly depends on.
+    :param thread: Name of the thread the method ran on.
+    :param begin: When the build out started.
+    :param ready: When the last of the methods it depends on finished (`begin` if it has no dependencies).
+    :param start: When the method was called.
+    :param end: When the method returned or raised.
+    :param error: The exception raised, or None.
+    """
+    __slots__ = ('item', 'method', 'flag', 'keys', 'requires', 'thread', 'begin', 'ready', 'start', 'end', 'error')
+
+    def __init__(self, item, method, flag, keys, requires, thread, begin, ready, start):
+        self.item = item
+        self.method = method
+        self.flag = flag
+        self.keys = keys
+        self.requires = requires
+        self.thread = thread
+        self.begin = begin
+        self.ready = ready
+        self.start = start
+        self.end = None
+        self.error = None
+
+    @property
+    def dependency_wait(self):
+        """
+        Seconds from the start of the build out until the methods this one depends on had all finished.
+        """
+        return self.ready - self.begin
+
+    @property
+    def queue_wait(self):
+        """
+        Seconds the method waited to be called after its dependencies had finished, ie. for a free worker.
+        """
+        return self.start - self.ready
+
+    @property
+    def elapsed(self):
+        return self.end - self.start
+
+    def __repr__(self):
+        return 'Span({}, item={}, start={:.6f}, elapsed={:.6f})'.format(
+            self.method, self.item, self.start, self.elapsed)
+
+
+class _Trace(object):
+    """
+    The spans of one traced build out.
+    """
+    def __init__(self, tracer, plan, item):
+        self.tracer = tracer
+        self.plan = plan
+        self.item = item
+        self.begin = _timer()
+        self.spans = [None] * len(plan.steps)
+
+    def start(self, ix):
+        """
+        :return span: The span of the step at `ix` of the plan, starting now.
+        """
+        steps = self.plan.steps
+        step = steps[ix]
+        ready = self.begin
+        for required in step.requires:
+            span = self.spans[required]
+            if span is not None and span.end is not None and span.end > ready:
+                ready = span.end
+        span = Span(
+            self.item, _name(step.method), step.requested_flags, tuple(key for key, rtv_ix in step.slots),
+            tuple(_name(steps[required].method) for required in step.requires),
+            threading.current_thread().name, self.begin, ready, _timer())
+        self.spans[ix] = span
+        return span
+
+    def finish(self, span, error=None):
+        span.end = _timer()
+        span.error = error
+        self.tracer._add(span)
+
+    def call(self, ix, fn, *args, **kwargs):
+        """
+        Returns fn(*args, **kwargs), recording it as the span of the step at `ix`.
+        """
+        span = self.start(ix)
+        try:
+            retval = fn(*args, **kwargs)
+        except BaseException as e:
+            self.finish(span, e)
+            raise
+        self.finish(span)
+        return retval
+
+
+class Tracer(object):
+    """
+    Collects a Span for every method call of the build outs it is passed to.  Thread-safe, so one tracer
+    can be shared by concurrent build outs, for example the items of a `build_out_many()` sweep.
+    """
+    def __init__(self):
+        self.spans = list()
+        self._items = 0
+        self._lock = threading.Lock()
+
+    def begin(self, plan):
+        """
+        Called by the registry when a traced build out starts.
+        """
+        with self._lock:
+            item = self._items
+            self._items += 1
+        return _Trace(self, plan, item)
+
+    def _add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def clear(self):
+        with self._lock:
+            del self.spans[:]
+            self._items = 0
+
+    def to_chrome_trace(self):
+        """
+        :return: The spans as a Chrome trace-event format dictionary, one row per thread.  Dependency
+        edges are drawn as flow arrows from the end of a method to the start of the method depending on it.
+        """
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span.start)
+        if not spans:
+            return dict(traceEvents=list(), displayTimeUnit='ms')
+
+        origin = min(span.begin for span in spans)
+        threads = OrderedDict()
+        events = list()
+        ends = dict()
+
+        def us(t):
+            return round((t - origin) * 1e6, 3)
+
+        for span in spans:
+            tid = threads.setdefault(span.thread, len(threads) + 1)
+            args = dict(
+                item=span.item, flag=span.flag, keys=list(span.keys), requires=list(span.requires),
+                dependency_wait_ms=round(span.dependency_wait * 1e3, 3), queue_wait_ms=round(span.queue_wait * 1e3, 3))
+            if span.error is not None:
+                args['error'] = repr(span.error)
+            events.append(dict(
+                name=span.method, cat='flagpole', ph='X', ts=us(span.start), dur=us(span.end) - us(span.start),
+                pid=1, tid=tid, args=args))
+            ends[(span.item, span.method)] = (tid, span.end)
+
+        flow = 0
+        for span in spans:
+            for required in span.requires:
+                if (span.item, required) not in ends:
+                    continue
+                flow += 1
+                tid, end = ends[(span.item, required)]
+                events.append(dict(name='depends_on', cat='flagpole', ph='s', id=flow, ts=us(end), pid=1, tid=tid))
+                events.append(dict(
+                    name='depends_on', cat='flagpole', ph='f', bp='e', id=flow, ts=us(span.start), pid=1,
+                    tid=threads[span.thread]))
+
+        for thread, tid in threads.items():
+            events.append(dict(name='thread_name', ph='M', pid=1, tid=tid, args=dict(name=thread)))
+        return dict(traceEvents=events, displayTimeUnit='ms')
+
+    def write_chrome_trace(self, fp):
+        """
+        Writes the Chrome trace-event JSON to the file object `fp`, for chrome://tracing or https://ui.perfetto.dev
+        """
+        json.dump(self.to_chrome_trace(), fp)
+
+    def to_folded(self):
+        """
+        :return: The spans as folded stacks (`frame;frame;frame microseconds` lines) for flamegraph.pl and
+        similar tools.  Each method is stacked on the chain of dependencies which held it up the longest, and the
+        time it spent waiting for a worker is shown as a `[queued] method` frame next to it, so the width of the
+        method's own frame is only the time it ran.
+        """
+        with self._lock:
+            spans = list(self.spans)
+        by_method = dict(((span.item, span.method), span) for span in spans)
+
+        def chain(span):
+            frames = [span.method]
+            while True:
+                blockers = [by_method[(span.item, required)] for required in span.requires
+                            if (span.item, required) in by_method]
+                if not blockers:
+                    break
+                span = max(blockers, key=lambda blocker: blocker.end)
+                frames.append(span.method)
+            frames.append('build_out')
+            return ';'.join(reversed(frames))
+
+        totals = OrderedDict()
+        for span in sorted(spans, key=lambda span: span.start):
+            stack = chain(span)
+            queued = stack[:-len(span.method)] + '[queued] ' + span.method
+            for frame, seconds in ((stack, span.elapsed), (queued, span.queue_wait)):
+                value = int(round(seconds * 1e6))
+                if value > 0:
+                    totals[frame] = totals.get(frame, 0) + value
+        return '\n'.join('{} {}'.format(stack, value) for stack, value in totals.items())
@@ -10,7 +10,9 @@ import os
 
 ROOT = os.path.realpath(os.path.join(os.path.dirname(__file__)))
 
-install_requires = []
+install_requires = [
+    'futures; python_version<"3"'
+]
 
 tests_require = [
     'pytest',
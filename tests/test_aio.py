@@ -0,0 +1,208 @@
+import asyncio
+import unittest
+from flagpole import Flags, FlagRegistry, Tracer
+
+
+class TestBuildOutAsync(unittest.TestCase):
+
+    def test_build_out_async(self):
+        FLAGS = Flags('BASE', 'LISTENERS', 'RULES', 'TAGS')
+        registry = FlagRegistry()
+        started = list()
+
+        @registry.register(flag=FLAGS.BASE)
+        async def get_base(alb):
+            started.append('base')
+            await asyncio.sleep(0)
+            # get_listeners was started before get_base finished.
+            return dict(arn=alb['Arn'], concurrent='listeners' in started)
+
+        @registry.register(flag=FLAGS.LISTENERS, key='listeners')
+        async def get_listeners(alb):
+            started.append('listeners')
+            await asyncio.sleep(0)
+            return ['{}/listener'.format(alb['Arn'])]
+
+        @registry.register(flag=FLAGS.RULES, depends_on=FLAGS.LISTENERS, key='rules')
+        async def get_rules(data, alb):
+            return [listener + '/rule' for listener in data['listeners']]
+
+        # Synchronous methods are run on a thread.
+        @registry.register(flag=FLAGS.TAGS, key='tags')
+        def get_tags(alb):
+            return dict(name='lb')
+
+        alb = dict(Arn='arn')
+        result = asyncio.run(registry.build_out_async(FLAGS.ALL, alb))
+        self.assertEqual(result, dict(
+            arn='arn', concurrent=True, listeners=['arn/listener'], rules=['arn/listener/rule'],
+            tags=dict(name='lb')))
+        self.assertEqual(list(result.keys()), ['arn', 'concurrent', 'listeners', 'rules', 'tags'])
+
+        # Only follows the requested flags and their dependencies.
+        result = asyncio.run(registry.build_out_async(FLAGS.RULES, alb, start_with=dict(hello='world')))
+        self.assertEqual(result, dict(hello='world', listeners=['arn/listener'], rules=['arn/listener/rule']))
+
+    def test_build_out_async_positional_result(self):
+        FLAGS = Flags('LISTENERS', 'RULES', 'TAGS')
+        registry = FlagRegistry()
+
+        @registry.register(flag=FLAGS.LISTENERS, key='listeners')
+        async def get_listeners(alb):
+            await asyncio.sleep(0)
+            return ['{}/listener'.format(alb['Arn'])]
+
+        # The result is passed positionally, so the method reads what get_listeners returned from it.
+        @registry.register(flag=FLAGS.RULES, depends_on=FLAGS.LISTENERS, key='rules')
+        async def get_rules(alb):
+            return [listener + '/rule' for listener in alb['listeners']]
+
+        @registry.register(flag=FLAGS.TAGS, key='tags', depends_on=FLAGS.LISTENERS)
+        def get_tags(alb):
+            return dict(listeners=len(alb['listeners']))
+
+        alb = dict(Arn='arn')
+        self.assertIs(asyncio.run(registry.build_out_async(FLAGS.ALL, alb, start_with=alb)), alb)
+        self.assertEqual(alb, dict(
+            Arn='arn', listeners=['arn/listener'], rules=['arn/listener/rule'], tags=dict(listeners=1)))
+
+    def test_build_out_async_error(self):
+        FLAGS = Flags('ONE', 'TWO')
+        registry = FlagRegistry()
+        called = list()
+
+        @registry.register(flag=FLAGS.ONE, key='one')
+        async def method_one():
+            raise ValueError('boom')
+
+        @registry.register(flag=FLAGS.TWO, depends_on=FLAGS.ONE, key='two')
+        async def method_two(data):
+            called.append(True)
+
+        with self.assertRaises(ValueError):
+            asyncio.run(registry.build_out_async(FLAGS.ALL))
+        self.assertEqual(called, [])
+
+    def test_build_out_async_cache_and_stats(self):
+        from flagpole import MethodStats, TTLCache
+        FLAGS = Flags('ONE')
+        registry = FlagRegistry()
+        stats = MethodStats()
+        registry.add_observer(stats)
+
+        @registry.register(flag=FLAGS.ONE, key='one', cache=TTLCache())
+        async def method_one():
+            await asyncio.sleep(0.01)
+            return 1
+
+        self.assertEqual(asyncio.run(registry.build_out_async(FLAGS.ONE)), dict(one=1))
+        self.assertEqual(asyncio.run(registry.build_out_async(FLAGS.ONE)), dict(one=1))
+
+        summary = stats.summary()['method_one']
+        self.assertEqual((summary['calls'], summary['skips']), (1, 1))
+        self.assertTrue(summary['total'] >= 0.01)
+
+    def test_build_out_async_timeouts(self):
+        from flagpole import INCOMPLETE
+        FLAGS = Flags('BASE', 'LISTENERS', 'RULES', 'SLOW')
+        registry = FlagRegistry()
+
+        @registry.register(flag=FLAGS.BASE, key='base')
+        async def get_base():
+            return 'base'
+
+        @registry.register(flag=FLAGS.LISTENERS, key='listeners', timeout=0.05)
+        async def get_listeners():
+            await asyncio.sleep(5)
+
+        @registry.register(flag=FLAGS.RULES, depends_on=FLAGS.LISTENERS, key='rules')
+        async def get_rules(data):
+            return ['rule']
+
+        @registry.register(flag=FLAGS.SLOW, key='slow')
+        async def get_slow():
+            await asyncio.sleep(0.2)
+            return 'slow'
+
+        result = asyncio.run(registry.build_out_async(FLAGS.ALL))
+        self.assertEqual(result, {
+            'base': 'base', 'slow': 'slow',
+            INCOMPLETE: dict(flags=FLAGS.LISTENERS | FLAGS.RULES, keys=['listeners', 'rules'])})
+
+        result = asyncio.run(registry.build_out_async(FLAGS.BASE | FLAGS.SLOW, deadline=0.05))
+        self.assertEqual(result, {'base': 'base', INCOMPLETE: dict(flags=FLAGS.SLOW, keys=['slow'])})
+
+    def test_build_out_async_limits(self):
+        from flagpole import Retry
+        FLAGS = Flags('ONE')
+        registry = FlagRegistry()
+        registry.add_limit('api', max_in_flight=1)
+        state = dict(in_flight=0, peak=0, calls=0)
+
+        @registry.register(flag=FLAGS.ONE, key='one', limit='api', retry=Retry(on=KeyError, backoff=0.001))
+        async def method_one(ix):
+            state['calls'] += 1
+            state['in_flight'] += 1
+            state['peak'] = max(state['peak'], state['in_flight'])
+            await asyncio.sleep(0.001)
+            state['in_flight'] -= 1
+            if state['calls'] == 1:
+                raise KeyError('throttled')
+            return ix
+
+        async def main():
+            return await asyncio.gather(*[registry.build_out_async(FLAGS.ONE, ix) for ix in range(5)])
+
+        self.assertEqual(asyncio.run(main()), [dict(one=ix) for ix in range(5)])
+        self.assertEqual((state['calls'], state['peak']), (6, 1))
+
+    def test_build_out_async_coalesce(self):
+        FLAGS = Flags('ONE')
+        registry = FlagRegistry()
+        calls = list()
+
+        @registry.register(flag=FLAGS.ONE, key='one', coalesce=True)
+        async def method_one(name):
+            calls.append(name)
+            await asyncio.sleep(0.01)
+            return name.upper()
+
+        async def main():
+            return await asyncio.gather(*[registry.build_out_async(FLAGS.ONE, name) for name in 'aab'])
+
+        self.assertEqual(asyncio.run(main()), [dict(one='A'), dict(one='A'), dict(one='B')])
+        self.assertEqual(calls, ['a', 'b'])
+
+    def test_build_out_async_tracer(self):
+        FLAGS = Flags('ONE', 'TWO')
+        registry = FlagRegistry()
+
+        @registry.register(flag=FLAGS.ONE, key='one')
+        async def method_one():
+            return 1
+
+        @registry.register(flag=FLAGS.TWO, key='two')
+        async def method_two():
+            raise ValueError('broken')
+
+        tracer = Tracer()
+        self.assertEqual(asyncio.run(registry.build_out_async(FLAGS.ONE, tracer=tracer)), dict(one=1))
+        with self.assertRaises(ValueError):
+            asyncio.run(registry.build_out_async(FLAGS.TWO, tracer=tracer))
+        self.assertEqual([(span.method, span.error is None) for span in tracer.spans], [
+            ('method_one', True), ('method_two', False)])
+
+    def test_build_out_async_batch_size(self):
+        FLAGS = Flags('TAGS', 'RULES')
+        registry = FlagRegistry()
+
+        @registry.register(flag=FLAGS.TAGS, key='tags', batch_size=4)
+        async def get_tags(albs):
+            await asyncio.sleep(0)
+            return [alb.upper() for alb in albs]
+
+        @registry.register(flag=FLAGS.RULES, key='rules', depends_on=FLAGS.TAGS, batch_size=4, pass_requested=True)
+        async def get_rules(datas, alb, requested_flags=None):
+            return [(data['tags'], requested_flags) for data in datas]
+
+        self.assertEqual(asyncio.run(registry.build_out_async(FLAGS.ALL, 'a')), dict(tags='A', rules=('A', FLAGS.RULES)))
@@ -0,0 +1,83 @@
+import unittest
+from flagpole import cache
+from flagpole import TTLCache
+
+
+class TestTTLCache(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self._clock = cache._clock
+        cache._clock = lambda: self.now
+
+    def tearDown(self):
+        cache._clock = self._clock
+
+    def test_lru(self):
+        ttl_cache = TTLCache(maxsize=2)
+        ttl_cache.store('a', 1)
+        ttl_cache.store('b', 2)
+        self.assertEqual(ttl_cache.lookup('a'), (True, 1))
+
+        # 'b' is the least recently used.
+        ttl_cache.store('c', 3)
+        self.assertEqual(len(ttl_cache), 2)
+        self.assertEqual(ttl_cache.lookup('b'), (False, None))
+        self.assertEqual(ttl_cache.lookup('a'), (True, 1))
+        self.assertEqual(ttl_cache.lookup('c'), (True, 3))
+        self.assertEqual((ttl_cache.hits, ttl_cache.misses), (3, 1))
+
+        with self.assertRaises(ValueError):
+            TTLCache(maxsize=0)
+
+    def test_ttl(self):
+        ttl_cache = TTLCache(maxsize=2, ttl=10)
+        ttl_cache.store('a', 1)
+        self.now += 9
+        self.assertEqual(ttl_cache.lookup('a'), (True, 1))
+        self.now += 1
+        self.assertEqual(ttl_cache.lookup('a'), (False, None))
+        self.assertEqual(len(ttl_cache), 0)
+
+    def test_make_key(self):
+        self.assertEqual(cache.make_key(1, b=2, a=3), ((1,), (('a', 3), ('b', 2))))
+        self.assertEqual(cache.make_key(dict(unhashable=True)), None)
+
+        ttl_cache = TTLCache(key=lambda alb, **conn: conn['account_number'])
+        self.assertEqual(ttl_cache.make_key(dict(Arn='arn'), account_number='123'), '123')
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_do(self):
+        import threading
+        import time
+        from flagpole import SingleFlight
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = list()
+
+        def fetch(name):
+            calls.append(name)
+            started.set()
+            release.wait()
+            return name.upper()
+
+        results = list()
+        leader = threading.Thread(target=lambda: results.append(flight.do('key', fetch, 'a')))
+        leader.start()
+        started.wait()
+        follower = threading.Thread(target=lambda: results.append(flight.do('key', fetch, 'b')))
+        follower.start()
+        time.sleep(0.05)
+        release.set()
+        leader.join()
+        follower.join()
+
+        self.assertEqual(calls, ['a'])
+        self.assertEqual(sorted(results), [(False, 'A'), (True, 'A')])
+        self.assertEqual(len(flight), 0)
+
+        # Nothing is kept once the call is done.
+        self.assertEqual(flight.do('key', fetch, 'c'), (False, 'C'))
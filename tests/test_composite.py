@@ -0,0 +1,115 @@
+import threading
+import unittest
+from collections import OrderedDict
+from flagpole import CircularDependencyError, CompositeRegistry, Flags, FlagRegistry
+
+
+class TestCompositeRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.IAM = IAM = Flags('ROLES', 'USERS')
+        self.S3 = S3 = Flags('BUCKETS', 'POLICY', 'OWNER')
+        self.iam = iam = FlagRegistry()
+        self.s3 = s3 = FlagRegistry()
+        self.calls = calls = list()
+        # Methods of both registries have to be running at the same time to get past the barrier.
+        # (Python 2 has no Barrier, so there only the results are checked.)
+        self.barrier = barrier = threading.Barrier(2, timeout=5) if hasattr(threading, 'Barrier') else None
+
+        def get_owner(account_number):
+            calls.append('owner')
+            return dict(owner='owner-{}'.format(account_number))
+
+        iam.register(flag=IAM.USERS)(get_owner)
+
+        @iam.register(flag=IAM.ROLES, key='roles')
+        def get_roles(account_number):
+            calls.append('roles')
+            if self.barrier is not None:
+                barrier.wait()
+            return ['role']
+
+        @s3.register(flag=S3.BUCKETS, key='buckets')
+        def get_buckets(account_number):
+            calls.append('buckets')
+            if self.barrier is not None:
+                barrier.wait()
+            return ['bucket']
+
+        @s3.register(flag=S3.POLICY, depends_on=S3.BUCKETS, key='policy')
+        def get_policy(data, account_number):
+            calls.append('policy')
+            return dict((bucket, data['iam']['roles']) for bucket in data['buckets'])
+
+        s3.register(flag=S3.OWNER)(get_owner)
+
+        self.composite = CompositeRegistry(OrderedDict(iam=iam, s3=s3))
+        self.composite.depends(('s3', S3.POLICY), on=('iam', IAM.ROLES))
+
+    def test_build_out(self):
+        IAM, S3 = self.IAM, self.S3
+        result = self.composite.build_out(dict(iam=IAM.USERS, s3=S3.ALL), '123', max_workers=4)
+        self.assertEqual(result, dict(
+            iam=dict(owner='owner-123', roles=['role']),
+            s3=dict(buckets=['bucket'], policy=dict(bucket=['role']), owner='owner-123')))
+
+        # The method registered with both registries ran once.
+        self.assertEqual(self.calls.count('owner'), 1)
+        self.assertTrue(self.calls.index('policy') > self.calls.index('roles'))
+
+        # Without dependencies between them, each registry's result is what its own build_out returns.
+        self.barrier = None
+        result = self.composite.build_out(dict(iam=IAM.ALL, s3=S3.BUCKETS), '123')
+        self.assertEqual(result, dict(iam=self.iam.build_out(IAM.ALL, '123'), s3=self.s3.build_out(S3.BUCKETS, '123')))
+
+    def test_circular(self):
+        self.composite.depends(('iam', self.IAM.ROLES), on=('s3', self.S3.POLICY))
+        # get_owner waits on the cycle, but is not part of it.
+        self.composite.depends(('iam', self.IAM.USERS), on=('s3', self.S3.POLICY))
+        with self.assertRaises(CircularDependencyError) as context:
+            self.composite.build_out(dict(iam=self.IAM.USERS, s3=self.S3.POLICY), '123')
+        names = [method.__name__ for method in context.exception.methods]
+        self.assertEqual(sorted(names[:-1]), ['get_policy', 'get_roles'])
+        self.assertEqual(names[0], names[-1])
+        with self.assertRaises(KeyError):
+            self.composite.depends(('ec2', 1), on=('s3', self.S3.POLICY))
+
+    def test_shared_method(self):
+        A, B = Flags('X', 'Y'), Flags('Z', 'W')
+        a, b = FlagRegistry(), FlagRegistry()
+        calls = list()
+
+        def get_pair(account_number, requested_flags=None):
+            calls.append(requested_flags)
+            return 'first', 'second'
+
+        a.register(flag=(A.X, A.Y), key=('x', 'y'), pass_requested=True)(get_pair)
+        b.register(flag=(B.Z, B.W), key=('z', 'w'), pass_requested=True)(get_pair)
+        composite = CompositeRegistry(OrderedDict(a=a, b=b))
+
+        # Asked for the same return values, one call fills in both.
+        self.assertEqual(composite.build_out(dict(a=A.ALL, b=B.ALL), '123'), dict(
+            a=dict(x='first', y='second'), b=dict(z='first', w='second')))
+        self.assertEqual(calls, [3])
+
+        # Otherwise each registry's call gets its own requested flags.
+        del calls[:]
+        self.assertEqual(composite.build_out(dict(a=A.X, b=B.ALL), '123', max_workers=2), dict(
+            a=dict(x='first'), b=dict(z='first', w='second')))
+        self.assertEqual(sorted(calls), [1, 3])
+
+    def test_unsupported(self):
+        from flagpole import Tracer
+        IAM, S3 = self.IAM, self.S3
+        flags = dict(iam=IAM.ROLES, s3=S3.BUCKETS)
+        for options in (dict(tracer=Tracer()), dict(deadline=5), dict(copy_datastructure=False)):
+            with self.assertRaises(ValueError):
+                self.composite.build_out(flags, '123', **options)
+
+        @self.s3.register(flag=S3.OWNER, key='slow', timeout=5)
+        def get_slow(account_number):
+            return 'slow'
+
+        with self.assertRaises(ValueError):
+            self.composite.build_out(dict(iam=IAM.ROLES, s3=S3.OWNER), '123')
+        self.assertEqual(self.calls, [])
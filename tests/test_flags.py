@@ -20,3 +20,56 @@ class TestFlags(unittest.TestCase):
         self.assertEqual(FLAGS_3.FEATURE_TWO, 4)
         self.assertEqual(FLAGS_3.ALL, 7)
         self.assertEqual(str(FLAGS_3), "OrderedDict([('BASE', 1), ('FEATURE_ONE', 2), ('FEATURE_TWO', 4), ('ALL', 7), ('None', 0), ('NONE', 0)])")
+
+    def test_flag_values(self):
+        import json
+        import pickle
+        FLAGS = Flags('BASE', 'LISTENERS', 'RULES', 'parse')
+        self.assertEqual(repr(FLAGS.RULES), 'RULES')
+        self.assertEqual(repr(FLAGS.parse('BASE|RULES')), 'BASE|RULES')
+        self.assertEqual(repr(FLAGS.NONE), 'NONE')
+        self.assertEqual(FLAGS.BASE | FLAGS.RULES, 5)
+        self.assertEqual(~FLAGS.BASE & FLAGS.ALL, 14)
+        self.assertEqual(str(FLAGS.RULES), '4')
+        self.assertEqual(json.dumps(FLAGS.ALL), '15')
+        self.assertEqual(getattr(FLAGS, 'None'), 0)
+        self.assertEqual(FLAGS['parse'], 8)
+        self.assertTrue(type(FLAGS.BASE | 2) is int)
+        self.assertEqual(FLAGS.parse(5).names, ('BASE', 'RULES'))
+
+        # Values outside of the flags never break repr.
+        self.assertEqual(repr(Flags('ONE').ONE.__class__(256)), '256')
+        self.assertEqual(repr(FLAGS.ALL.__class__(-1)), '-1')
+
+        # Members are slots, not looked up with __getattr__.
+        self.assertFalse(hasattr(FLAGS, '__dict__'))
+        self.assertTrue(isinstance(FLAGS, Flags))
+        with self.assertRaises(AttributeError):
+            FLAGS.MISSING
+
+        self.assertEqual(FLAGS.parse('BASE | RULES'), 5)
+        self.assertEqual(FLAGS.parse('ALL'), FLAGS.ALL)
+        self.assertEqual(FLAGS.parse(''), FLAGS.NONE)
+        self.assertEqual(FLAGS.parse(6), 6)
+        with self.assertRaises(ValueError):
+            FLAGS.parse('BASE|MISSING')
+        with self.assertRaises(ValueError):
+            FLAGS.parse(100)
+        with self.assertRaises(ValueError):
+            FLAGS.parse(-1)
+
+        # Names which aren't identifiers can't be slots.
+        OTHER = Flags('my-flag', '1ST', 'BASE')
+        self.assertEqual(OTHER['my-flag'], 1)
+        self.assertEqual(getattr(OTHER, '1ST'), 2)
+        self.assertEqual(OTHER.BASE, 4)
+        self.assertEqual(OTHER.parse('my-flag|1ST'), 3)
+        self.assertEqual(repr(OTHER.ALL), 'my-flag|1ST|BASE')
+
+        self.assertEqual(FLAGS.decode(FLAGS.LISTENERS | FLAGS.RULES), ('LISTENERS', 'RULES'))
+        self.assertEqual(FLAGS.decode(0), ())
+        with self.assertRaises(ValueError):
+            FLAGS.decode(16)
+
+        self.assertEqual(pickle.loads(pickle.dumps(FLAGS)).flags, FLAGS.flags)
+        self.assertEqual(type(pickle.loads(pickle.dumps(FLAGS.RULES))), int)
@@ -0,0 +1,100 @@
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from flagpole import Flags, FlagRegistry, Limit, Retry
+
+
+class Throttled(Exception):
+    pass
+
+
+class TestLimits(unittest.TestCase):
+
+    def test_token_bucket(self):
+        limit = Limit(rate=100, burst=2)
+        self.assertEqual(limit.try_acquire(), 0)
+        self.assertEqual(limit.try_acquire(), 0)
+        wait = limit.try_acquire()
+        self.assertTrue(0 < wait <= 0.01)
+        limit.release()
+        limit.release()
+
+        start = time.time()
+        for _ in range(5):
+            with limit:
+                pass
+        # Two tokens refill at 100/s, five calls need at least three more.
+        self.assertTrue(time.time() - start >= 0.02)
+
+    def test_max_in_flight(self):
+        limit = Limit(max_in_flight=1)
+        self.assertEqual(limit.try_acquire(), 0)
+        self.assertEqual(limit.try_acquire(), None)
+        limit.release()
+        self.assertEqual(limit.try_acquire(), 0)
+
+    def test_retry(self):
+        retry = Retry(on=Throttled, attempts=3, backoff=1, max_backoff=3)
+        self.assertTrue(retry.should_retry(Throttled(), 0))
+        self.assertTrue(retry.should_retry(Throttled(), 1))
+        self.assertFalse(retry.should_retry(Throttled(), 2))
+        self.assertFalse(retry.should_retry(ValueError(), 0))
+        for attempt in range(5):
+            self.assertTrue(0 <= retry.delay(attempt) <= min(3, 2 ** attempt))
+
+        retry = Retry(on=lambda e: 'Throttling' in str(e))
+        self.assertTrue(retry.should_retry(Exception('Throttling: Rate exceeded'), 0))
+        self.assertFalse(retry.should_retry(Exception('AccessDenied'), 0))
+
+    def test_registry_limits(self):
+        FLAGS = Flags('LISTENERS', 'RULES')
+        registry = FlagRegistry()
+        limit = registry.add_limit('elbv2', max_in_flight=2)
+        lock = threading.Lock()
+        in_flight = [0, 0]
+        attempts = dict()
+
+        def call(name):
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight)
+                attempts[name] = attempts.get(name, 0) + 1
+                throttle = attempts[name] % 2
+            time.sleep(0.005)
+            with lock:
+                in_flight[0] -= 1
+            if throttle:
+                raise Throttled()
+            return name
+
+        @registry.register(flag=FLAGS.LISTENERS, key='listeners', limit='elbv2', retry=Retry(on=Throttled, backoff=0.001))
+        def get_listeners(alb):
+            return call('listeners-' + alb)
+
+        @registry.register(flag=FLAGS.RULES, key='rules', limit=limit, retry=Retry(on=Throttled, backoff=0.001))
+        def get_rules(alb):
+            return call('rules-' + alb)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(
+                lambda alb: registry.build_out(FLAGS.ALL, alb, max_workers=2), [str(ix) for ix in range(8)]))
+
+        self.assertEqual(results[3], dict(listeners='listeners-3', rules='rules-3'))
+        self.assertEqual(set(attempts.values()), set([2]))
+        self.assertTrue(in_flight[1] <= 2)
+        self.assertEqual(limit.in_flight, 0)
+
+    def test_retry_gives_up(self):
+        FLAGS = Flags('ONE')
+        registry = FlagRegistry()
+        calls = list()
+
+        @registry.register(flag=FLAGS.ONE, key='one', retry=Retry(on=Throttled, attempts=3, backoff=0.001))
+        def method_one():
+            calls.append(True)
+            raise Throttled()
+
+        with self.assertRaises(Throttled):
+            registry.build_out(FLAGS.ONE)
+        self.assertEqual(len(calls), 3)
@@ -0,0 +1,37 @@
+import os
+import unittest
+from flagpole import Flags, FlagRegistry
+
+FLAGS = Flags('POLICY', 'STATEMENTS', 'DIFF')
+registry = FlagRegistry()
+
+
+@registry.register(flag=FLAGS.POLICY, key='policy')
+def get_policy(bucket_name):
+    return dict(Statement=['s1', 's2'], pid=os.getpid())
+
+
+@registry.register(flag=(FLAGS.STATEMENTS, FLAGS.DIFF), depends_on=FLAGS.POLICY, key=('statements', 'diff'),
+                   executor='process')
+def parse_policy(data, bucket_name):
+    return len(data['policy']['Statement']), os.getpid()
+
+
+class TestProcessExecutor(unittest.TestCase):
+
+    def test_process(self):
+        result = registry.build_out(FLAGS.ALL, 'a')
+        self.assertEqual(result['statements'], 2)
+        self.assertEqual(result['policy']['pid'], os.getpid())
+        self.assertNotEqual(result['diff'], os.getpid())
+
+        # Only the requested return values are merged.
+        result = registry.build_out(FLAGS.STATEMENTS, 'a', max_workers=2, copy_datastructure=False)
+        self.assertEqual(sorted(result), ['policy', 'statements'])
+
+    def test_executor(self):
+        from concurrent.futures import ThreadPoolExecutor
+        other = FlagRegistry()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            other.register(flag=FLAGS.POLICY, key='policy', executor=executor)(get_policy)
+            self.assertEqual(other.build_out(FLAGS.POLICY, 'a')['policy']['pid'], os.getpid())
@@ -0,0 +1,97 @@
+import pickle
+import sys
+import unittest
+from flagpole import Flags, FlagRegistry, Record, record_class
+
+
+class TestRecord(unittest.TestCase):
+
+    def test_record(self):
+        cls = record_class(['arn', 'rules', 'Load Balancer', 'class'])
+        self.assertTrue(cls is record_class(('arn', 'rules', 'Load Balancer', 'class')))
+
+        record = cls()
+        self.assertEqual(len(record), 0)
+        record['rules'] = ['rule']
+        record['Load Balancer'] = 'lb'
+        record.update(dict(region='us-east-1', arn='arn'))
+        self.assertEqual(record.rules, ['rule'])
+        self.assertEqual(record['class'] if 'class' in record else None, None)
+        self.assertEqual(list(record), ['arn', 'rules', 'Load Balancer', 'region'])
+        self.assertEqual(record, dict(arn='arn', rules=['rule'], region='us-east-1', **{'Load Balancer': 'lb'}))
+        self.assertEqual(record.get('missing', 1), 1)
+        with self.assertRaises(KeyError):
+            record['class']
+
+        del record['region']
+        del record['arn']
+        self.assertEqual(record.to_dict(), {'rules': ['rule'], 'Load Balancer': 'lb'})
+        self.assertEqual(pickle.loads(pickle.dumps(record)), record)
+        self.assertEqual(repr(record), "Record({!r})".format(record.to_dict()))
+
+        # No __dict__ per record.
+        with self.assertRaises(AttributeError):
+            record.__dict__
+        self.assertTrue(sys.getsizeof(cls()) < sys.getsizeof(dict(record)))
+
+    def test_build_out(self):
+        FLAGS = Flags('BASE', 'LISTENERS', 'RULES')
+        registry = FlagRegistry()
+
+        @registry.register(flag=FLAGS.BASE)
+        def get_base(alb):
+            return dict(arn=alb)
+
+        @registry.register(flag=FLAGS.LISTENERS, key='listeners')
+        def get_listeners(alb):
+            return ['listener']
+
+        @registry.register(flag=FLAGS.RULES, depends_on=FLAGS.LISTENERS, key='rules')
+        def get_rules(data, alb):
+            return [listener + '/rule' for listener in data['listeners']]
+
+        cls = registry.record_class()
+        self.assertTrue(issubclass(cls, Record))
+        self.assertEqual(cls.__slots__, ('listeners', 'rules'))
+
+        expected = registry.build_out(FLAGS.ALL, 'a')
+        result = registry.build_out(FLAGS.ALL, 'a', record=True)
+        self.assertTrue(isinstance(result, cls))
+        self.assertEqual(result.to_dict(), expected)
+        self.assertEqual(result.rules, ['listener/rule'])
+        self.assertEqual(registry.build_out(FLAGS.ALL, 'a', record=True, copy_datastructure=False), expected)
+        self.assertEqual(registry.build_out(FLAGS.ALL, 'a', record=True, max_workers=2), expected)
+
+        results = list(registry.build_out_many(FLAGS.RULES, ['a', 'b'], record=True))
+        self.assertEqual([type(result) for result in results], [cls, cls])
+        self.assertEqual([result.to_dict() for result in results], [
+            dict(listeners=['listener'], rules=['listener/rule'])] * 2)
+
+    def test_method_names(self):
+        cls = record_class(['keys', 'update', 'get', 'to_dict', 'rules'])
+        self.assertEqual(cls.__slots__, ('_0', '_1', '_2', '_3', 'rules'))
+
+        record = cls()
+        record.update(dict(keys=['key'], get='got'))
+        record['update'] = 'updated'
+        self.assertEqual(dict(record), dict(keys=['key'], get='got', update='updated'))
+        self.assertEqual(list(record.keys()), ['keys', 'update', 'get'])
+        self.assertEqual(record.get('get'), 'got')
+
+        FLAGS = Flags('BASE', 'KEYS', 'UPDATE')
+        registry = FlagRegistry()
+
+        @registry.register(flag=FLAGS.BASE)
+        def get_base(alb):
+            return dict(arn=alb)
+
+        @registry.register(flag=FLAGS.KEYS, key='keys')
+        def get_keys(alb):
+            return ['key']
+
+        @registry.register(flag=FLAGS.UPDATE, key='update')
+        def get_update(alb):
+            return 'updated'
+
+        result = registry.build_out(FLAGS.ALL, 'a', record=True)
+        self.assertEqual(dict(result), dict(arn='a', keys=['key'], update='updated'))
@@ -1,5 +1,7 @@
+import threading
+import types
 import unittest
-from flagpole import Flags, FlagRegistry
+from flagpole import Flags, FlagRegistry, CircularDependencyError
 
 
 class TestRegistry(unittest.TestCase):
@@ -140,7 +142,7 @@ class TestRegistry(unittest.TestCase):
             pass
 
         with self.assertRaises(Exception) as context:
-            registry._do_method_pass([method_one, method_two], 0, dict(), False, flags=FLAGS.ONE | FLAGS.TWO)
+            registry.build_out(FLAGS.ONE | FLAGS.TWO)
             self.assertTrue('Circular Dependency Error' in str(context.exception))
         
         with self.assertRaises(Exception) as context:
@@ -148,34 +150,6 @@ class TestRegistry(unittest.TestCase):
             self.assertTrue('Circular Dependency Error' in str(context.exception))
         
         
-    def test_do_method_pass_requires_another_pass(self):
-        FLAGS = Flags('ONE', 'TWO')
-        registry = FlagRegistry()
-
-        @registry.register(flag=FLAGS.ONE, key='one')
-        def method_one():
-            return 1
-
-        @registry.register(flag=FLAGS.TWO, depends_on=FLAGS.ONE, key='two')
-        def method_two(data):
-            # Note: Any method that sets depends_on must take an argument holding the datastructure being built out
-            return 2
-
-        result = dict()
-        next_method_queue, executed_flag = registry._do_method_pass(
-            [method_two, method_one], 0, result, False, flags=FLAGS.ONE | FLAGS.TWO)
-
-        self.assertEqual(len(next_method_queue), 1) 
-        self.assertEqual(executed_flag, FLAGS.ONE)
-        self.assertEqual(set(result.keys()), set(['one']))
-
-        next_method_queue, executed_flag = registry._do_method_pass(
-            next_method_queue, executed_flag, result, False, flags=FLAGS.ONE | FLAGS.TWO)
-
-        self.assertEqual(len(next_method_queue), 0) 
-        self.assertEqual(executed_flag, FLAGS.ONE | FLAGS.TWO)
-        self.assertEqual(set(result.keys()), set(['one', 'two']))
-
     def test_build_out(self):
         FLAGS = Flags('PEOPLE', 'HOBBIES')
         registry = FlagRegistry()
@@ -328,4 +302,933 @@ class TestRegistry(unittest.TestCase):
         self.assertEqual(result, dict(
             hello='goodbye',
             people=dict(simon='123', george='234'),
-            hobbies=dict(simon=['mountain biking', 'skiing'], george=['snail collecting', 'roaring like a dinosaur'])))
\ No newline at end of file
+            hobbies=dict(simon=['mountain biking', 'skiing'], george=['snail collecting', 'roaring like a dinosaur'])))
+
+    def test_plan_cache(self):
+        FLAGS = Flags('ONE', 'TWO', 'THREE')
+        registry = FlagRegistry()
+
+        @registry.register(flag=(FLAGS.ONE, FLAGS.THREE), key=('one', 'three'))
+        def method_one():
+            return 1, 3
+
+        @registry.register(flag=FLAGS.TWO, depends_on=FLAGS.ONE, key='two')
+        def method_two(data):
+            return data['one'] + 1
+
+        plan = registry._get_plan(FLAGS.TWO)
+        self.assertEqual(plan.flags, FLAGS.ONE | FLAGS.TWO)
+        self.assertEqual([step.method for step in plan.steps], [method_one, method_two])
+        self.assertEqual(plan.steps[0].slots, (('one', 0),))
+        self.assertIs(registry._get_plan(FLAGS.TWO), plan)
+
+        self.assertEqual(registry.build_out(FLAGS.TWO), dict(one=1, two=2))
+        self.assertEqual(registry.build_out(FLAGS.TWO), dict(one=1, two=2))
+
+        # Registering a new method invalidates the cached plans.
+        @registry.register(flag=FLAGS.THREE, depends_on=FLAGS.TWO, key='four')
+        def method_four(data):
+            return 4
+
+        self.assertEqual(len(registry._plans), 0)
+        self.assertEqual(registry.build_out(FLAGS.THREE), dict(one=1, two=2, three=3, four=4))
+
+        # The cache is bounded.
+        registry.plan_cache_size = 2
+        for flags in (FLAGS.ONE, FLAGS.TWO, FLAGS.THREE):
+            registry.build_out(flags)
+        self.assertEqual(list(registry._plans.keys()), [FLAGS.TWO, FLAGS.THREE])
+
+    def test_topological_order(self):
+        FLAGS = Flags('BASE', 'LEFT', 'RIGHT', 'TOP', 'OTHER')
+        registry = FlagRegistry()
+
+        # Registered dependents-first to make sure order comes from the graph.
+        @registry.register(flag=FLAGS.TOP, depends_on=FLAGS.LEFT | FLAGS.RIGHT, key='top')
+        def method_top(data):
+            return data['left'] + data['right']
+
+        @registry.register(flag=FLAGS.LEFT, depends_on=FLAGS.BASE, key='left')
+        def method_left(data):
+            return data['base'] + 1
+
+        @registry.register(flag=FLAGS.RIGHT, depends_on=FLAGS.BASE, key='right')
+        def method_right(data):
+            return data['base'] + 2
+
+        @registry.register(flag=FLAGS.OTHER, key='other')
+        def method_other():
+            return 0
+
+        @registry.register(flag=FLAGS.BASE, key='base')
+        def method_base():
+            return 10
+
+        self.assertEqual(
+            registry._topological_order(),
+            [method_other, method_base, method_left, method_right, method_top])
+        self.assertEqual(
+            registry._calculate_dependency_flag(method_top),
+            FLAGS.BASE | FLAGS.LEFT | FLAGS.RIGHT)
+        self.assertEqual(
+            registry._find_methods_matching_flag(FLAGS.RIGHT | FLAGS.LEFT),
+            [method_left, method_right])
+        self.assertEqual(registry.build_out(FLAGS.TOP), dict(base=10, left=11, right=12, top=23))
+
+    def test_circular_dependency_error_names_methods(self):
+        FLAGS = Flags('ONE', 'TWO', 'THREE', 'FOUR')
+        registry = FlagRegistry()
+
+        @registry.register(flag=FLAGS.ONE, depends_on=FLAGS.THREE, key='one')
+        def method_one(data):
+            pass
+
+        @registry.register(flag=FLAGS.TWO, depends_on=FLAGS.ONE, key='two')
+        def method_two(data):
+            pass
+
+        @registry.register(flag=FLAGS.THREE, depends_on=FLAGS.TWO, key='three')
+        def method_three(data):
+            pass
+
+        @registry.register(flag=FLAGS.FOUR, key='four')
+        def method_four():
+            return 4
+
+        with self.assertRaises(CircularDependencyError) as context:
+            registry.build_out(FLAGS.ALL)
+        self.assertEqual(set(context.exception.methods), set([method_one, method_two, method_three]))
+        self.assertTrue('Circular Dependency Error' in str(context.exception))
+        self.assertTrue('method_two' in str(context.exception))
+
+        with self.assertRaises(CircularDependencyError):
+            registry._calculate_dependency_flag(method_one)
+
+    def test_deep_chain(self):
+        names = ['F{}'.format(i) for i in range(2000)]
+        FLAGS = Flags(*names)
+        registry = FlagRegistry()
+
+        def make_method(ix):
+            def method(data):
+                return data.get('F{}'.format(ix - 1), 0) + 1
+            return method
+
+        for ix in reversed(range(len(names))):
+            depends_on = getattr(FLAGS, names[ix - 1]) if ix else 0
+            registry.register(flag=getattr(FLAGS, names[ix]), depends_on=depends_on, key=names[ix])(make_method(ix))
+
+        result = registry.build_out(getattr(FLAGS, names[-1]), pass_datastructure=True)
+        self.assertEqual(len(result), len(names))
+        self.assertEqual(result[names[-1]], len(names))
+
+    @unittest.skipIf(not hasattr(threading, 'Barrier'), 'threading.Barrier is Python 3 only')
+    def test_first_build_out_from_threads(self):
+        import sys
+        import threading
+
+        names = ['F{}'.format(i) for i in range(300)]
+        FLAGS = Flags(*names)
+        errors = list()
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            for _ in range(10):
+                registry = FlagRegistry()
+                for ix in range(len(names)):
+                    depends_on = getattr(FLAGS, names[ix - 1]) if ix else 0
+                    registry.register(
+                        flag=getattr(FLAGS, names[ix]), depends_on=depends_on, key=names[ix])(lambda data=None: None)
+
+                # Every thread compiles its plan while the others may still be calculating the dependency flags.
+                barrier = threading.Barrier(8, timeout=5)
+
+                def build():
+                    barrier.wait()
+                    try:
+                        registry.build_out(FLAGS.ALL, pass_datastructure=True)
+                    except Exception as e:
+                        errors.append(e)
+
+                threads = [threading.Thread(target=build) for _ in range(8)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+        finally:
+            sys.setswitchinterval(interval)
+        self.assertEqual(errors, [])
+
+    @unittest.skipIf(not hasattr(threading, 'Barrier'), 'threading.Barrier is Python 3 only')
+    def test_build_out_concurrent(self):
+        import threading
+        from collections import OrderedDict
+        from concurrent.futures import ThreadPoolExecutor
+
+        FLAGS = Flags('BASE', 'LISTENERS', 'RULES', 'TAGS')
+        registry = FlagRegistry()
+        # Both independent methods have to be running at the same time to get past the barrier.
+        barrier = threading.Barrier(2, timeout=5)
+
+        @registry.register(flag=FLAGS.BASE)
+        def get_base(alb):
+            barrier.wait()
+            return dict(arn=alb['Arn'])
+
+        @registry.register(flag=FLAGS.LISTENERS, key='listeners')
+        def get_listeners(alb):
+            barrier.wait()
+            return ['{}/listener'.format(alb['Arn'])]
+
+        @registry.register(flag=FLAGS.RULES, depends_on=FLAGS.LISTENERS, key='rules')
+        def get_rules(data, alb):
+            return [listener + '/rule' for listener in data['listeners']]
+
+        @registry.register(flag=FLAGS.TAGS, key='tags')
+        def get_tags(alb):
+            return dict(name='lb')
+
+        alb = dict(Arn='arn')
+        expected = dict(
+            arn='arn', listeners=['arn/listener'], rules=['arn/listener/rule'], tags=dict(name='lb'))
+
+        result = registry.build_out(FLAGS.ALL, alb, max_workers=4)
+        self.assertEqual(result, expected)
+
+        # Return values are merged in plan order; an OrderedDict shows it on interpreters whose dicts do not.
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            result = registry.build_out(FLAGS.ALL, alb, executor=executor, start_with=OrderedDict(hello='world'))
+        self.assertEqual(list(result.keys()), ['hello', 'arn', 'listeners', 'rules', 'tags'])
+
+    def test_build_out_concurrent_positional_result(self):
+        FLAGS = Flags('BASE', 'LISTENERS', 'RULES', 'TAGS')
+        registry = FlagRegistry()
+
+        @registry.register(flag=FLAGS.BASE)
+        def get_base(alb):
+            return dict(region='us-east-1')
+
+        @registry.register(flag=FLAGS.LISTENERS, key='listeners')
+        def get_listeners(alb):
+            return ['{}/listener'.format(alb['Arn'])]
+
+        # The result is passed positionally, so the method reads what get_listeners returned from it.
+        @registry.register(flag=FLAGS.RULES, depends_on=FLAGS.LISTENERS, key='rules')
+        def get_rules(alb):
+            return [listener + '/rule' for listener in alb['listeners']]
+
+        @registry.register(flag=FLAGS.TAGS, key='tags')
+        def get_tags(alb):
+            return dict(name='lb')
+
+        expected = dict(
+            Arn='arn', region='us-east-1', listeners=['arn/listener'], rules=['arn/listener/rule'], tags=dict(name='lb'))
+        alb = dict(Arn='arn')
+        self.assertIs(registry.build_out(FLAGS.ALL, alb, start_with=alb, max_workers=2), alb)
+        self.assertEqual(alb, expected)
+
+        alb = dict(Arn='arn')
+        items = dict(registry.build_out_iter(FLAGS.RULES, alb, start_with=alb, max_workers=2))
+        self.assertEqual(items, dict(listeners=['arn/listener'], rules=['arn/listener/rule']))
+
+    def test_critical_path(self):
+        FLAGS = Flags('TAGS', 'LISTENERS', 'RULES')
+        registry = FlagRegistry()
+        calls = list()
+
+        @registry.register(flag=FLAGS.TAGS, key='tags')
+        def get_tags():
+            calls.append('tags')
+
+        @registry.register(flag=FLAGS.LISTENERS, key='listeners')
+        def get_listeners():
+            calls.append('listeners')
+
+        @registry.register(flag=FLAGS.RULES, depends_on=FLAGS.LISTENERS, key='rules')
+        def get_rules(data):
+            calls.append('rules')
+
+        # Nothing measured yet: the longer chain goes first.
+        registry.build_out(FLAGS.ALL, max_workers=1)
+        self.assertEqual(calls, ['listeners', 'tags', 'rules'])
+        self.assertEqual(len(registry.latencies), 3)
+
+        # A slow method goes before a chain of quick ones.
+        del calls[:]
+        registry.latencies.seed({get_tags: 5.0, get_listeners: 1.0, get_rules: 1.0})
+        registry.build_out(FLAGS.ALL, max_workers=1)
+        self.assertEqual(calls, ['tags', 'listeners', 'rules'])
+
+        # Estimates can be saved and loaded by name.
+        other = FlagRegistry()
+        other.latencies.seed(registry.latencies.to_dict())
+        self.assertEqual(other.latencies.estimate(get_tags), registry.latencies.estimate(get_tags))
+
+    def test_build_out_concurrent_error(self):
+        FLAGS = Flags('ONE', 'TWO')
+        registry = FlagRegistry()
+        called = list()
+
+        @registry.register(flag=FLAGS.ONE, key='one')
+        def method_one():
+            raise ValueError('boom')
+
+        @registry.register(flag=FLAGS.TWO, depends_on=FLAGS.ONE, key='two')
+        def method_two(data):
+            called.append(True)
+
+        with self.assertRaises(ValueError):
+            registry.build_out(FLAGS.ALL, max_workers=2)
+        self.assertEqual(called, [])
+
+    def test_build_out_many(self):
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+        FLAGS = Flags('BASE', 'NAME')
+        registry = FlagRegistry()
+        lock = threading.Lock()
+        in_flight = [0, 0]
+
+        @registry.register(flag=FLAGS.BASE, key='arn')
+        def get_base(alb):
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight)
+            with lock:
+                in_flight[0] -= 1
+            return alb['Arn']
+
+        @registry.register(flag=FLAGS.NAME, depends_on=FLAGS.BASE, key='name')
+        def get_name(data, *args):
+            return data['arn'].split('/')[-1]
+
+        read = list()
+
+        def albs():
+            for ix in range(50):
+                read.append(ix)
+                yield dict(Arn='arn/{}'.format(ix))
+
+        results = registry.build_out_many(FLAGS.NAME, albs(), max_workers=2)
+        first = next(results)
+        self.assertEqual(first, dict(arn='arn/0', name='0'))
+        # Items are only read as fast as the window allows.
+        self.assertTrue(len(read) <= 5)
+
+        rest = list(results)
+        self.assertEqual([result['name'] for result in rest], [str(ix) for ix in range(1, 50)])
+        self.assertTrue(in_flight[1] <= 2)
+
+        # Items as the starting dictionary, results in completion order.
+        results = registry.build_out_many(
+            FLAGS.NAME, albs(), start_with_items=True, pass_datastructure=True, ordered=False, window=3)
+        self.assertEqual(
+            sorted(result['name'] for result in results), sorted(str(ix) for ix in range(50)))
+
+        # With an executor and no max_workers, the window follows the executor's workers.
+        del read[:]
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            results = registry.build_out_many(FLAGS.NAME, albs(), executor=executor, max_workers=None)
+            self.assertEqual(next(results), dict(arn='arn/0', name='0'))
+            self.assertTrue(len(read) <= 5)
+            self.assertEqual(len(list(results)), 49)
+
+    def test_batch_size(self):
+        FLAGS = Flags('BASE', 'TAGS', 'RULES')
+        registry = FlagRegistry()
+        batches = list()
+
+        @registry.register(flag=FLAGS.BASE, key='arn')
+        def get_base(alb, region=None):
+            return alb['Arn']
+
+        @registry.register(flag=FLAGS.TAGS, key='tags', batch_size=4)
+        def get_tags(albs, region=None):
+            batches.append(len(albs))
+            return [dict(region=region, name=alb['Arn']) for alb in albs]
+
+        @registry.register(flag=(FLAGS.RULES, FLAGS.BASE), key=('rules', 'arn_again'), depends_on=FLAGS.TAGS, batch_size=8)
+        def get_rules(datas, *args, **kwargs):
+            batches.append(len(datas))
+            return [(data['tags']['name'] + '/rule', data['arn']) for data in datas]
+
+        albs = [dict(Arn='arn/{}'.format(ix)) for ix in range(10)]
+        results = list(registry.build_out_many(FLAGS.ALL, albs, region='us-east-1', window=10))
+        self.assertEqual(len(results), 10)
+        self.assertEqual(results[3], dict(
+            arn='arn/3', tags=dict(region='us-east-1', name='arn/3'), rules='arn/3/rule', arn_again='arn/3'))
+        self.assertEqual(sorted(batches), [2, 2, 4, 4, 8])
+
+        # build_out calls batch methods with a list of one.
+        del batches[:]
+        result = registry.build_out(FLAGS.ALL, albs[0], region='us-east-1')
+        self.assertEqual(result['rules'], 'arn/0/rule')
+        self.assertEqual(batches, [1, 1])
+
+        # Items are gathered for a whole batch, even past the default window of 16.
+        registry = FlagRegistry()
+
+        @registry.register(flag=FLAGS.TAGS, key='tags', batch_size=20)
+        def get_tags(albs, region=None):
+            batches.append(len(albs))
+            return [dict(region=region, name=alb['Arn']) for alb in albs]
+
+        del batches[:]
+        albs = [dict(Arn='arn/{}'.format(ix)) for ix in range(45)]
+        self.assertEqual(len(list(registry.build_out_many(FLAGS.TAGS, albs))), 45)
+        self.assertEqual(batches, [20, 20, 5])
+
+    def test_batch_size_options(self):
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+        from flagpole import TTLCache
+        FLAGS = Flags('TAGS')
+        registry = FlagRegistry()
+
+        for options in (dict(cache=TTLCache()), dict(coalesce=True), dict(persist=60)):
+            with self.assertRaises(ValueError):
+                registry.register(flag=FLAGS.TAGS, key='tags', batch_size=4, **options)
+        self.assertEqual(len(registry.r), 0)
+
+        threads = list()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            @registry.register(flag=FLAGS.TAGS, key='tags', batch_size=4, executor=executor)
+            def get_tags(albs):
+                threads.append(threading.current_thread())
+                return [alb.upper() for alb in albs]
+
+            results = list(registry.build_out_many(FLAGS.ALL, ['a', 'b', 'c']))
+            # The executor's only worker.
+            worker = executor.submit(threading.current_thread).result()
+        self.assertEqual(results, [dict(tags='A'), dict(tags='B'), dict(tags='C')])
+        self.assertEqual(threads, [worker])
+
+    def test_cache(self):
+        from flagpole import TTLCache
+        FLAGS = Flags('GRANTS', 'OWNER', 'POLICY')
+        registry = FlagRegistry()
+        calls = list()
+        grants_cache = TTLCache(maxsize=4, ttl=60)
+
+        @registry.register(flag=(FLAGS.GRANTS, FLAGS.OWNER), key=('grants', 'owner'), cache=grants_cache)
+        def get_grants(bucket_name, **conn):
+            calls.append(bucket_name)
+            return ['{}-grant'.format(bucket_name)], 'owner-{}'.format(conn['account_number'])
+
+        @registry.register(flag=FLAGS.POLICY, depends_on=FLAGS.OWNER, key='policy',
+                           cache=TTLCache(key=lambda bucket_name, **conn: conn['account_number']))
+        def get_policy(data, bucket_name, **conn):
+            calls.append('policy')
+            return 'policy-{}'.format(data['owner'])
+
+        expected = dict(grants=['a-grant'], owner='owner-123', policy='policy-owner-123')
+        self.assertEqual(registry.build_out(FLAGS.ALL, 'a', account_number='123'), expected)
+        self.assertEqual(registry.build_out(FLAGS.ALL, 'a', account_number='123'), expected)
+        self.assertEqual(calls, ['a', 'policy'])
+        self.assertEqual((grants_cache.hits, grants_cache.misses), (1, 1))
+
+        # Different bucket, same account: only the grants are fetched.
+        self.assertEqual(registry.build_out(FLAGS.POLICY, 'b', account_number='123'), dict(
+            owner='owner-123', policy='policy-owner-123'))
+        self.assertEqual(calls, ['a', 'policy', 'b'])
+
+        # A hit still only fills in the requested slots.
+        self.assertEqual(registry.build_out(FLAGS.GRANTS, 'a', account_number='123'), dict(grants=['a-grant']))
+        self.assertEqual(calls, ['a', 'policy', 'b'])
+
+    def test_coalesce(self):
+        import threading
+        import time
+        FLAGS = Flags('POLICY', 'TAGS')
+        registry = FlagRegistry()
+        release = threading.Event()
+        calls = list()
+
+        @registry.register(flag=FLAGS.POLICY, key='policy',
+                           coalesce=lambda bucket_name, **conn: conn['account_number'])
+        def get_policy(bucket_name, **conn):
+            calls.append(bucket_name)
+            release.wait()
+            return 'policy-{}'.format(conn['account_number'])
+
+        @registry.register(flag=FLAGS.TAGS, key='tags', coalesce=True)
+        def get_tags(bucket_name, **conn):
+            calls.append('tags')
+            return bucket_name
+
+        results = dict()
+
+        def build(bucket_name):
+            results[bucket_name] = registry.build_out(FLAGS.POLICY, bucket_name, account_number='123')
+
+        threads = [threading.Thread(target=build, args=(name,)) for name in ('a', 'b')]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, dict(a=dict(policy='policy-123'), b=dict(policy='policy-123')))
+
+        # Only calls in flight are shared.
+        self.assertEqual(registry.build_out(FLAGS.ALL, 'c', account_number='123'), dict(policy='policy-123', tags='c'))
+        self.assertEqual(calls[1:], ['c', 'tags'])
+
+    @unittest.skipIf(not hasattr(types, 'MappingProxyType'), 'read-only views need types.MappingProxyType')
+    def test_copy_datastructure(self):
+        FLAGS = Flags('ONE', 'TWO', 'THREE')
+        registry = FlagRegistry()
+        seen = list()
+
+        @registry.register(flag=FLAGS.ONE, key='one')
+        def method_one(data):
+            seen.append(type(data))
+            return 1
+
+        @registry.register(flag=FLAGS.TWO, depends_on=FLAGS.ONE, key='two')
+        def method_two(data):
+            return data['one'] + 1
+
+        @registry.register(flag=FLAGS.THREE, depends_on=FLAGS.TWO, key='three')
+        def method_three(data):
+            data['sneaky'] = True
+
+        result = registry.build_out(FLAGS.TWO, pass_datastructure=True, copy_datastructure=False)
+        self.assertEqual(result, dict(one=1, two=2))
+        self.assertNotEqual(seen[-1], dict)
+
+        # The view is read-only.
+        with self.assertRaises(TypeError):
+            registry.build_out(FLAGS.THREE, copy_datastructure=False)
+
+        # The default copy can be mutated without changing the result.
+        result = registry.build_out(FLAGS.THREE, pass_datastructure=True)
+        self.assertEqual(result, dict(one=1, two=2, three=None))
+        self.assertEqual(seen[-1], dict)
+
+    def test_build_out_lazy(self):
+        import json
+        import pickle
+        from flagpole import Record, Tracer
+        FLAGS = Flags('BASE', 'LISTENERS', 'RULES', 'TAGS')
+        registry = FlagRegistry()
+        calls = list()
+
+        @registry.register(flag=FLAGS.BASE)
+        def get_base(alb):
+            calls.append('base')
+            return dict(region='us-east-1')
+
+        @registry.register(flag=FLAGS.LISTENERS, key='listeners')
+        def get_listeners(alb):
+            calls.append('listeners')
+            return ['listener']
+
+        @registry.register(flag=FLAGS.RULES, depends_on=FLAGS.LISTENERS, key='rules')
+        def get_rules(data, alb):
+            calls.append('rules')
+            return [listener + '/rule' for listener in data['listeners']]
+
+        @registry.register(flag=FLAGS.TAGS, key='tags')
+        def get_tags(alb):
+            calls.append('tags')
+            return dict()
+
+        alb = dict(Arn='arn')
+        result = registry.build_out_lazy(FLAGS.ALL, alb, start_with=dict(name='lb'))
+        self.assertEqual(calls, [])
+
+        self.assertEqual(result['name'], 'lb')
+        self.assertEqual(calls, [])
+
+        self.assertEqual(result['rules'], ['listener/rule'])
+        self.assertEqual(calls, ['listeners', 'rules'])
+        self.assertEqual(result['listeners'], ['listener'])
+        self.assertEqual(calls, ['listeners', 'rules'])
+
+        # Keys without a registered key come from the keyless methods.
+        self.assertTrue('region' in result)
+        self.assertEqual(calls, ['listeners', 'rules', 'base'])
+        self.assertFalse('missing' in result)
+        with self.assertRaises(KeyError):
+            result['missing']
+
+        self.assertEqual([m.__name__ for m in result.pending()], ['get_tags'])
+        expected = dict(name='lb', region='us-east-1', listeners=['listener'], rules=['listener/rule'], tags=dict())
+        self.assertEqual(json.loads(json.dumps(result.to_dict())), expected)
+        self.assertEqual(calls, ['listeners', 'rules', 'base', 'tags'])
+
+        # Iterating and pickling fill in everything.
+        result = registry.build_out_lazy(FLAGS.RULES | FLAGS.TAGS, alb)
+        self.assertEqual(sorted(result), ['listeners', 'rules', 'tags'])
+        result = registry.build_out_lazy(FLAGS.TAGS, alb)
+        self.assertEqual(pickle.loads(pickle.dumps(result)), dict(tags=dict()))
+
+        # Builds into a record, but can't run methods elsewhere.
+        result = registry.build_out_lazy(FLAGS.RULES, alb, record=True)
+        self.assertEqual(result['rules'], ['listener/rule'])
+        self.assertTrue(isinstance(result.to_dict(), Record))
+        for kwargs in (dict(max_workers=4), dict(executor=object()), dict(tracer=Tracer())):
+            with self.assertRaises(ValueError):
+                registry.build_out_lazy(FLAGS.ALL, alb, **kwargs)
+
+    def test_build_out_iter(self):
+        import threading
+        from flagpole import INCOMPLETE
+        FLAGS = Flags('BASE', 'LISTENERS', 'RULES', 'SLOW')
+        registry = FlagRegistry()
+        release = threading.Event()
+        calls = list()
+
+        @registry.register(flag=FLAGS.BASE)
+        def get_base(alb):
+            calls.append('base')
+            return dict(region='us-east-1')
+
+        @registry.register(flag=FLAGS.LISTENERS, key='listeners')
+        def get_listeners(alb):
+            calls.append('listeners')
+            return ['listener']
+
+        @registry.register(flag=FLAGS.RULES, depends_on=FLAGS.LISTENERS, key='rules')
+        def get_rules(data, alb):
+            calls.append('rules')
+            return [listener + '/rule' for listener in data['listeners']]
+
+        @registry.register(flag=FLAGS.SLOW, key='slow', timeout=0.05)
+        def get_slow(alb):
+            release.wait(5)
+            return 'slow'
+
+        # Methods only run as the values are consumed.
+        items = registry.build_out_iter(FLAGS.RULES | FLAGS.BASE, 'alb')
+        self.assertEqual(next(items), (None, dict(region='us-east-1')))
+        self.assertEqual(calls, ['base'])
+        self.assertEqual(list(items), [('listeners', ['listener']), ('rules', ['listener/rule'])])
+
+        # Concurrently, values come back as the methods finish.
+        try:
+            items = list(registry.build_out_iter(FLAGS.ALL, 'alb', max_workers=4))
+        finally:
+            release.set()
+        self.assertEqual(sorted(items[:3], key=lambda item: item[0] or ''), [
+            (None, dict(region='us-east-1')), ('listeners', ['listener']), ('rules', ['listener/rule'])])
+        self.assertTrue(items.index(('listeners', ['listener'])) < items.index(('rules', ['listener/rule'])))
+        self.assertEqual(items[3:], [(INCOMPLETE, dict(flags=FLAGS.SLOW, keys=['slow']))])
+
+        # A timeout alone keeps them in plan order.
+        release.clear()
+        try:
+            items = list(registry.build_out_iter(FLAGS.ALL, 'alb'))
+        finally:
+            release.set()
+        self.assertEqual(items, [
+            (None, dict(region='us-east-1')), ('listeners', ['listener']), ('rules', ['listener/rule']),
+            (INCOMPLETE, dict(flags=FLAGS.SLOW, keys=['slow']))])
+
+    def test_freeze(self):
+        from flagpole import TTLCache
+
+        def make_registry():
+            FLAGS = Flags('BASE', 'LISTENERS', 'RULES', 'TAGS', 'OWNER')
+            registry = FlagRegistry()
+
+            @registry.register(flag=FLAGS.BASE)
+            def get_base(*args, **kwargs):
+                return dict(region='us-east-1', args=len(args))
+
+            @registry.register(flag=FLAGS.LISTENERS, key='listeners')
+            def get_listeners(*args, **kwargs):
+                return [kwargs.get('name', 'listener')]
+
+            @registry.register(flag=FLAGS.RULES, depends_on=FLAGS.LISTENERS | FLAGS.BASE, key='rules')
+            def get_rules(data, *args, **kwargs):
+                return [listener + '/rule' for listener in data['listeners']] + [data['region']]
+
+            @registry.register(flag=(FLAGS.TAGS, FLAGS.OWNER), key=('tags', 'owner'), cache=TTLCache())
+            def get_tags(*args, **kwargs):
+                return dict(), 'owner'
+
+            return registry, FLAGS
+
+        registry, FLAGS = make_registry()
+        frozen, _ = make_registry()
+        frozen.freeze(FLAGS.ALL)
+        with self.assertRaises(RuntimeError):
+            frozen.register(flag=FLAGS.BASE)
+
+        for flags in range(FLAGS.ALL + 1):
+            for kwargs in (dict(), dict(name='lb'), dict(pass_datastructure=True),
+                           dict(copy_datastructure=False), dict(start_with=dict(name='lb'))):
+                self.assertEqual(
+                    frozen.build_out(flags, 'alb', **dict(kwargs)), registry.build_out(flags, 'alb', **dict(kwargs)))
+
+        start_with = dict()
+        self.assertEqual(
+            frozen.build_out(FLAGS.RULES, start_with, start_with=start_with),
+            registry.build_out(FLAGS.RULES, dict(), start_with=dict()))
+        self.assertEqual(len(list(frozen.build_out_many(FLAGS.ALL, ['a', 'b']))), 2)
+
+    def test_refresh(self):
+        FLAGS = Flags('BASE', 'LISTENERS', 'RULES', 'TAGS', 'POLICY')
+        registry = FlagRegistry()
+        version = dict(listeners=1, rules=1, tags=1)
+        calls = list()
+
+        @registry.register(flag=FLAGS.BASE)
+        def get_base(alb):
+            calls.append('base')
+            return dict(region='us-east-1')
+
+        @registry.register(flag=FLAGS.LISTENERS, key='listeners')
+        def get_listeners(alb):
+            calls.append('listeners')
+            return ['listener-v{}'.format(version['listeners'])]
+
+        @registry.register(flag=FLAGS.RULES, depends_on=FLAGS.LISTENERS, key='rules')
+        def get_rules(data, alb):
+            calls.append('rules')
+            return [listener + '/rule-v{}'.format(version['rules']) for listener in data['listeners']]
+
+        @registry.register(flag=(FLAGS.TAGS, FLAGS.POLICY), key=('tags', 'policy'))
+        def get_tags(alb):
+            calls.append('tags')
+            return 'tags-v{}'.format(version['tags']), 'policy'
+
+        alb = dict(Arn='arn')
+        result = registry.build_out(FLAGS.ALL ^ FLAGS.POLICY, alb)
+        del calls[:]
+
+        # Refreshing RULES keeps the listeners it depends on.
+        version['rules'] = 2
+        self.assertIs(registry.refresh(result, FLAGS.RULES, alb), result)
+        self.assertEqual(calls, ['rules'])
+        self.assertEqual(result['rules'], ['listener-v1/rule-v2'])
+
+        # Refreshing LISTENERS also refreshes RULES, which depends on it.
+        version['listeners'] = 2
+        del calls[:]
+        registry.refresh(result, FLAGS.LISTENERS, alb)
+        self.assertEqual(calls, ['listeners', 'rules'])
+        self.assertEqual(result, dict(
+            region='us-east-1', listeners=['listener-v2'], rules=['listener-v2/rule-v2'], tags='tags-v1'))
+
+        # Missing dependencies are filled in.
+        del calls[:]
+        result = dict(Arn='arn')
+        registry.refresh(result, FLAGS.RULES, alb)
+        self.assertEqual(calls, ['listeners', 'rules'])
+        self.assertEqual(set(result.keys()), set(['Arn', 'listeners', 'rules']))
+
+    def test_pass_requested(self):
+        from flagpole import TTLCache
+        FLAGS = Flags('GRANTS', 'GRANT_REFERENCES', 'OWNER')
+        registry = FlagRegistry()
+        fetched = list()
+
+        @registry.register(
+            flag=(FLAGS.GRANTS, FLAGS.GRANT_REFERENCES, FLAGS.OWNER),
+            key=('grants', 'grant_references', 'owner'),
+            pass_requested=True, cache=TTLCache())
+        def get_grants(bucket_name, requested_flags=FLAGS.ALL):
+            grants = owner = None
+            if requested_flags & (FLAGS.GRANTS | FLAGS.GRANT_REFERENCES):
+                fetched.append('grants')
+                grants = ['grant']
+            if requested_flags & FLAGS.OWNER:
+                fetched.append('owner')
+                owner = 'owner'
+            return grants, grants, owner
+
+        self.assertEqual(registry.build_out(FLAGS.OWNER, 'bucket'), dict(owner='owner'))
+        self.assertEqual(fetched, ['owner'])
+
+        # The cached OWNER-only call is not served for GRANTS.
+        self.assertEqual(
+            registry.build_out(FLAGS.ALL, 'bucket'),
+            dict(grants=['grant'], grant_references=['grant'], owner='owner'))
+        self.assertEqual(fetched, ['owner', 'grants', 'owner'])
+        registry.build_out(FLAGS.OWNER, 'bucket')
+        self.assertEqual(len(fetched), 3)
+
+    def test_timeouts(self):
+        import threading
+        from flagpole import INCOMPLETE
+        FLAGS = Flags('BASE', 'LISTENERS', 'RULES', 'TAGS')
+        registry = FlagRegistry()
+        release = threading.Event()
+
+        @registry.register(flag=FLAGS.BASE, key='base')
+        def get_base():
+            return 'base'
+
+        @registry.register(flag=FLAGS.LISTENERS, key='listeners', timeout=0.05)
+        def get_listeners():
+            release.wait(5)
+            return ['listener']
+
+        @registry.register(flag=FLAGS.RULES, depends_on=FLAGS.LISTENERS, key='rules')
+        def get_rules(data):
+            return ['rule']
+
+        @registry.register(flag=FLAGS.TAGS, key='tags')
+        def get_tags():
+            return dict()
+
+        try:
+            result = registry.build_out(FLAGS.ALL)
+        finally:
+            release.set()
+        self.assertEqual(result, {
+            'base': 'base', 'tags': dict(),
+            INCOMPLETE: dict(flags=FLAGS.LISTENERS | FLAGS.RULES, keys=['listeners', 'rules'])})
+
+        # Without the slow method, nothing is marked.
+        self.assertEqual(registry.build_out(FLAGS.BASE | FLAGS.TAGS), dict(base='base', tags=dict()))
+
+    def test_timeouts_stay_sequential(self):
+        import threading
+        FLAGS = Flags('BASE', 'LISTENERS', 'RULES', 'TAGS')
+        registry = FlagRegistry()
+        threads = set()
+
+        @registry.register(flag=FLAGS.BASE)
+        def get_base(alb):
+            threads.add(threading.current_thread())
+            return dict(region='us-east-1')
+
+        @registry.register(flag=FLAGS.LISTENERS, key='listeners', timeout=5)
+        def get_listeners(alb):
+            return ['{}/listener'.format(alb['Arn'])]
+
+        # The result is passed positionally, so the method reads what get_listeners returned from it.
+        @registry.register(flag=FLAGS.RULES, depends_on=FLAGS.LISTENERS, key='rules')
+        def get_rules(alb):
+            threads.add(threading.current_thread())
+            return [listener + '/rule' for listener in alb['listeners']]
+
+        # Doesn't depend on get_base, but runs after it in plan order and sees its keys.
+        @registry.register(flag=FLAGS.TAGS, key='tags')
+        def get_tags(alb):
+            threads.add(threading.current_thread())
+            return dict(region=alb['region'])
+
+        alb = dict(Arn='arn')
+        self.assertIs(registry.build_out(FLAGS.ALL, alb, start_with=alb), alb)
+        self.assertEqual(alb, dict(
+            Arn='arn', region='us-east-1', listeners=['arn/listener'], rules=['arn/listener/rule'],
+            tags=dict(region='us-east-1')))
+        # Only the method with a timeout left the calling thread.
+        self.assertEqual(threads, set([threading.current_thread()]))
+
+        # Same under a deadline, where every method can run out of time.
+        alb = dict(Arn='arn')
+        self.assertEqual(registry.build_out(FLAGS.ALL, alb, start_with=alb, deadline=5)['rules'], ['arn/listener/rule'])
+
+    def test_deadline(self):
+        import threading
+        from flagpole import INCOMPLETE
+        FLAGS = Flags('FAST', 'SLOW')
+        registry = FlagRegistry()
+        release = threading.Event()
+
+        @registry.register(flag=FLAGS.FAST, key='fast')
+        def get_fast():
+            return 'fast'
+
+        @registry.register(flag=FLAGS.SLOW, key='slow')
+        def get_slow():
+            release.wait(5)
+            return 'slow'
+
+        try:
+            result = registry.build_out(FLAGS.ALL, deadline=0.05)
+        finally:
+            release.set()
+        self.assertEqual(result, {'fast': 'fast', INCOMPLETE: dict(flags=FLAGS.SLOW, keys=['slow'])})
+        self.assertEqual(registry.build_out(FLAGS.ALL, deadline=5), dict(fast='fast', slow='slow'))
+
+    def test_timeouts_outside_build_out(self):
+        import threading
+        from flagpole import INCOMPLETE
+        FLAGS = Flags('BASE', 'LISTENERS', 'RULES')
+        registry = FlagRegistry()
+        release = threading.Event()
+        slow = set(['a'])
+
+        @registry.register(flag=FLAGS.BASE, key='base')
+        def get_base(alb):
+            return alb
+
+        @registry.register(flag=FLAGS.LISTENERS, key='listeners', timeout=0.05)
+        def get_listeners(alb):
+            if alb in slow:
+                release.wait(5)
+            return ['listener']
+
+        @registry.register(flag=FLAGS.RULES, depends_on=FLAGS.LISTENERS, key='rules')
+        def get_rules(data, alb):
+            return ['rule']
+
+        try:
+            results = list(registry.build_out_many(FLAGS.ALL, ['a', 'b'], max_workers=2))
+        finally:
+            release.set()
+        self.assertEqual(results, [
+            {'base': 'a', INCOMPLETE: dict(flags=FLAGS.LISTENERS | FLAGS.RULES, keys=['listeners', 'rules'])},
+            dict(base='b', listeners=['listener'], rules=['rule'])])
+
+        # Refreshing the abandoned methods clears the mark.
+        slow.clear()
+        result = registry.refresh(results[0], FLAGS.LISTENERS, 'a')
+        self.assertEqual(result, dict(base='a', listeners=['listener'], rules=['rule']))
+
+        # Unless they are abandoned again.
+        release.clear()
+        slow.add('a')
+        try:
+            result = registry.refresh(result, FLAGS.LISTENERS, 'a')
+        finally:
+            release.set()
+        self.assertEqual(result[INCOMPLETE], dict(flags=FLAGS.LISTENERS | FLAGS.RULES, keys=['listeners', 'rules']))
+
+        with self.assertRaises(ValueError):
+            registry.build_out_lazy(FLAGS.ALL, 'a')
+        with self.assertRaises(ValueError):
+            registry.build_out_lazy(FLAGS.BASE, 'a', deadline=5)
+        self.assertEqual(registry.build_out_lazy(FLAGS.BASE, 'a')['base'], 'a')
+
+    def test_deadline_outside_build_out(self):
+        import threading
+        from flagpole import INCOMPLETE
+        FLAGS = Flags('FAST', 'SLOW')
+        registry = FlagRegistry()
+        release = threading.Event()
+
+        @registry.register(flag=FLAGS.FAST, key='fast')
+        def get_fast(item):
+            return 'fast'
+
+        @registry.register(flag=FLAGS.SLOW, key='slow')
+        def get_slow(item):
+            release.wait(5)
+            return 'slow'
+
+        try:
+            results = list(registry.build_out_many(FLAGS.ALL, ['a', 'b'], deadline=0.05))
+            result = registry.refresh(dict(fast='old', slow='old'), FLAGS.ALL, 'a', deadline=0.05)
+        finally:
+            release.set()
+        incomplete = {'fast': 'fast', INCOMPLETE: dict(flags=FLAGS.SLOW, keys=['slow'])}
+        self.assertEqual(results, [incomplete, incomplete])
+        # An abandoned method's key keeps its earlier value.
+        self.assertEqual(result, dict(incomplete, slow='old'))
+
+        @registry.register(flag=FLAGS.FAST, key='tags', batch_size=10)
+        def get_tags(items):
+            return [dict() for _ in items]
+
+        with self.assertRaises(ValueError):
+            registry.build_out_many(FLAGS.ALL, ['a'], deadline=5)
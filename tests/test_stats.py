@@ -0,0 +1,95 @@
+import unittest
+from flagpole import Flags, FlagRegistry, MethodStats, Observer, TTLCache
+
+
+class Recorder(Observer):
+    def __init__(self):
+        self.events = list()
+
+    def on_method_start(self, method, flag, keys):
+        self.events.append(('start', method.__name__, flag, keys))
+
+    def on_method_end(self, method, flag, keys, elapsed):
+        self.events.append(('end', method.__name__, flag, keys))
+
+    def on_method_error(self, method, flag, keys, elapsed, error):
+        self.events.append(('error', method.__name__, flag, keys, str(error)))
+
+    def on_method_skip(self, method, flag, keys, reason):
+        self.events.append(('skip', method.__name__, flag, keys, reason))
+
+
+class TestStats(unittest.TestCase):
+
+    def setUp(self):
+        self.FLAGS = FLAGS = Flags('PETS', 'FARM', 'BROKEN')
+        self.registry = registry = FlagRegistry()
+
+        @registry.register(flag=(FLAGS.PETS, FLAGS.FARM), key=('pets', 'farm'), cache=TTLCache())
+        def get_animals():
+            return 'cat', 'pig'
+
+        @registry.register(flag=FLAGS.BROKEN, key='broken')
+        def get_broken():
+            raise ValueError('broken')
+
+    def test_observer(self):
+        FLAGS = self.FLAGS
+        recorder = Recorder()
+        self.registry.add_observer(recorder)
+
+        self.registry.build_out(FLAGS.PETS)
+        self.registry.build_out(FLAGS.ALL ^ FLAGS.BROKEN)
+        with self.assertRaises(ValueError):
+            self.registry.build_out(FLAGS.BROKEN)
+
+        self.assertEqual(recorder.events, [
+            ('start', 'get_animals', FLAGS.PETS | FLAGS.FARM, ('pets',)),
+            ('end', 'get_animals', FLAGS.PETS | FLAGS.FARM, ('pets',)),
+            ('skip', 'get_animals', FLAGS.PETS | FLAGS.FARM, ('pets', 'farm'), 'cache'),
+            ('start', 'get_broken', FLAGS.BROKEN, ('broken',)),
+            ('error', 'get_broken', FLAGS.BROKEN, ('broken',), 'broken')])
+
+        self.registry.remove_observer(recorder)
+        self.registry.build_out(FLAGS.PETS)
+        self.assertEqual(len(recorder.events), 5)
+
+    def test_method_stats(self):
+        FLAGS = self.FLAGS
+        stats = MethodStats(max_samples=4)
+        self.registry.add_observer(stats)
+
+        for _ in range(10):
+            self.registry.build_out(FLAGS.PETS)
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                self.registry.build_out(FLAGS.BROKEN)
+
+        summary = stats.summary()
+        self.assertEqual(
+            (summary['get_animals']['calls'], summary['get_animals']['skips'], summary['get_animals']['errors']),
+            (1, 9, 0))
+        self.assertEqual(
+            (summary['get_broken']['calls'], summary['get_broken']['skips'], summary['get_broken']['errors']),
+            (2, 0, 2))
+        self.assertTrue(summary['get_broken']['p50'] <= summary['get_broken']['p99'])
+        self.assertEqual(stats.percentile(FLAGS, 50), None)
+
+        stats.reset()
+        self.assertEqual(stats.summary(), dict())
+
+    def test_latency_estimates(self):
+        from flagpole import LatencyEstimates
+        estimates = LatencyEstimates(alpha=0.5)
+        get_animals = list(self.registry.r.keys())[0]
+        self.assertEqual(estimates.estimate(get_animals), None)
+        self.assertEqual(estimates.estimate(get_animals, default=1.0), 1.0)
+
+        estimates.update(get_animals, 2.0)
+        estimates.update(get_animals, 4.0)
+        self.assertEqual(estimates.estimate(get_animals), 3.0)
+        self.assertEqual(list(estimates.to_dict().values()), [3.0])
+        self.assertTrue(list(estimates.to_dict())[0].endswith('get_animals'))
+
+        estimates.reset()
+        self.assertEqual(len(estimates), 0)
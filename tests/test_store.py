@@ -0,0 +1,120 @@
+import os
+import shutil
+import tempfile
+import unittest
+from flagpole import Flags, FlagRegistry, SQLiteStore
+from flagpole import store as store_module
+
+
+class TestSQLiteStore(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'results.db')
+        self.now = 1000.0
+        self._now = store_module._now
+        store_module._now = lambda: self.now
+
+    def tearDown(self):
+        store_module._now = self._now
+        shutil.rmtree(self.dir)
+
+    def test_batching(self):
+        store = SQLiteStore(self.path, batch_size=3, flush_interval=60)
+        store.put('m', 'a', 1, dict(a=1))
+        store.put('m', 'b', 1, dict(b=2), ttl=10)
+
+        # Buffered entries are served, but not written yet.
+        self.assertEqual(store.get('m', 'a', 1), (True, dict(a=1)))
+        other = SQLiteStore(self.path)
+        self.assertEqual(other.get('m', 'a', 1), (False, None))
+
+        store.put('m', 'c', 1, [3])
+        self.assertEqual(other.get('m', 'a', 1), (True, dict(a=1)))
+        self.assertEqual(other.get('m', 'a', 2), (False, None))
+        self.assertEqual((other.hits, other.misses), (1, 2))
+
+        self.now += 11
+        self.assertEqual(store.get('m', 'b', 1), (False, None))
+        self.assertEqual(store.purge(), 1)
+        self.assertEqual(len(store), 2)
+        store.close()
+        other.close()
+
+    def test_build_out(self):
+        FLAGS = Flags('POLICY', 'TAGS')
+        calls = list()
+
+        def make_registry():
+            registry = FlagRegistry()
+            registry.store = SQLiteStore(self.path)
+
+            @registry.register(flag=FLAGS.POLICY, key='policy', persist=60)
+            def get_policy(bucket_name, **conn):
+                calls.append('policy')
+                return 'policy-{}'.format(bucket_name)
+
+            @registry.register(flag=FLAGS.TAGS, key='tags')
+            def get_tags(bucket_name, **conn):
+                calls.append('tags')
+                return dict()
+
+            return registry
+
+        registry = make_registry()
+        expected = dict(policy='policy-a', tags=dict())
+        self.assertEqual(registry.build_out(FLAGS.ALL, 'a', account_number='123'), expected)
+        registry.store.close()
+
+        # A new process starts warm.
+        registry = make_registry()
+        self.assertEqual(registry.build_out(FLAGS.ALL, 'a', account_number='123'), expected)
+        self.assertEqual(calls, ['policy', 'tags', 'tags'])
+        self.assertEqual(registry.build_out(FLAGS.POLICY, 'b', account_number='123'), dict(policy='policy-b'))
+        self.assertEqual(calls[-1], 'policy')
+
+        # Until the entries expire.
+        self.now += 61
+        self.assertEqual(registry.build_out(FLAGS.POLICY, 'a', account_number='123'), dict(policy='policy-a'))
+        self.assertEqual(calls, ['policy', 'tags', 'tags', 'policy', 'policy'])
+        registry.store.close()
+
+    def test_persist_key(self):
+        FLAGS = Flags('POLICY', 'TAGS')
+        calls = list()
+
+        class Client(object):
+            pass
+
+        registry = FlagRegistry()
+        registry.store = SQLiteStore(self.path)
+
+        @registry.register(
+            flag=FLAGS.POLICY, key='policy', persist=60,
+            persist_key=lambda bucket_name, **conn: (conn['account_number'], bucket_name) if bucket_name else None)
+        def get_policy(bucket_name, **conn):
+            calls.append(bucket_name)
+            return 'policy-{}'.format(bucket_name)
+
+        @registry.register(flag=FLAGS.TAGS, key='tags', persist=60)
+        def get_tags(bucket_name, **conn):
+            return dict()
+
+        # Only the keyed arguments count, so a new client still hits.
+        self.assertEqual(registry.build_out(FLAGS.POLICY, 'a', account_number='123', client=Client()),
+                         dict(policy='policy-a'))
+        self.assertEqual(registry.build_out(FLAGS.POLICY, 'a', account_number='123', client=Client()),
+                         dict(policy='policy-a'))
+        self.assertEqual(calls, ['a'])
+
+        # A None key is not persisted.
+        registry.build_out(FLAGS.POLICY, '', account_number='123')
+        registry.build_out(FLAGS.POLICY, '', account_number='123')
+        self.assertEqual(calls, ['a', '', ''])
+
+        # Without a persist_key, arguments which can't be keyed across processes are rejected.
+        with self.assertRaises(TypeError):
+            registry.build_out(FLAGS.TAGS, 'a', client=Client())
+        with self.assertRaises(TypeError):
+            registry.build_out(FLAGS.TAGS, 'a', regions=['us-east-1'])
+        registry.store.close()
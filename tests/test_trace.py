@@ -0,0 +1,82 @@
+import json
+import time
+import unittest
+from flagpole import Flags, FlagRegistry, Tracer
+
+
+class TestTracer(unittest.TestCase):
+
+    def setUp(self):
+        self.FLAGS = FLAGS = Flags('BASE', 'LISTENERS', 'RULES')
+        self.registry = registry = FlagRegistry()
+
+        @registry.register(flag=FLAGS.BASE)
+        def get_base(alb):
+            return dict(arn=alb)
+
+        @registry.register(flag=FLAGS.LISTENERS, key='listeners')
+        def get_listeners(alb):
+            time.sleep(0.01)
+            return ['listener']
+
+        @registry.register(flag=FLAGS.RULES, depends_on=FLAGS.LISTENERS, key='rules')
+        def get_rules(data, alb):
+            return ['rule']
+
+    def test_spans(self):
+        tracer = Tracer()
+        self.registry.build_out(self.FLAGS.ALL, 'a', tracer=tracer)
+        self.registry.build_out(self.FLAGS.ALL, 'b', max_workers=2, tracer=tracer)
+        self.assertEqual(len(tracer.spans), 6)
+
+        by_item = dict()
+        for span in tracer.spans:
+            by_item.setdefault(span.item, dict())[span.method] = span
+        self.assertEqual(sorted(by_item), [0, 1])
+        for spans in by_item.values():
+            rules = spans['get_rules']
+            self.assertEqual(rules.keys, ('rules',))
+            self.assertEqual(rules.flag, self.FLAGS.RULES)
+            self.assertEqual(rules.requires, ('get_listeners',))
+            self.assertEqual(rules.ready, spans['get_listeners'].end)
+            self.assertTrue(rules.dependency_wait >= 0.01)
+            self.assertTrue(rules.queue_wait >= 0)
+            self.assertEqual(spans['get_base'].dependency_wait, 0)
+
+        trace = json.loads(json.dumps(tracer.to_chrome_trace()))
+        slices = [event for event in trace['traceEvents'] if event['ph'] == 'X']
+        self.assertEqual(sorted(event['name'] for event in slices), sorted(['get_base', 'get_listeners', 'get_rules'] * 2))
+        self.assertEqual(len([event for event in trace['traceEvents'] if event['ph'] == 's']), 2)
+
+        folded = dict(line.rsplit(' ', 1) for line in tracer.to_folded().splitlines())
+        self.assertTrue('build_out;get_listeners;get_rules' in folded)
+        self.assertTrue(int(folded['build_out;get_listeners']) >= 20000)
+
+        # With one worker, get_base waits for get_listeners.  The wait is a frame of its own, beside get_base.
+        queued = Tracer()
+        self.registry.build_out(self.FLAGS.ALL, 'c', max_workers=1, tracer=queued)
+        folded = dict(line.rsplit(' ', 1) for line in queued.to_folded().splitlines())
+        self.assertTrue(int(folded['build_out;[queued] get_base']) >= 5000)
+        self.assertFalse([stack for stack in folded if '[queued];' in stack])
+
+        tracer.clear()
+        self.assertEqual(tracer.to_chrome_trace()['traceEvents'], [])
+
+    def test_errors(self):
+        FLAGS = Flags('ONE', 'TWO')
+        registry = FlagRegistry()
+
+        @registry.register(flag=FLAGS.ONE, key='one')
+        def method_one():
+            return 1
+
+        @registry.register(flag=FLAGS.TWO, key='two')
+        def method_two():
+            raise ValueError('broken')
+
+        tracer = Tracer()
+        self.assertEqual(registry.build_out(FLAGS.ONE, tracer=tracer), dict(one=1))
+        with self.assertRaises(ValueError):
+            registry.build_out(FLAGS.TWO, tracer=tracer)
+        self.assertEqual([(span.method, span.error is None) for span in tracer.spans], [
+            ('method_one', True), ('method_two', False)])